@@ -0,0 +1,73 @@
+"""
+Conditional GET benchmark: compares a full item feed request with a poll that revalidates it with `If-None-Match`
+and is answered `304 Not Modified` from the version stamps, without building the feed.
+
+Run from the project root against a database with data, with the access token of an existing user:
+
+    DJANGO_SETTINGS_MODULE=swapp_api.settings python benchmarks/conditional_get.py --token <token> --runs 20
+
+`--path` measures another polled list instead, e.g. `/transaction/notifications/{token}/`.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(client, path, runs, headers):
+    timings = []
+    response = None
+
+    for i in range(runs):
+        started = time.time()
+        response = client.get(path, **headers)
+        timings.append(time.time() - started)
+
+    return sorted(timings), response
+
+
+def report(label, timings, response):
+    sys.stdout.write("{:<12} status {}  min {:8.1f}ms  median {:8.1f}ms  max {:8.1f}ms\n".format(
+        label,
+        response.status_code,
+        timings[0]*1000,
+        timings[len(timings)//2]*1000,
+        timings[-1]*1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument('--token', required=True, help="access token of the user whose feed is polled")
+    parser.add_argument('--path', default='/item/entry/list/{token}/')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--host', default='localhost')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swapp_api.settings')
+
+    import django
+    django.setup()
+
+    from django.test import Client
+
+    client = Client(HTTP_HOST=args.host)
+    path = "{}?identifier={}".format(args.path.format(token=args.token), args.token)
+
+    timings, response = measure(client, path, args.runs, {})
+    report("full", timings, response)
+
+    etag = response.get('ETag')
+
+    if not etag:
+        sys.stdout.write("No ETag in the response; nothing to revalidate\n")
+        return
+
+    timings, response = measure(client, path, args.runs, {'HTTP_IF_NONE_MATCH': etag})
+    report("revalidated", timings, response)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Push throughput benchmark: compares sending notifications one at a time on the caller's thread, with a new
+connection and an error check each, as `device.send_message` did, with queueing them on the batched push queue.
+
+Runs offline against a local fake APNS endpoint; run from the project root:
+
+    DJANGO_SETTINGS_MODULE=swapp_api.settings python benchmarks/push_throughput.py --messages 2000
+
+`--error-timeout` is the time waited for an APNS error response, by every direct send and by the queue once it is
+empty.
+"""
+import argparse
+import os
+import select
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def tokens(count):
+    return ["{:064x}".format(i) for i in range(count)]
+
+
+def send_directly(server, count, error_timeout):
+    from push_notifications.apns import _apns_send
+
+    caller = []
+    started = time.time()
+
+    for token in tokens(count):
+        call_started = time.time()
+        connection = server.connect()
+
+        try:
+            _apns_send(token, "Benchmark", badge=1, socket=connection)
+            # The same wait for an error response as `_apns_check_errors`
+            if select.select([connection], [], [], error_timeout)[0]:
+                connection.recv(6)
+        finally:
+            connection.close()
+
+        caller.append(time.time() - call_started)
+
+    return time.time() - started, sorted(caller)
+
+
+def send_queued(server, count, batch_size, error_timeout):
+    from swapp_api.push import PushQueue
+
+    queue = PushQueue(batch_size=batch_size, error_timeout=error_timeout, connect=server.connect)
+    caller = []
+    started = time.time()
+
+    for token in tokens(count):
+        call_started = time.time()
+        queue.enqueue(token, "Benchmark", badge=1)
+        caller.append(time.time() - call_started)
+
+    queue.flush()
+
+    return time.time() - started, sorted(caller)
+
+
+def report(label, count, received, total, caller):
+    sys.stdout.write("{:<8} {:6d}/{} received  {:9.0f} msg/s  caller median {:8.3f}ms  max {:8.3f}ms\n".format(
+        label,
+        received,
+        count,
+        count / total,
+        caller[len(caller)//2]*1000,
+        caller[-1]*1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--error-timeout', type=float, default=0.01)
+    parser.add_argument('--skip-direct', action='store_true', help="only measure the push queue")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swapp_api.settings')
+
+    import django
+    django.setup()
+
+    from swapp_api.fake_apns import FakeAPNSServer
+
+    if not args.skip_direct:
+        server = FakeAPNSServer()
+        total, caller = send_directly(server, args.messages, args.error_timeout)
+        report("direct", args.messages, len(server.notifications), total, caller)
+        server.stop()
+
+    server = FakeAPNSServer()
+    total, caller = send_queued(server, args.messages, args.batch_size, args.error_timeout)
+    report("queued", args.messages, len(server.notifications), total, caller)
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Startup-time benchmark: measures `django.setup()` plus importing the root URL configuration (and with it every
+view, model and PredictionIO module) in a fresh interpreter, as a gunicorn worker or management command would.
+
+Run from the project root with the settings module of the environment to measure:
+
+    DJANGO_SETTINGS_MODULE=swapp_api.settings python benchmarks/startup.py --runs 10
+
+`--eager` also builds every PredictionIO client right after import, which reproduces the cost that was paid at
+import time before clients were built lazily, so both numbers can be compared on the same checkout.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = """
+import sys, time
+sys.path.insert(0, {root!r})
+started = time.time()
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.utils.module_loading import import_module
+import_module(settings.ROOT_URLCONF)
+
+if {eager!r}:
+    from swapp_api.pio_clients import clients
+    clients.warm()
+
+sys.stdout.write("%f" % (time.time() - started))
+"""
+
+
+def measure(runs, eager):
+    code = MEASURE.format(root=ROOT, eager=eager)
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'swapp_api.settings')
+
+    return sorted(float(subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, env=env))
+                  for i in range(runs))
+
+
+def report(label, timings):
+    sys.stdout.write("{:<8} min {:8.1f}ms  median {:8.1f}ms  max {:8.1f}ms\n".format(
+        label,
+        timings[0]*1000,
+        timings[len(timings)//2]*1000,
+        timings[-1]*1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--eager', action='store_true', help="also measure with every client built at startup")
+    args = parser.parse_args()
+
+    report("lazy", measure(args.runs, False))
+
+    if args.eager:
+        report("eager", measure(args.runs, True))
+
+
+if __name__ == '__main__':
+    main()
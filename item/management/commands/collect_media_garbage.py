@@ -0,0 +1,88 @@
+import os, time
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from item.models import Item
+from swapp_api.images import get_renditions, rendition_name
+from swapp_api.storage import UPLOAD_DIRECTORY
+from swapp_api.utils import chunked_rows
+from user_profile.models import UserProfile
+
+PHOTO_MODELS = (Item, UserProfile)
+
+
+class Command(BaseCommand):
+    help = ("Deletes item and profile photos, and their renditions, that no item or profile references anymore. "
+            "Files younger than the grace period are kept, as their objects may not be saved yet.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help="Keep unreferenced files modified in the last hours (default: 24)")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Number of rows fetched per query (default: 2000)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="List the files that would be deleted without deleting them")
+
+    def handle(self, *args, **options):
+        references = Counter()
+
+        for model in PHOTO_MODELS:
+            queryset = model.objects.exclude(photo='').exclude(photo__isnull=True)
+
+            for id, name in chunked_rows(queryset, ('photo',), options['chunk_size']):
+                references[name] += 1
+
+        aliases = list(get_renditions())
+        keep = set(references)
+        keep.update(rendition_name(name, alias) for name in references for alias in aliases)
+
+        cutoff = time.time() - options['grace_hours']*60*60
+        deleted = 0
+        freed = 0
+
+        for storage, directory in self.directories():
+            root = storage.path(directory)
+
+            for path, directories, files in os.walk(root):
+                for file_name in files:
+                    full_path = os.path.join(path, file_name)
+                    name = os.path.relpath(full_path, storage.location).replace(os.sep, '/')
+
+                    if name in keep or os.path.getmtime(full_path) >= cutoff:
+                        continue
+
+                    size = os.path.getsize(full_path)
+
+                    if options['dry_run']:
+                        self.stdout.write("Would delete {}".format(name))
+                    else:
+                        storage.delete(name)
+
+                    deleted += 1
+                    freed += size
+
+        self.stdout.write("{} referenced photo(s), {} shared by several objects; {} {} file(s), {} bytes".format(
+            len(references),
+            len([name for name, count in references.items() if count > 1]),
+            "would delete" if options['dry_run'] else "deleted",
+            deleted,
+            freed))
+
+    def directories(self):
+        """
+        Returns the (storage, directory) pairs holding photos: each photo field's upload directory, and the
+        directory where the storage writes uploads before moving them to their name.
+        """
+
+        directories = set()
+
+        for model in PHOTO_MODELS:
+            field = model._meta.get_field('photo')
+            directories.add((field.storage, field.upload_to.strip('/')))
+
+            if hasattr(field.storage, 'content_name'):
+                directories.add((field.storage, UPLOAD_DIRECTORY))
+
+        return sorted(directories, key=lambda pair: pair[1])
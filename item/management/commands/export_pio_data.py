@@ -0,0 +1,90 @@
+import gzip, json, os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from item.models import Item
+from swapp_api.pio_event import item_set_event, user_set_event
+from swapp_api.utils import chunked_rows
+
+
+class JsonLinesWriter(object):
+    """
+    Writes JSON lines to numbered files, optionally gzip-compressed, starting a new file once `max_bytes` of
+    uncompressed data have been written to the current one.
+    """
+
+    def __init__(self, directory, prefix, compress=False, max_bytes=0):
+        self.directory = directory
+        self.prefix = prefix
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.paths = []
+        self.lines = 0
+
+        self._file = None
+        self._written = 0
+
+    def write(self, data):
+        line = (json.dumps(data) + "\n").encode('utf-8')
+
+        if self._file is None or (self.max_bytes and self._written + len(line) > self.max_bytes and self._written):
+            self._open_next()
+
+        self._file.write(line)
+        self._written += len(line)
+        self.lines += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open_next(self):
+        self.close()
+
+        path = os.path.join(self.directory, "{}-{:04d}.json{}".format(
+            self.prefix, len(self.paths) + 1, ".gz" if self.compress else ""))
+
+        self._file = gzip.open(path, 'wb') if self.compress else open(path, 'wb')
+        self._written = 0
+        self.paths.append(path)
+
+
+class Command(BaseCommand):
+    help = ("Exports active users and available items as PredictionIO batch-import files "
+            "(`pio import --appid <id> --input <file>`), for seeding a fresh engine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default='pio_export',
+                            help="Directory to write the files to (default: pio_export)")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Number of rows fetched per query (default: 2000)")
+        parser.add_argument('--gzip', action='store_true',
+                            help="Compress the files with gzip")
+        parser.add_argument('--max-bytes', type=int, default=0,
+                            help="Start a new file after this many uncompressed bytes (default: no limit)")
+
+    def handle(self, *args, **options):
+        directory = options['output_dir']
+        chunk_size = options['chunk_size']
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        writer = JsonLinesWriter(directory, 'events', compress=options['gzip'], max_bytes=options['max_bytes'])
+
+        try:
+            for (user_id,) in chunked_rows(User.objects.filter(is_active=True), (), chunk_size):
+                writer.write(user_set_event(user_id))
+
+            for item_id, subcategory_id in chunked_rows(Item.objects.filter(is_available=True),
+                                                        ('subcategory_id',), chunk_size):
+                writer.write(item_set_event(item_id, subcategory_id))
+        finally:
+            writer.close()
+
+        self.stdout.write("Exported {} events to {} file(s):".format(writer.lines, len(writer.paths)))
+
+        for path in writer.paths:
+            self.stdout.write("  {}".format(path))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from item.models import Item
+from swapp_api.images import ImageJob, ImagePool, get_renditions, rendition_name
+from swapp_api.utils import chunked_rows
+from swapp_api.versioning import CATALOG_VERSION_KEY, bump_user_versions, bump_version
+from user_profile.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = ("Generates the missing photo renditions of items and user profiles, e.g. for photos uploaded before "
+            "renditions existed or after a rendition was added to IMAGE_RENDITIONS.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Regenerate renditions that already exist")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of photos processed at once (default: 4)")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of rows fetched per query (default: 1000)")
+
+    def handle(self, *args, **options):
+        pool = ImagePool(workers=options['workers'], max_queue=options['workers']*4)
+        aliases = sorted(get_renditions())
+        jobs = []
+
+        for model, owner_field in ((Item, 'owner'), (UserProfile, 'user')):
+            storage = model._meta.get_field('photo').storage
+            queryset = model.objects.exclude(photo='').exclude(photo__isnull=True)
+
+            for id, name, owner_id in chunked_rows(queryset, ('photo', owner_field), options['chunk_size']):
+                missing = aliases if options['force'] else [
+                    alias for alias in aliases if not storage.exists(rendition_name(name, alias))
+                ]
+
+                if missing and storage.exists(name):
+                    # The original was already processed when it was uploaded
+                    jobs.append((owner_id, pool.submit(storage.path(name), renditions=missing, process=False)))
+
+        pool.join()
+
+        failed = [job for owner_id, job in jobs if job.error]
+        owners = [owner_id for owner_id, job in jobs if job.status == ImageJob.DONE]
+
+        if owners:
+            # Payloads built before showed the original photos instead
+            bump_user_versions(*owners)
+            bump_version(CATALOG_VERSION_KEY)
+
+        for job in failed:
+            self.stderr.write("{}: {}".format(job.path, job.error))
+
+        self.stdout.write("Generated renditions for {} photo(s), {} failed ({:.3f}s per photo on average)".format(
+            len(jobs) - len(failed), len(failed), pool.stats()['run_time_average']))
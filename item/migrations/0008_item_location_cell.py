@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from item.utils import location_cell
+
+
+def populate_location_cells(apps, schema_editor):
+    Item = apps.get_model('item', 'Item')
+
+    for item in Item.objects.exclude(latitude=None).exclude(longitude=None).iterator():
+        Item.objects.filter(id=item.id).update(location_cell=location_cell(item.latitude, item.longitude))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0007_item_condition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='location_cell',
+            field=models.CharField(db_index=True, max_length=20, null=True, editable=False, blank=True),
+        ),
+        migrations.RunPython(populate_location_cells, migrations.RunPython.noop),
+    ]
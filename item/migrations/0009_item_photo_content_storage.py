@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import swapp_api.fields
+import swapp_api.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0008_item_location_cell'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='photo',
+            field=swapp_api.fields.AutoResizeImageField(storage=swapp_api.storage.ContentAddressedStorage(), max_length=500, null=True, upload_to=b'item/', blank=True),
+        ),
+    ]
@@ -2,13 +2,21 @@ import logging
 
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import pre_delete
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 
+from item.spatial_index import remove_from_item_index, update_item_index
+from item.taxonomy import bump_taxonomy_version
+from item.utils import location_cell
 from user_profile.models import UserProfile
+from swapp_api.cache import invalidate_owner_recommendations
 from swapp_api.fields import AutoResizeImageField
+from swapp_api.images import AVATAR, CARD, rendition_url, renditions_generated
 from swapp_api.pio_event import PIOEvent
+from swapp_api.storage import content_storage
+from swapp_api.versioning import bump_item_versions, bump_photo_versions
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +32,7 @@ class Item(models.Model):
     """
     name = models.CharField(max_length=250)
     owner = models.ForeignKey(User, related_name='items')
-    photo = AutoResizeImageField(upload_to = "item/", max_length = 500, **optional)
+    photo = AutoResizeImageField(upload_to = "item/", max_length = 500, storage=content_storage, **optional)
     date_posted = models.DateTimeField(default=timezone.now)
     price_range_minimum = models.PositiveIntegerField()
     price_range_maximum = models.PositiveIntegerField()
@@ -35,6 +43,7 @@ class Item(models.Model):
     latitude = models.DecimalField(max_digits=11, decimal_places=8, **optional)
     longitude = models.DecimalField(max_digits=11, decimal_places=8, **optional)
     condition = models.BooleanField(default=True)  # Brand new
+    location_cell = models.CharField(max_length=20, db_index=True, editable=False, **optional)
 
     def __unicode__(self):
         return "{} (from: {})".format(self.name, self.owner)
@@ -44,10 +53,15 @@ class Item(models.Model):
         verbose_name = _('Item')
         verbose_name_plural = _('Items')
 
-    def to_dict(self):
+    def to_dict(self, rendition=CARD):
+        """
+        Returns the item's details, with the URL of its photo's `rendition` (see `swapp_api.images`), or of the
+        original photo if `rendition` is None.
+        """
+
         try:
             location = str(self.owner.profile.location)
-            owner_photo_url = "" if not self.owner.profile.photo else self.owner.profile.photo.url
+            owner_photo_url = rendition_url(self.owner.profile.photo, AVATAR)
         except UserProfile.DoesNotExist:
             location = ""
             owner_photo_url = ""
@@ -65,13 +79,43 @@ class Item(models.Model):
             'date_posted_formatted': self.date_posted.strftime("%B %m, %Y"),
             'description': self.description,
             'condition': self.condition,
-            'photo': "" if not self.photo else self.photo.url,
+            'photo': rendition_url(self.photo, rendition) if rendition else ("" if not self.photo else self.photo.url),
             'subcategory': self.subcategory.name,
             'is_available': self.is_available,
         }
 
+    @classmethod
+    def bulk_to_dict(cls, items, rendition=CARD):
+        """
+        Class method to serialize several items with a single query, regardless of their number.
+
+        Accepts a queryset, a list of Item instances or a list of item ids. Returns the list of `to_dict`
+        outputs, in the order of the queryset or list given; ids of items that no longer exist are skipped.
+        """
+
+        if isinstance(items, QuerySet):
+            queryset = items
+            ids = None
+        else:
+            ids = [getattr(item, 'pk', item) for item in items]
+
+            if not ids:
+                return []
+
+            queryset = cls.objects.filter(id__in=ids)
+
+        queryset = queryset.select_related('owner__profile', 'subcategory')
+
+        if ids is None:
+            return [item.to_dict(rendition) for item in queryset]
+
+        items_by_id = dict((item.id, item) for item in queryset)
+
+        return [items_by_id[item_id].to_dict(rendition) for item_id in ids if item_id in items_by_id]
+
     def save(self, *args, **kwargs):
         new = False if self.pk else True
+        self.location_cell = location_cell(self.latitude, self.longitude)
         super(Item, self).save(*args, **kwargs)
         if new:
             try:
@@ -152,14 +196,15 @@ class SwapHistory(models.Model):
         verbose_name_plural = _('Swap History')
 
 
-# Signal Method(s)
-def delete_previous_item_image(sender, instance, **kwargs):
-    """
-    Before deleting the item instance, deletes first its associated image before it is replaced.
-    """
-
-    if instance and instance.photo:
-        instance.photo.delete(False)
-
+# Register the signal
+post_save.connect(update_item_index, sender=Item)
+pre_delete.connect(remove_from_item_index, sender=Item)
+post_save.connect(invalidate_owner_recommendations, sender=Item)
+post_delete.connect(invalidate_owner_recommendations, sender=Item)
+post_save.connect(bump_item_versions, sender=Item)
+post_delete.connect(bump_item_versions, sender=Item)
+renditions_generated.connect(bump_photo_versions, sender=Item)
 
-pre_delete.connect(delete_previous_item_image, sender=Item)
+for model in (Category, Subcategory, Tag):
+    post_save.connect(bump_taxonomy_version, sender=model)
+    post_delete.connect(bump_taxonomy_version, sender=model)
@@ -1,12 +1,10 @@
-import base64
-import imghdr
 import six
 import uuid
 
-from django.core.files.base import ContentFile
-
 from rest_framework import serializers
 
+from swapp_api.uploads import UploadError, decode_base64_image, max_image_upload_size
+
 
 class Base64ImageField(serializers.ImageField):
     """
@@ -20,34 +18,22 @@ class Base64ImageField(serializers.ImageField):
     https://github.com/tomchristie/django-rest-framework/pull/1268
 
     Updated for Django REST framework 3.
+
+    Base64 strings are decoded in chunks into a spooled temporary file (see `decode_base64_image`), and uploaded
+    files from multipart requests are accepted as they are; both are limited to MAX_IMAGE_UPLOAD_SIZE bytes.
     """
 
     def to_internal_value(self, data):
         # Check if this is a base64 string
         if isinstance(data, six.string_types):
-            # Check if the base64 string is in the "data:" format
-            if 'data:' in data and ';base64,' in data:
-                # Break out the header from the base64 content
-                header, data = data.split(';base64,')
-
-            # Try to decode the file. Return validation error if it fails.
-            try:
-                decoded_file = base64.b64decode(data)
-            except TypeError:
-                self.fail('invalid_image')
-
-            # Generate file name and file extension
+            # Generate file name; its extension is taken from the decoded image's format
             file_name = str(uuid.uuid4())[:12]
-            file_extension = self.get_file_extension(file_name, decoded_file)
-
-            complete_file_name = "{}.{}".format(file_name, file_extension)
 
-            data = ContentFile(decoded_file, name=complete_file_name)
+            try:
+                data = decode_base64_image(data, file_name)
+            except UploadError as e:
+                raise serializers.ValidationError(str(e))
+        elif getattr(data, 'size', None) and data.size > max_image_upload_size():
+            raise serializers.ValidationError("Image is larger than {} bytes".format(max_image_upload_size()))
 
         return super(Base64ImageField, self).to_internal_value(data)
-
-    def get_file_extension(self, file_name, decoded_file):
-        extension = imghdr.what(file_name, decoded_file)
-        extension = "jpg" if extension == "jpeg" else extension
-
-        return extension
@@ -0,0 +1,207 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from django.conf import settings
+
+from item.utils import DEGREES_TO_RADIANS, EARTH_RADIUS_KM
+
+logger = logging.getLogger(__name__)
+
+
+def unit_vectors(latitudes, longitudes):
+    """
+    Converts latitude-longitude points to 3D vectors on the unit sphere.
+
+    Args:
+        latitudes: sequence of latitudinal positions
+        longitudes: sequence of longitudinal positions
+
+    Returns:
+        A NumPy array of shape (n, 3)
+    """
+
+    lat = np.asarray(latitudes, dtype=np.float64)*DEGREES_TO_RADIANS
+    long = np.asarray(longitudes, dtype=np.float64)*DEGREES_TO_RADIANS
+    cos_lat = np.cos(lat)
+
+    return np.column_stack((cos_lat*np.cos(long), cos_lat*np.sin(long), np.sin(lat)))
+
+
+def chord_length(radius):
+    """
+    Returns the straight-line distance on the unit sphere that corresponds to a distance in kilometers
+    along the earth's surface.
+    """
+
+    arc = float(radius)/EARTH_RADIUS_KM
+
+    return 2.0 if arc >= math.pi else 2.0*math.sin(arc/2.0)
+
+
+class ItemSpatialIndex(object):
+    """
+    Process-local KD-tree of the coordinates of available items, stored as unit-sphere vectors so that
+    radius queries are exact great-circle queries.
+
+    Items added or moved since the last build are kept in a small pending set that is scanned linearly,
+    and the tree is rebuilt once that set grows past `rebuild_threshold`. Saves made by other processes
+    are only picked up when the index is reloaded after `max_age` seconds.
+    """
+
+    def __init__(self, rebuild_threshold=256, max_age=None):
+        self.rebuild_threshold = rebuild_threshold
+        self.max_age = max_age if max_age is not None else getattr(settings, 'ITEM_SPATIAL_INDEX_MAX_AGE', 300)
+
+        self._lock = threading.RLock()
+        self._vectors = {}
+        self._tree = None
+        self._tree_ids = np.empty(0, dtype=np.int64)
+        self._pending = set()
+        self._stale = set()
+        self._loaded_at = None
+
+    def __contains__(self, item_id):
+        self._ensure_loaded()
+
+        return item_id in self._vectors
+
+    def __len__(self):
+        self._ensure_loaded()
+
+        return len(self._vectors)
+
+    def load(self):
+        """
+        (Re)builds the index from all available items that have a location.
+        """
+
+        from item.models import Item
+
+        rows = list(Item.objects.filter(is_available=True)
+                                .exclude(latitude=None)
+                                .exclude(longitude=None)
+                                .values_list('id', 'latitude', 'longitude'))
+
+        with self._lock:
+            self._vectors = {}
+
+            if rows:
+                ids, latitudes, longitudes = zip(*rows)
+                self._vectors = dict(zip(ids, unit_vectors(latitudes, longitudes)))
+
+            self._pending = set()
+            self._build()
+            self._loaded_at = time.time()
+
+    def invalidate(self):
+        """
+        Drops the index so that it is reloaded on next use.
+        """
+
+        with self._lock:
+            self._loaded_at = None
+
+    def update(self, item):
+        """
+        Adds, moves or removes an item according to its current availability and location.
+        """
+
+        if item.is_available and item.latitude is not None and item.longitude is not None:
+            self.add(item.id, item.latitude, item.longitude)
+        else:
+            self.remove(item.id)
+
+    def add(self, item_id, lat, long):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+
+            self._vectors[item_id] = unit_vectors([lat], [long])[0]
+            self._stale.add(item_id)
+            self._pending.add(item_id)
+
+            if len(self._pending) > self.rebuild_threshold:
+                self._build()
+
+    def remove(self, item_id):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+
+            self._vectors.pop(item_id, None)
+            self._stale.add(item_id)
+            self._pending.discard(item_id)
+
+    def within(self, lat, long, radius):
+        """
+        Returns the set of ids of the available items within `radius` kilometers of a location.
+        """
+
+        self._ensure_loaded()
+
+        center = unit_vectors([lat], [long])[0]
+        # Allow for rounding so that points exactly on the boundary are included
+        chord = chord_length(radius)*(1 + 1e-9)
+
+        with self._lock:
+            result = set()
+
+            if self._tree is not None:
+                indexes = self._tree.query_ball_point(center, chord)
+                result.update(int(item_id) for item_id in self._tree_ids[indexes])
+                result.difference_update(self._stale)
+
+            for item_id in self._pending:
+                if np.linalg.norm(self._vectors[item_id] - center) <= chord:
+                    result.add(item_id)
+
+        return result
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.time() - self._loaded_at > self.max_age:
+            self.load()
+
+    def _build(self):
+        # Imported on first build, as SciPy is slow to import and not every process queries the index
+        from scipy.spatial import cKDTree
+
+        ids = list(self._vectors.keys())
+
+        if ids:
+            self._tree = cKDTree(np.array([self._vectors[item_id] for item_id in ids]))
+        else:
+            self._tree = None
+
+        self._tree_ids = np.array(ids, dtype=np.int64)
+        self._pending = set()
+        self._stale = set()
+
+
+item_index = ItemSpatialIndex()
+
+
+# Signal Method(s)
+def update_item_index(sender, instance, **kwargs):
+    """
+    After saving an item instance, reflects its availability and location in the spatial index.
+    """
+
+    try:
+        item_index.update(instance)
+    except Exception as e:
+        logger.error(e)
+
+
+def remove_from_item_index(sender, instance, **kwargs):
+    """
+    Before deleting the item instance, removes it from the spatial index.
+    """
+
+    try:
+        item_index.remove(instance.id)
+    except Exception as e:
+        logger.error(e)
@@ -0,0 +1,131 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from swapp_api.versioning import TAXONOMY_VERSION_KEY, bump_version, get_version, stamps_are_shared
+
+TAXONOMY_CACHE_KEY = "swapp:taxonomy:{:.6f}"
+
+
+def build_taxonomy():
+    """
+    Returns a snapshot of the categories, subcategories and tags: their serialized lists, as returned by the list
+    endpoints, and the lookups the views need.
+    """
+
+    from item.models import Category, Subcategory, Tag
+    from item.serializers import CategorySerializer, SubcategorySerializer, TagSerializer
+
+    categories = list(Category.objects.all().order_by('name'))
+    subcategories = list(Subcategory.objects.all())
+
+    return {
+        'categories': list(CategorySerializer(categories, many=True).data),
+        'subcategories': list(SubcategorySerializer(subcategories, many=True).data),
+        'tags': list(TagSerializer(Tag.objects.all(), many=True).data),
+        'category_ids': [category.id for category in categories],
+        'category_names': [category.name for category in categories],
+        'subcategory_names': [subcategory.name for subcategory in subcategories],
+        'subcategory_ids': dict((subcategory.name, subcategory.id) for subcategory in subcategories),
+    }
+
+
+class TaxonomyCache(object):
+    """
+    Two-level cache of the taxonomy snapshot built by `build_taxonomy`.
+
+    The snapshot is kept in process memory and in the shared cache, both keyed by the taxonomy version stamp, which
+    is bumped whenever a category, subcategory or tag is saved or deleted. A process only rebuilds the snapshot when
+    the version it holds is outdated and no other process has stored the current one yet. Without shared stamps
+    (see `swapp_api.versioning.stamps_are_shared`) a change made in another process would go unnoticed, so the
+    snapshot is then built for every lookup.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or getattr(settings, 'TAXONOMY_CACHE_TIMEOUT', 24*60*60)
+        self.builds = 0
+
+        self._lock = threading.Lock()
+        self._entry = (None, None)
+
+    def get(self):
+        if not stamps_are_shared():
+            self.builds += 1
+            return build_taxonomy()
+
+        # The version is read before the snapshot is built, so a concurrent change can only cause an extra rebuild
+        version = get_version(TAXONOMY_VERSION_KEY)
+        entry_version, snapshot = self._entry
+
+        if entry_version == version:
+            return snapshot
+
+        with self._lock:
+            entry_version, snapshot = self._entry
+
+            if entry_version == version:
+                return snapshot
+
+            key = TAXONOMY_CACHE_KEY.format(version)
+            snapshot = cache.get(key)
+
+            if snapshot is None:
+                snapshot = build_taxonomy()
+                self.builds += 1
+                cache.set(key, snapshot, self.timeout)
+
+            self._entry = (version, snapshot)
+
+        return snapshot
+
+    def categories(self):
+        return self.get()['categories']
+
+    def subcategories(self):
+        return self.get()['subcategories']
+
+    def tags(self):
+        return self.get()['tags']
+
+    def category_ids(self):
+        """
+        Returns the category ids ordered by category name, the order in which clients index categories.
+        """
+
+        return self.get()['category_ids']
+
+    def category_names(self):
+        return self.get()['category_names']
+
+    def subcategory_names(self):
+        return self.get()['subcategory_names']
+
+    def subcategory_id(self, name):
+        """
+        Returns the id of the subcategory with the given name. Raises Subcategory.DoesNotExist if there is none.
+        """
+
+        try:
+            return self.get()['subcategory_ids'][name]
+        except KeyError:
+            from item.models import Subcategory
+
+            # Added after the snapshot was built, e.g. without signals
+            return Subcategory.objects.values_list('id', flat=True).get(name=name)
+
+    def clear(self):
+        with self._lock:
+            self._entry = (None, None)
+
+
+taxonomy = TaxonomyCache()
+
+
+# Signal Method(s)
+def bump_taxonomy_version(sender, instance, **kwargs):
+    """
+    After saving or deleting a category, subcategory or tag, marks the taxonomy as modified.
+    """
+
+    bump_version(TAXONOMY_VERSION_KEY)
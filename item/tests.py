@@ -1,20 +1,42 @@
-import base64, json, requests
+import base64, gzip, json, math, os, requests, shutil, tempfile
 from datetime import datetime
 
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.test import LiveServerTestCase
+from django.core.management import call_command
+from django.test import LiveServerTestCase, RequestFactory, override_settings
 from django.test.client import Client
 
 from cities_light.models import City, Country
 from oauth2_provider.models import AccessToken, Application
+from six import StringIO
 
 from item.models import (
     Category,
     Item,
     Subcategory
 )
-from item.utils import distance_on_unit_sphere
+from item.spatial_index import ItemSpatialIndex, item_index
+from item.taxonomy import taxonomy
+from item.utils import (
+    DEGREES_TO_RADIANS,
+    EARTH_RADIUS_KM,
+    distance_on_unit_sphere,
+    distances_on_unit_sphere,
+    items_within_radius,
+    location_cell
+)
+from swapp_api.pagination import paginate_queryset
+from swapp_api.pio_clients import clients
+from swapp_api.pio_event import PIOEvent
+from swapp_api.predictionio_api import (
+    FALLBACK_CHUNK_SIZE,
+    PIOExport,
+    PriceRangeIndex,
+    engine_client,
+    lebesgue_measure
+)
+from swapp_api.versioning import MODEL_VERSION_KEY, bump_user_versions, bump_version
 
 
 class ItemTest(LiveServerTestCase):
@@ -115,6 +137,248 @@ class ItemTest(LiveServerTestCase):
 
         self.assertEqual(response.status_code, 200)
 
+    def test_item_bulk_to_dict_query_count(self):
+        """
+        Test method to check if serializing a large list of items takes a single query
+
+        Expected behavior: 1000 items be serialized with exactly one query, in the order they were given
+        """
+
+        Item.objects.bulk_create([
+            Item(
+                name='Bulk Item {}'.format(i),
+                owner=self.user,
+                price_range_minimum=1000,
+                price_range_maximum=2000,
+                subcategory=self.subcategory,
+            ) for i in range(1000)
+        ])
+        item_ids = list(Item.objects.filter(name__startswith='Bulk Item').values_list('id', flat=True))
+        item_ids.reverse()
+
+        with self.assertNumQueries(1):
+            item_data = Item.bulk_to_dict(item_ids)
+
+        self.assertEqual([item.get('id') for item in item_data], item_ids)
+        self.assertEqual(item_data[0], Item.objects.get(id=item_ids[0]).to_dict())
+
+    def test_paginate_queryset_walks_every_page(self):
+        """
+        Test method to check if following the next cursors of a queryset returns every object once, newest first
+
+        Expected behavior: The pages together list every item in (date_posted, id) descending order, and the last
+        page have no cursor
+        """
+
+        for i in range(3):
+            Item.objects.create(name='Item {}'.format(i), owner=self.user, price_range_minimum=0,
+                                price_range_maximum=100, subcategory=self.subcategory)
+
+        factory = RequestFactory()
+        expected = list(Item.objects.order_by('-date_posted', '-id').values_list('id', flat=True))
+        actual = []
+        cursor = None
+
+        while True:
+            params = {'page_size': 2}
+
+            if cursor:
+                params['cursor'] = cursor
+
+            items, cursor = paginate_queryset(factory.get('/', params), Item.objects.all(), 'date_posted')
+            actual.extend(item.id for item in items)
+
+            if cursor is None:
+                break
+
+        self.assertEqual(actual, expected)
+
+    def test_recommendation_cache_invalidation(self):
+        """
+        Test method to check if cached recommendations are dropped when the user saves or buys an item, when the
+        user's data or the model changes in another process, and only then
+
+        Expected behavior: The engine be queried again after each change, and not for a repeated request
+        """
+
+        class Engine(object):
+            queries = 0
+
+            def send_query(self, query):
+                self.queries += 1
+                return {'itemScores': []}
+
+        class Dispatcher(object):
+            def enqueue(self, *args):
+                pass
+
+        engine = Engine()
+        pio = PIOExport()
+        clients.register('engine_client_recommended', lambda: engine)
+        clients.reset()
+
+        try:
+            pio.list_of_recommended_items(self.user)
+            pio.list_of_recommended_items(self.user)
+            self.assertEqual(engine.queries, 1)
+
+            self.item.save()
+            pio.list_of_recommended_items(self.user)
+            self.assertEqual(engine.queries, 2)
+
+            PIOEvent(dispatcher=Dispatcher()).buy_item(self.user, self.item2)
+            pio.list_of_recommended_items(self.user)
+            self.assertEqual(engine.queries, 3)
+
+            # As done by a save or a training in another process
+            bump_user_versions(self.user.id)
+            pio.list_of_recommended_items(self.user)
+            self.assertEqual(engine.queries, 4)
+
+            bump_version(MODEL_VERSION_KEY)
+            pio.list_of_recommended_items(self.user)
+            pio.list_of_recommended_items(self.user)
+            self.assertEqual(engine.queries, 5)
+        finally:
+            clients.register('engine_client_recommended', engine_client('PIO_ACCESS_URL'))
+            clients.reset()
+
+    def test_hydrate_items(self):
+        """
+        Test method to check if recommended item ids are resolved to items in score order, with a single query
+
+        Expected behavior: The available items of other users be returned in the order of the ids, and the ids of
+        deleted, unavailable and owned items be dropped
+        """
+
+        seller = User.objects.create(username='seller', password='sellerpassword')
+        items = [
+            Item.objects.create(name='Item {}'.format(i), owner=seller, price_range_minimum=0,
+                                price_range_maximum=100, subcategory=self.subcategory)
+            for i in range(3)
+        ]
+        unavailable = Item.objects.create(name='Sold Item', owner=seller, price_range_minimum=0,
+                                          price_range_maximum=100, subcategory=self.subcategory, is_available=False)
+        deleted = Item.objects.create(name='Deleted Item', owner=seller, price_range_minimum=0,
+                                      price_range_maximum=100, subcategory=self.subcategory)
+        deleted_id = deleted.id
+        deleted.delete()
+
+        # The engine returns ids as strings, best score first
+        item_ids = [str(x) for x in [items[2].id, deleted_id, items[0].id, self.item.id, unavailable.id, items[1].id]]
+
+        with self.assertNumQueries(1):
+            actual_result = PIOExport().hydrate_items(self.user, item_ids)
+
+        self.assertEqual(actual_result, [items[2], items[0], items[1]])
+
+    def test_fallback_items(self):
+        """
+        Test method to check if the fallback recommender returns the available items of other users in the user's
+        preferred categories and range, nearest first
+
+        Expected behavior: Only the nearby items of the preferred category be returned, ordered by distance
+        """
+
+        profile = self.user.profile
+        profile.current_latitude, profile.current_longitude, profile.distance_range = 7.070963, 125.606439, 100
+        profile.save()
+        self.user.preferences.get().categories.add(self.subcategory.parent_category)
+
+        seller = User.objects.create(username='seller', password='sellerpassword')
+        other_subcategory = Subcategory.objects.create(name='Phones',
+                                                       parent_category=Category.objects.create(name='Gadgets'))
+
+        def create_item(latitude_offset, **kwargs):
+            options = {'owner': seller, 'subcategory': self.subcategory}
+            options.update(kwargs)
+
+            return Item.objects.create(name='Item', price_range_minimum=0, price_range_maximum=100,
+                                       latitude=7.070963 + latitude_offset, longitude=125.606439, **options)
+
+        # Roughly 22km, 1km and 6km away
+        expected = [create_item(0.2), create_item(0.01), create_item(0.05)]
+        expected.sort(key=lambda item: item.latitude)
+
+        create_item(3.0)
+        create_item(0.02, subcategory=other_subcategory)
+        create_item(0.03, is_available=False)
+        create_item(0.04, owner=self.user)
+
+        self.assertEqual(PIOExport().list_of_fallback_items(self.user), expected)
+
+    def test_fallback_items_limit(self):
+        """
+        Test method to check if the fallback recommender keeps only the nearest items of a catalog larger than one
+        chunk of candidates
+
+        Expected behavior: Exactly `limit` items be returned, the nearest ones, nearest first
+        """
+
+        profile = self.user.profile
+        profile.current_latitude, profile.current_longitude, profile.distance_range = 7.070963, 125.606439, 100
+        profile.save()
+
+        seller = User.objects.create(username='seller', password='sellerpassword')
+        latitudes = [7.070963 + 0.0001*i for i in range(2*FALLBACK_CHUNK_SIZE + 10)]
+
+        # Created in reverse, so that the nearest items are found in the last chunk
+        Item.objects.bulk_create([
+            Item(name='Bulk Item', owner=seller, price_range_minimum=0, price_range_maximum=100,
+                 subcategory=self.subcategory, latitude=latitude, longitude=125.606439,
+                 location_cell=location_cell(latitude, 125.606439))
+            for latitude in reversed(latitudes)
+        ])
+
+        actual_result = PIOExport().list_of_fallback_items(self.user, limit=25)
+
+        self.assertEqual(len(actual_result), 25)
+        self.assertEqual([float(item.latitude) for item in actual_result], [round(x, 8) for x in latitudes[:25]])
+
+    @override_settings(CONDITIONAL_RESPONSES=True)
+    def test_taxonomy_cache(self):
+        """
+        Test method to check if taxonomy lookups are served from the cache until a subcategory is added
+
+        Expected behavior: No query be made for a cached lookup, and a new subcategory be found right after it is saved
+        """
+
+        taxonomy.clear()
+        taxonomy.get()
+
+        with self.assertNumQueries(0):
+            subcategory_id = taxonomy.subcategory_id('Basketball Shoes')
+
+        self.assertEqual(subcategory_id, self.subcategory.id)
+
+        subcategory = Subcategory.objects.create(name='Running Shoes', parent_category=self.subcategory.parent_category)
+
+        self.assertEqual(taxonomy.subcategory_id('Running Shoes'), subcategory.id)
+        self.assertRaises(Subcategory.DoesNotExist, taxonomy.subcategory_id, 'Hiking Shoes')
+
+        # Saved by another process, whose version bump this one has not seen
+        Subcategory.objects.bulk_create([
+            Subcategory(name='Trail Shoes', parent_category=self.subcategory.parent_category)
+        ])
+
+        self.assertEqual(taxonomy.subcategory_id('Trail Shoes'), Subcategory.objects.get(name='Trail Shoes').id)
+
+    @override_settings(CONDITIONAL_RESPONSES=False)
+    def test_taxonomy_without_shared_stamps(self):
+        """
+        Test method to check if taxonomy lookups see changes made by other processes when version stamps are not
+        shared between processes
+
+        Expected behavior: A category saved without bumping the version be listed at once, in name order
+        """
+
+        taxonomy.clear()
+        category_ids = taxonomy.category_ids()
+
+        Category.objects.bulk_create([Category(name='AAA Antiques')])
+
+        self.assertEqual(taxonomy.category_ids(), [Category.objects.get(name='AAA Antiques').id] + category_ids)
+
     # Item Add view tests
     def test_item_add_endpoint(self):
         """
@@ -171,6 +435,184 @@ class ItemTest(LiveServerTestCase):
 
         self.assertEqual(theoretical_result, actual_result)
 
+    def test_distances_on_unit_sphere(self):
+        """
+        Test method to compute for distances between one location point and several others in a single call
+
+        Expected behavior: Each output distance be equal to the distance computed for that pair of points alone
+        """
+
+        origin = (7.070963, 125.606439)
+        latitudes = [7.016807, 7.190708, 7.070963]
+        longitudes = [125.493731, 125.455341, 125.606439]
+
+        actual_result = distances_on_unit_sphere(origin[0], origin[1], latitudes, longitudes)
+
+        for i in range(len(latitudes)):
+            theoretical_result = distance_on_unit_sphere(origin[0], origin[1], latitudes[i], longitudes[i])[1]
+
+            self.assertAlmostEqual(theoretical_result, actual_result[i])
+
+    def test_spatial_index_radius(self):
+        """
+        Test method to check if the spatial index returns the same items within a radius as computing every distance
+        with `distances_on_unit_sphere`
+
+        Expected behavior: Both sets of item ids be equal for every radius, including an item at coordinates 0.0
+        """
+
+        points = [(7.016807, 125.493731), (7.190708, 125.455341), (7.5, 126.0), (0.0, 0.0), (10.0, 120.0)]
+        items = [self.item, self.item2] + [
+            Item.objects.create(name='Item {}'.format(i), owner=self.user, price_range_minimum=0,
+                                price_range_maximum=100, subcategory=self.subcategory, latitude=lat, longitude=long)
+            for i, (lat, long) in enumerate(points)
+        ]
+        origin = (7.070963, 125.606439)
+
+        index = ItemSpatialIndex()
+        index.load()
+
+        distances = distances_on_unit_sphere(origin[0], origin[1], [item.latitude for item in items],
+                                             [item.longitude for item in items])
+
+        for radius in [1, 20, 100, 1000, 20000]:
+            theoretical_result = set(item.id for item, distance in zip(items, distances) if distance <= radius)
+
+            self.assertEqual(index.within(origin[0], origin[1], radius), theoretical_result)
+
+    def test_spatial_index_follows_saves_and_deletes(self):
+        """
+        Test method to check if moving, hiding and deleting an item updates the shared spatial index
+
+        Expected behavior: The item be found at its new location only, then not at all once unavailable or deleted
+        """
+
+        item_index.load()
+
+        self.item.latitude, self.item.longitude = 7.070963, 125.606439
+        self.item.save()
+
+        self.assertIn(self.item.id, item_index.within(7.07, 125.6, 5))
+        self.assertNotIn(self.item.id, item_index.within(80.0, 80.0, 5))
+
+        self.item2.latitude, self.item2.longitude = 7.070963, 125.606439
+        self.item2.is_available = False
+        self.item2.save()
+
+        self.assertNotIn(self.item2.id, item_index.within(7.07, 125.6, 5))
+
+        item_id = self.item.id
+        self.item.delete()
+
+        self.assertNotIn(item_id, item_index.within(7.07, 125.6, 5))
+        self.assertNotIn(item_id, item_index)
+
+    def test_location_prefilter_keeps_items_within_radius(self):
+        """
+        Test method to check if the SQL prefilter on location cells and bounding boxes keeps every item within the
+        radius, including around the antimeridian and close to the north pole
+
+        Expected behavior: Every item within the radius be in the prefiltered queryset, for each origin
+        """
+
+        def destination(lat, long, bearing, distance):
+            # Point reached by going `distance` kilometers from a location along the initial `bearing` in degrees
+            lat, long, bearing = lat*DEGREES_TO_RADIANS, long*DEGREES_TO_RADIANS, bearing*DEGREES_TO_RADIANS
+            arc = float(distance)/EARTH_RADIUS_KM
+
+            lat2 = math.asin(math.sin(lat)*math.cos(arc) + math.cos(lat)*math.sin(arc)*math.cos(bearing))
+            long2 = long + math.atan2(math.sin(bearing)*math.sin(arc)*math.cos(lat),
+                                      math.cos(arc) - math.sin(lat)*math.sin(lat2))
+
+            return round(lat2/DEGREES_TO_RADIANS, 8), round((long2/DEGREES_TO_RADIANS + 540.0) % 360.0 - 180.0, 8)
+
+        # A cell-covered circle, one crossing the antimeridian, and one widened by the latitude near the pole
+        origins = [(7.070963, 125.606439, 100), (-16.5, 179.9, 100), (89.0, 10.0, 20)]
+
+        for lat, long, radius in origins:
+            ids = [
+                Item.objects.create(name='Item', owner=self.user, price_range_minimum=0, price_range_maximum=100,
+                                    subcategory=self.subcategory,
+                                    latitude=point[0], longitude=point[1]).id
+                for point in [destination(lat, long, bearing, radius*fraction)
+                              for bearing in range(0, 360, 45) for fraction in (0.5, 0.99, 1.5)]
+            ]
+            rows = list(Item.objects.filter(id__in=ids).values_list('id', 'latitude', 'longitude'))
+            distances = distances_on_unit_sphere(lat, long, [float(row[1]) for row in rows],
+                                                 [float(row[2]) for row in rows])
+
+            theoretical_result = set(row[0] for row, distance in zip(rows, distances) if distance <= radius)
+            actual_result = set(items_within_radius(Item.objects.filter(id__in=ids), lat, long, radius)
+                                .values_list('id', flat=True))
+
+            self.assertEqual(len(theoretical_result), 16)
+            self.assertEqual(theoretical_result - actual_result, set())
+
+    def test_price_range_index_matching(self):
+        """
+        Test method to check if the price range index returns the same items as checking each item with
+        `lebesgue_measure`
+
+        Expected behavior: Both lists of matching items be equal
+        """
+
+        items = [
+            Item(name='Item {}'.format(i), price_range_minimum=minimum, price_range_maximum=maximum)
+            for i, (minimum, maximum) in enumerate([(0, 100), (4000, 6000), (5000, 5100), (6400, 9000), (1000, 60000)])
+        ]
+        index = PriceRangeIndex(items)
+
+        for item in [self.item, self.item2]:
+            theoretical_result = [other for other in items if lebesgue_measure(
+                item.price_range_minimum,
+                item.price_range_maximum,
+                other.price_range_minimum,
+                other.price_range_maximum)]
+            actual_result = index.matching(item.price_range_minimum, item.price_range_maximum)
+
+            self.assertEqual(theoretical_result, actual_result)
+
+    def test_export_pio_data(self):
+        """
+        Test method to check if the PredictionIO export writes one event per active user and available item, over
+        several chunks and several gzip-compressed files
+
+        Expected behavior: The files together hold every event once, and none be larger than --max-bytes uncompressed
+        """
+
+        User.objects.bulk_create([User(username='exportuser{}'.format(i)) for i in range(4)])
+        User.objects.create(username='inactiveuser', is_active=False)
+        Item.objects.create(name='Hidden Item', owner=self.user, price_range_minimum=0, price_range_maximum=100,
+                            subcategory=self.subcategory, is_available=False)
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            call_command('export_pio_data', output_dir=directory, chunk_size=2, gzip=True, max_bytes=400,
+                         stdout=StringIO())
+
+            names = sorted(os.listdir(directory))
+            lines = []
+
+            for name in names:
+                self.assertTrue(name.endswith('.json.gz'))
+
+                with gzip.open(os.path.join(directory, name), 'rb') as f:
+                    data = f.read()
+
+                self.assertLessEqual(len(data), 400)
+                lines.extend(data.decode('utf-8').splitlines())
+        finally:
+            shutil.rmtree(directory)
+
+        expected = (["u{}".format(user_id) for user_id in User.objects.filter(is_active=True)
+                                                                 .order_by('id').values_list('id', flat=True)] +
+                    ["i{}".format(item_id) for item_id in Item.objects.filter(is_available=True)
+                                                                 .order_by('id').values_list('id', flat=True)])
+
+        self.assertGreater(len(names), 1)
+        self.assertEqual([json.loads(line)['entityId'] for line in lines], expected)
+
     def test_item_conflict_check_200(self):
         """
         Test method to check if the endpoint for Checking for Location Conflict would return True
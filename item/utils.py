@@ -1,39 +1,50 @@
 import math
 
+import numpy as np
 
-def distance_on_unit_sphere(lat1, long1, lat2, long2):
+EARTH_RADIUS_MILES = 3960
+EARTH_RADIUS_KM = 6373
+
+DEGREES_TO_RADIANS = math.pi/180.0
+
+# Size, in degrees, of the fixed grid cells used to prefilter items by location in SQL.
+# Half a degree is roughly 55km along a meridian, so the default 100km range covers a handful of cells.
+LOCATION_CELL_SIZE = 0.5
+LOCATION_CELL_COUNT_LONGITUDE = int(360/LOCATION_CELL_SIZE)
+
+# Beyond this many cells the `IN` clause costs more than it saves and only the bounding box is used
+MAX_LOCATION_CELLS = 400
+
+# Below this many candidates a direct batch computation is cheaper than querying the spatial index
+SPATIAL_INDEX_MIN_CANDIDATES = 256
+
+
+def arcs_on_unit_sphere(lat, long, latitudes, longitudes):
     """
-    This function return the distance between two latitude-longitude points.
+    This function returns the arc lengths between one latitude-longitude point and an array of points.
 
     Args:
-        lat1: latitudinal position of first location
-        long1: longitudinal position of first location
-        lat2: latitudinal position of second location
-        long2: longitudinal position of second location
+        lat: latitudinal position of the origin
+        long: longitudinal position of the origin
+        latitudes: sequence of latitudinal positions of the candidate locations
+        longitudes: sequence of longitudinal positions of the candidate locations
 
     Returns:
-        A tuple that contains the distance between the two locations in miles and kilometers, respectively
-
-        Output = (distance in miles, distance in kilometes)
+        A NumPy array of arc lengths on the unit sphere, one per candidate location
     """
 
     # Convert latitude and longitude to
     # spherical coordinates in radians.
-    lat1 = float(lat1)
-    lat2 = float(lat2)
-    long1 = float(long1)
-    long2 = float(long2)
-
-    # import pdb; pdb.set_trace()
-    degrees_to_radians = math.pi/180.0
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
 
     # phi = 90 - latitude
-    phi1 = (90.0 - lat1)*degrees_to_radians
-    phi2 = (90.0 - lat2)*degrees_to_radians
+    phi1 = (90.0 - float(lat))*DEGREES_TO_RADIANS
+    phi2 = (90.0 - latitudes)*DEGREES_TO_RADIANS
 
     # theta = longitude
-    theta1 = long1*degrees_to_radians
-    theta2 = long2*degrees_to_radians
+    theta1 = float(long)*DEGREES_TO_RADIANS
+    theta2 = longitudes*DEGREES_TO_RADIANS
 
     # Compute spherical distance from spherical coordinates.
 
@@ -43,25 +54,220 @@ def distance_on_unit_sphere(lat1, long1, lat2, long2):
     #    sin phi sin phi' cos(theta-theta') + cos phi cos phi'
     # distance = rho * arc length
 
-    cos = (math.sin(phi1)*math.sin(phi2)*math.cos(theta1 - theta2) +
-           math.cos(phi1)*math.cos(phi2))
-    arc = math.acos( cos )
-    mile = 3960*arc
-    km = 6373*arc
+    cos = (math.sin(phi1)*np.sin(phi2)*np.cos(theta1 - theta2) +
+           math.cos(phi1)*np.cos(phi2))
+
+    # Rounding errors can push identical points slightly outside of acos' domain
+    return np.arccos(np.clip(cos, -1.0, 1.0))
+
+
+def distances_on_unit_sphere(lat, long, latitudes, longitudes):
+    """
+    This function returns the distances in kilometers between one latitude-longitude point and an array of points.
+
+    Args:
+        lat: latitudinal position of the origin
+        long: longitudinal position of the origin
+        latitudes: sequence of latitudinal positions of the candidate locations
+        longitudes: sequence of longitudinal positions of the candidate locations
+
+    Returns:
+        A NumPy array of distances in kilometers, one per candidate location
+    """
+
+    return EARTH_RADIUS_KM*arcs_on_unit_sphere(lat, long, latitudes, longitudes)
+
+
+def distance_on_unit_sphere(lat1, long1, lat2, long2):
+    """
+    This function return the distance between two latitude-longitude points.
+
+    Args:
+        lat1: latitudinal position of first location
+        long1: longitudinal position of first location
+        lat2: latitudinal position of second location
+        long2: longitudinal position of second location
+
+    Returns:
+        A tuple that contains the distance between the two locations in miles and kilometers, respectively
+
+        Output = (distance in miles, distance in kilometes)
+    """
+
+    arc = float(arcs_on_unit_sphere(lat1, long1, [lat2], [long2])[0])
 
     # Remember to multiply arc by the radius of the earth
     # in your favorite set of units to get length.
-    return mile, km
+    return EARTH_RADIUS_MILES*arc, EARTH_RADIUS_KM*arc
 
 
-def recommended_items_based_on_location(profile, recommended_items):
-    items = []
+def location_cell(lat, long):
+    """
+    This function returns the key of the fixed grid cell that contains a latitude-longitude point.
+
+    Args:
+        lat: latitudinal position of the location
+        long: longitudinal position of the location
+
+    Returns:
+        The cell key as a string (e.g. "194:610"), or None if the location is incomplete
+    """
+
+    try:
+        lat = float(lat)
+        long = float(long)
+    except (TypeError, ValueError):
+        return None
+
+    lat_index = int(math.floor((lat + 90.0)/LOCATION_CELL_SIZE))
+    long_index = int(math.floor((long + 180.0)/LOCATION_CELL_SIZE)) % LOCATION_CELL_COUNT_LONGITUDE
 
-    for item in recommended_items:
-        if item.latitude and item.longitude:
-            distance = distance_on_unit_sphere(item.latitude, item.longitude, profile.current_latitude, profile.current_longitude)[1]
+    return "{}:{}".format(lat_index, long_index)
 
-            if float(distance) <= float(profile.distance_range):
-                items.append(item)
 
-    return items
+def bounding_box(lat, long, radius):
+    """
+    This function returns the latitude-longitude box that encloses a circle on the earth's surface.
+
+    Args:
+        lat: latitudinal position of the center
+        long: longitudinal position of the center
+        radius: radius of the circle in kilometers
+
+    Returns:
+        A tuple of (minimum latitude, maximum latitude, minimum longitude, maximum longitude).
+        The longitude bounds are None if the circle reaches a pole or crosses the antimeridian.
+    """
+
+    lat = float(lat)
+    long = float(long)
+    angular_radius = float(radius)/EARTH_RADIUS_KM/DEGREES_TO_RADIANS
+
+    minimum_lat = lat - angular_radius
+    maximum_lat = lat + angular_radius
+
+    if minimum_lat <= -90.0 or maximum_lat >= 90.0:
+        return max(minimum_lat, -90.0), min(maximum_lat, 90.0), None, None
+
+    # Longitude degrees shrink towards the poles; widen by the latitude closest to a pole
+    widest_lat = max(abs(minimum_lat), abs(maximum_lat))
+    long_radius = angular_radius/math.cos(widest_lat*DEGREES_TO_RADIANS)
+
+    minimum_long = long - long_radius
+    maximum_long = long + long_radius
+
+    if minimum_long < -180.0 or maximum_long > 180.0:
+        return minimum_lat, maximum_lat, None, None
+
+    return minimum_lat, maximum_lat, minimum_long, maximum_long
+
+
+def cells_within_radius(lat, long, radius):
+    """
+    This function returns the grid cells and bounding box that cover a circle on the earth's surface.
+
+    Args:
+        lat: latitudinal position of the center
+        long: longitudinal position of the center
+        radius: radius of the circle in kilometers
+
+    Returns:
+        A tuple of (set of cell keys, bounding box). The set of cell keys is None if the circle covers
+        more than `MAX_LOCATION_CELLS` cells or its longitude cannot be bounded.
+    """
+
+    box = bounding_box(lat, long, radius)
+    minimum_lat, maximum_lat, minimum_long, maximum_long = box
+
+    if minimum_long is None:
+        return None, box
+
+    lat_indexes = range(int(math.floor((minimum_lat + 90.0)/LOCATION_CELL_SIZE)),
+                        int(math.floor((maximum_lat + 90.0)/LOCATION_CELL_SIZE)) + 1)
+    long_indexes = range(int(math.floor((minimum_long + 180.0)/LOCATION_CELL_SIZE)),
+                         int(math.floor((maximum_long + 180.0)/LOCATION_CELL_SIZE)) + 1)
+
+    if len(lat_indexes)*len(long_indexes) > MAX_LOCATION_CELLS:
+        return None, box
+
+    cells = set("{}:{}".format(lat_index, long_index % LOCATION_CELL_COUNT_LONGITUDE)
+                for lat_index in lat_indexes for long_index in long_indexes)
+
+    return cells, box
+
+
+def items_within_radius(queryset, lat, long, radius):
+    """
+    This function narrows down an Item queryset to the items whose cells and coordinates fall in the
+    bounding box of a circle. The result is a superset of the items within the circle; use
+    `recommended_items_based_on_location` for the exact check.
+
+    Args:
+        queryset: Item queryset to filter
+        lat: latitudinal position of the center
+        long: longitudinal position of the center
+        radius: radius of the circle in kilometers
+
+    Returns:
+        The filtered queryset
+    """
+
+    cells, (minimum_lat, maximum_lat, minimum_long, maximum_long) = cells_within_radius(lat, long, radius)
+
+    queryset = queryset.filter(latitude__range=(minimum_lat, maximum_lat))
+
+    if minimum_long is not None:
+        queryset = queryset.filter(longitude__range=(minimum_long, maximum_long))
+
+    if cells is not None:
+        queryset = queryset.filter(location_cell__in=cells)
+
+    return queryset
+
+
+def items_within_distance(lat, long, radius, items):
+    """
+    This function returns the items that are within a given distance of a location.
+
+    Long candidate lists are answered with the in-memory spatial index; items the index does not know
+    about, and short candidate lists, are checked directly with `distances_on_unit_sphere`.
+
+    Args:
+        lat: latitudinal position of the location
+        long: longitudinal position of the location
+        radius: maximum distance in kilometers
+        items: list of Item instances
+
+    Returns:
+        The list of items within the distance, in their original order
+    """
+
+    from item.spatial_index import item_index
+
+    items = [item for item in items if item.latitude is not None and item.longitude is not None]
+
+    if len(items) >= SPATIAL_INDEX_MIN_CANDIDATES:
+        nearby_ids = item_index.within(lat, long, radius)
+        unindexed = [item for item in items if item.id not in item_index]
+    else:
+        nearby_ids = set()
+        unindexed = items
+
+    if unindexed:
+        distances = distances_on_unit_sphere(
+            lat,
+            long,
+            [item.latitude for item in unindexed],
+            [item.longitude for item in unindexed])
+
+        nearby_ids.update(item.id for item, distance in zip(unindexed, distances) if distance <= float(radius))
+
+    return [item for item in items if item.id in nearby_ids]
+
+
+def recommended_items_based_on_location(profile, recommended_items):
+    return items_within_distance(
+        profile.current_latitude,
+        profile.current_longitude,
+        profile.distance_range,
+        recommended_items)
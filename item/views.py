@@ -3,7 +3,6 @@ import json
 from django.contrib.auth.models import User
 from django.http import Http404
 
-from oauth2_provider.models import AccessToken
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -20,12 +19,22 @@ from item.serializers import (
     SubcategorySerializer,
     TagSerializer,
 )
-from item.utils import distance_on_unit_sphere, recommended_items_based_on_location
-from swapp_api.authentication import BasicAuthentication
+from item.taxonomy import taxonomy
+from item.utils import items_within_distance, recommended_items_based_on_location
+from swapp_api.authentication import BasicAuthentication, authenticated
+from swapp_api.images import DETAIL
+from swapp_api.pagination import paginate_list, wants_legacy_response
 from swapp_api.permissions import IsAuthenticated
 from swapp_api.predictionio_api import PIOEvent, PIOExport, train_system
+from swapp_api.uploads import request_data
+from swapp_api.versioning import (
+    CATALOG_VERSION_KEY,
+    MODEL_VERSION_KEY,
+    TAXONOMY_VERSION_KEY,
+    conditional_response,
+    user_version_key
+)
 from transaction.models import Transaction
-from user_profile.models import UserProfile
 
 
 # Category
@@ -33,6 +42,9 @@ class CategoryList(generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def list(self, request, *args, **kwargs):
+        return conditional_response(request, [TAXONOMY_VERSION_KEY], lambda: Response(taxonomy.categories()))
+
 
 class CategoryDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
@@ -44,6 +56,9 @@ class SubcategoryList(generics.ListCreateAPIView):
     queryset = Subcategory.objects.all()
     serializer_class = SubcategorySerializer
 
+    def list(self, request, *args, **kwargs):
+        return conditional_response(request, [TAXONOMY_VERSION_KEY], lambda: Response(taxonomy.subcategories()))
+
 
 class SubcategoryDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = Subcategory.objects.all()
@@ -55,6 +70,9 @@ class TagList(generics.ListCreateAPIView):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
+    def list(self, request, *args, **kwargs):
+        return conditional_response(request, [TAXONOMY_VERSION_KEY], lambda: Response(taxonomy.tags()))
+
 
 class TagDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = Tag.objects.all()
@@ -68,37 +86,50 @@ class ItemList(APIView):
 
     def get(self, request, **kwargs):
         try:
-            token = AccessToken.objects.get(token=kwargs.get('identifier'))
-            user = token.user
-            profile = UserProfile.objects.get(user=user)
+            user = authenticated(request, kwargs.get('identifier')).user
 
-            # Retrieve and filter out user's recommended items by availability, location, and price ranges
-            user_items = user.items.filter(is_available=True)
+            # Answers 304 without building the feed if nothing it depends on has changed
+            return conditional_response(
+                request,
+                [user_version_key(user.id), CATALOG_VERSION_KEY, MODEL_VERSION_KEY],
+                lambda: self.get_feed(request, user))
+        except Exception as e:
+            return Response("Error: {}".format(e), status.HTTP_400_BAD_REQUEST)
 
-            if not user_items:
-                msg = "You have yet to add your very first item.\nClick the 'Plus' icon in you Profile page to do so."
+    def get_feed(self, request, user):
+        profile = user.profile
 
-                return Response(msg, status.HTTP_404_NOT_FOUND)
+        # Retrieve and filter out user's recommended items by availability, location, and price ranges
+        user_items = user.items.filter(is_available=True)
 
-            recommended_items = PIOExport().list_of_recommended_items(user)
-            recommended_items = [item for item in recommended_items if item.is_available]
-            recommended_items_by_location = recommended_items_based_on_location(
-                                                profile,
-                                                recommended_items)
-            matching_items = PIOExport().list_of_matching_items_by_price_range(
-                                    user_items[0],
-                                    recommended_items_by_location)
+        if not user_items:
+            msg = "You have yet to add your very first item.\nClick the 'Plus' icon in you Profile page to do so."
 
-            return_data = {
-                'owned_items': [item.to_dict() for item in user_items],
-                'other_users_items': [item.to_dict() for item in matching_items],
-                'pending_transactions': Transaction.get_pending_user_transactions(user, detailed=True)
-                # TODO: Filter items with existing transaction
-            }
+            return Response(msg, status.HTTP_404_NOT_FOUND)
 
-            return Response(return_data, status.HTTP_200_OK)
-        except Exception as e:
-            return Response("Error: {}".format(e), status.HTTP_400_BAD_REQUEST)
+        recommended_items = PIOExport().list_of_recommended_items(user)
+        recommended_items = [item for item in recommended_items if item.is_available]
+        recommended_items_by_location = recommended_items_based_on_location(
+                                            profile,
+                                            recommended_items)
+        matching_items = PIOExport().list_of_matching_items_by_price_range(
+                                user_items[0],
+                                recommended_items_by_location)
+
+        return_data = {
+            'owned_items': Item.bulk_to_dict(user_items),
+            'pending_transactions': Transaction.get_pending_user_transactions(user, detailed=True)
+            # TODO: Filter items with existing transaction
+        }
+
+        if wants_legacy_response(request):
+            return_data['other_users_items'] = Item.bulk_to_dict(matching_items)
+        else:
+            matching_items, next_cursor = paginate_list(request, matching_items, lambda item: item.date_posted)
+            return_data['other_users_items'] = Item.bulk_to_dict(matching_items)
+            return_data['next_cursor'] = next_cursor
+
+        return Response(return_data, status.HTTP_200_OK)
 
 
 class ItemDetail(APIView):
@@ -111,7 +142,7 @@ class ItemDetail(APIView):
         try:
             item = Item.objects.get(id=id);
 
-            return Response(item.to_dict(), status.HTTP_200_OK)
+            return Response(item.to_dict(DETAIL), status.HTTP_200_OK)
         except Item.DoesNotExist:
             raise Http404
 
@@ -146,36 +177,33 @@ class ItemEdit(APIView):
     permission_classes = (IsAuthenticated,)
 
     def post(self, request, **kwargs):
-        data = request.DATA
+        data = request_data(request)
         item = Item.objects.get(id=data.get('id'))
 
         data['owner'] = item.owner.id
         data['condition'] = True if data['condition'] == "brand_new" else False
-        data['subcategory'] = Subcategory.objects.get(name=data.get('subcategory')).id
+        data['subcategory'] = taxonomy.subcategory_id(data.get('subcategory'))
 
         if not data.get('photo'):
             item.name = data.get('name')
             item.description = data.get('description')
             item.condition = data.get('condition')
-            item.subcategory = Subcategory.objects.get(id=data.get('subcategory'))
+            item.subcategory_id = data.get('subcategory')
             item.latitude = data.get('latitude')
             item.longitude = data.get('longitude')
             item.price_range_minimum = data.get('price_range_minimum')
             item.price_range_maximum = data.get('price_range_maximum')
             item.save()
 
-            return Response(item.to_dict(), status=status.HTTP_201_CREATED)
+            return Response(item.to_dict(DETAIL), status=status.HTTP_201_CREATED)
         else:
             serializer = ItemSerializer(item, data=data)
 
             if serializer.is_valid():
-                # Deletes first its previous image to save server storage space
-                if item.photo:
-                    item.photo.delete(False)
-
+                # The previous image is left to `collect_media_garbage`, as other objects may share it
                 serializer.save()
 
-                return Response(item.to_dict(), status=status.HTTP_201_CREATED)
+                return Response(item.to_dict(DETAIL), status=status.HTTP_201_CREATED)
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -185,29 +213,26 @@ class ItemAdd(APIView):
     permission_classes = (IsAuthenticated,)
 
     def post(self, request, **kwargs):
-        identifier = request.META.get('HTTP_AUTHORIZATION')
-        identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-        token = AccessToken.objects.get(token=identifier)
-        user = token.user
+        user = authenticated(request).user
 
-        data = request.DATA
+        data = request_data(request)
         data['owner'] = user.id
         data['condition'] = True if data['condition'] == "brand_new" else False
-        data['subcategory'] = Subcategory.objects.get(name=data.get('subcategory')).id
+        data['subcategory'] = taxonomy.subcategory_id(data.get('subcategory'))
 
         serializer = ItemSerializer(data=data)
 
         if serializer.is_valid():
             item = serializer.save()
 
-            profile = UserProfile.objects.get(user__id=int(user.id))
+            profile = user.profile
             profile.current_latitude = data.get('latitude')
             profile.current_longitude = data.get('longitude')
-            profile.save()
+            profile.save(update_fields=['current_latitude', 'current_longitude'])
 
             train_system()
 
-            return Response(item.to_dict(), status=status.HTTP_201_CREATED)
+            return Response(item.to_dict(DETAIL), status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -233,21 +258,18 @@ class ItemConflictCheck(APIView):
 
     def get(self, request, **kwargs):
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
-            profile = UserProfile.objects.get(user=user)
-
-            conflict_items = Item.objects.filter(owner=user, is_available=True)
-            result = "False"
-
-            for item in conflict_items:
-                # Checks if the distance of an item is greater than 50Km with the current location of the user
-                if item.latitude == None or item.longitude == None:
-                    result = "True"
-                elif distance_on_unit_sphere(item.latitude, item.longitude, profile.current_latitude, profile.current_longitude)[1] > 50.0:
-                    result = "True"
+            user = authenticated(request).user
+            profile = user.profile
+
+            conflict_items = list(Item.objects.filter(owner=user, is_available=True))
+
+            # Checks if an item has no location or is farther than 50Km from the current location of the user
+            nearby_items = items_within_distance(
+                                profile.current_latitude,
+                                profile.current_longitude,
+                                50.0,
+                                conflict_items)
+            result = "True" if len(nearby_items) < len(conflict_items) else "False"
 
             result_text = {'result': result}
 
@@ -262,11 +284,8 @@ class ItemConflictResolve(APIView):
 
     def post(self, request, **kwargs):
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
-            profile = UserProfile.objects.get(user=user)
+            user = authenticated(request).user
+            profile = user.profile
 
             items = Item.objects.filter(owner=user, is_available=True)
 
@@ -291,11 +310,8 @@ class MatchingItems(APIView):
         """
 
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
-            profile = UserProfile.objects.get(user=user)
+            user = authenticated(request).user
+            profile = user.profile
 
             try:
                 item_id = kwargs.get('pk')
@@ -315,7 +331,7 @@ class MatchingItems(APIView):
                                     recommended_items_by_location)
 
                 return_data = {
-                    'matching_items': [item.to_dict() for item in matching_items],
+                    'matching_items': Item.bulk_to_dict(matching_items),
                     'pending_transactions': Transaction.get_pending_user_transactions(user, detailed=True)
                 }
 
@@ -1,8 +1,11 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 
+from swapp_api.images import AVATAR, CARD, rendition_url
+from swapp_api.versioning import bump_conversation_versions
 from transaction.models import Transaction
 from user_profile.models import UserProfile
 
@@ -39,13 +42,13 @@ class Thread(models.Model):
 
         try:
             profile = self.sender.profile
-            sender_photo = "" if not profile.photo else profile.photo.url
+            sender_photo = rendition_url(profile.photo, AVATAR)
         except UserProfile.DoesNotExist:
             sender_photo = ""
 
         try:
             profile = self.receiver.profile
-            receiver_photo = "" if not profile.photo else profile.photo.url
+            receiver_photo = rendition_url(profile.photo, AVATAR)
         except UserProfile.DoesNotExist:
             receiver_photo = ""
 
@@ -57,7 +60,7 @@ class Thread(models.Model):
             'receiver': self.receiver.get_full_name(),
             'receiver_id': self.receiver.id,
             'receiver_photo': receiver_photo,
-            'item_photo': "" if not self.transaction.item1.photo else self.transaction.item1.photo.url,
+            'item_photo': rendition_url(self.transaction.item1.photo, AVATAR),
             'latest_message': {} if not all_messages else all_messages.latest('date_sent').to_dict(),
             'date_modified': self.date_modified,
         }
@@ -74,13 +77,13 @@ class Thread(models.Model):
             thread_data.update({'item_1': {
                 'name': self.transaction.item1.name,
                 'owner': self.transaction.item1.name,
-                'photo': "" if not self.transaction.item1.photo else self.transaction.item1.photo.url,
+                'photo': rendition_url(self.transaction.item1.photo, CARD),
                 'is_available': self.transaction.item1.is_available}
             })
             thread_data.update({'item_2': {
                 'name': self.transaction.item2.name,
                 'owner': self.transaction.item2.name,
-                'photo': "" if not self.transaction.item2.photo else self.transaction.item2.photo.url,
+                'photo': rendition_url(self.transaction.item2.photo, CARD),
                 'is_available': self.transaction.item2.is_available}
             })
 
@@ -110,7 +113,7 @@ class Message(models.Model):
     def to_dict(self):
         try:
             profile = self.sender.profile
-            sender_photo = "" if not profile.photo else profile.photo.url
+            sender_photo = rendition_url(profile.photo, AVATAR)
         except UserProfile.DoesNotExist:
             sender_photo = ""
 
@@ -122,3 +125,10 @@ class Message(models.Model):
             'is_read': self.is_read,
             'date_sent': self.date_sent
         }
+
+
+# Register the signal
+post_save.connect(bump_conversation_versions, sender=Thread)
+post_delete.connect(bump_conversation_versions, sender=Thread)
+post_save.connect(bump_conversation_versions, sender=Message)
+post_delete.connect(bump_conversation_versions, sender=Message)
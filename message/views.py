@@ -1,3 +1,5 @@
+from django.db.models import Q
+
 from oauth2_provider.models import AccessToken
 from rest_framework import generics, status
 from rest_framework.response import Response
@@ -5,9 +7,12 @@ from rest_framework.views import APIView
 
 from message.models import Message, Thread
 from message.serializers import MessageSerializer, ThreadSerializer
-from swapp_api.authentication import BasicAuthentication
+from swapp_api.authentication import BasicAuthentication, authenticated
+from swapp_api.images import AVATAR, rendition_url
+from swapp_api.pagination import paginate_queryset, wants_legacy_response
 from swapp_api.permissions import IsAuthenticated
 from swapp_api.utils import send_push_notification
+from swapp_api.versioning import conditional_response, user_version_key
 from transaction.models import Transaction
 from user_profile.models import UserProfile
 
@@ -30,38 +35,43 @@ class ThreadList(APIView):
 
     def get(self, request, **kwargs):
         try:
-            identifier = kwargs.get('identifier')
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
-
-            try:
-                profile = user.profile
-                user_photo = "" if not profile.photo else profile.photo.url
-            except UserProfile.DoesNotExist:
-                user_photo = ""
+            user = authenticated(request, kwargs.get('identifier')).user
 
-            threads_received = user.thread_receiver.all()
-            threads_initiated = user.thread_sender.all()
-
-            all_threads = threads_received | threads_initiated
-            sorted_threads = sorted(
-                [thread.to_dict() for thread in all_threads],
-                key=lambda t: t['date_modified'],
-                reverse=True
-            )
+            return conditional_response(request, [user_version_key(user.id)], lambda: self.get_threads(request, user))
+        except AccessToken.DoesNotExist:
+            return Response("Access Token is invalid", status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response("Error: {}".format(e), status=status.HTTP_400_BAD_REQUEST)
 
-            threads_data = {
-                'threads': [thread for thread in sorted_threads],
-                'current_user': {
-                    'id': user.id,
-                    'name': user.get_full_name(),
-                    'photo': user_photo
-                }
+    def get_threads(self, request, user):
+        try:
+            profile = user.profile
+            user_photo = rendition_url(profile.photo, AVATAR)
+        except UserProfile.DoesNotExist:
+            user_photo = ""
+
+        all_threads = Thread.objects.filter(Q(sender=user) | Q(receiver=user)).select_related(
+            'sender__profile',
+            'receiver__profile',
+            'transaction__item1'
+        )
+
+        threads_data = {
+            'current_user': {
+                'id': user.id,
+                'name': user.get_full_name(),
+                'photo': user_photo
             }
+        }
 
-            return Response(threads_data, status=status.HTTP_200_OK)
-        except AccessToken.DoesNotExist:
-            return Response("Access Token is invalid", status=status.HTTP_400_BAD_REQUEST)
+        if wants_legacy_response(request):
+            threads_data['threads'] = [thread.to_dict() for thread in all_threads.order_by('-date_modified', '-id')]
+        else:
+            threads, next_cursor = paginate_queryset(request, all_threads, 'date_modified')
+            threads_data['threads'] = [thread.to_dict() for thread in threads]
+            threads_data['next_cursor'] = next_cursor
+
+        return Response(threads_data, status=status.HTTP_200_OK)
 
 
 class ThreadDetail(APIView):
@@ -73,10 +83,7 @@ class ThreadDetail(APIView):
             thread = Thread.objects.get(id=int(kwargs.get('pk')))
 
             try:
-                identifier = request.META.get('HTTP_AUTHORIZATION')
-                identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-                token = AccessToken.objects.get(token=identifier)
-                user = token.user
+                user = authenticated(request).user
 
                 # Set all Thread message's `is_read` attribute to True
                 for message in thread.messages.all():
@@ -85,7 +92,7 @@ class ThreadDetail(APIView):
 
                 try:
                     profile = user.profile
-                    user_photo = "" if not profile.photo else profile.photo.url
+                    user_photo = rendition_url(profile.photo, AVATAR)
                 except UserProfile.DoesNotExist:
                     user_photo = ""
 
@@ -114,16 +121,13 @@ class ThreadCreate(APIView):
         data = request.DATA
 
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
+            user = authenticated(request).user
 
             transaction = Transaction.objects.get(id=int(data.get('transaction_id')))
 
             try:
                 profile = user.profile
-                user_photo = "" if not profile.photo else profile.photo.url
+                user_photo = rendition_url(profile.photo, AVATAR)
             except UserProfile.DoesNotExist:
                 user_photo = ""
 
@@ -1,6 +1,12 @@
 import base64
 
+from collections import namedtuple
+
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
 
 from oauth2_provider.models import AccessToken
 from rest_framework import status
@@ -8,6 +14,88 @@ from rest_framework.authentication import BaseAuthentication
 
 from rest_framework.response import Response
 
+from swapp_api.cache import TTLCache
+
+# What an access token resolves to; `profile` is None for users without a UserProfile
+ResolvedToken = namedtuple('ResolvedToken', ['token', 'user', 'profile', 'expires'])
+
+# Access token -> (user id, expiry). Only the token's identity is cached: the user and profile are loaded fresh on
+# every request, so profile edits are seen at once by every process. Tokens revoked through another process stay
+# usable here for at most the cache's time-to-live.
+token_cache = TTLCache(
+    maxsize=getattr(settings, 'ACCESS_TOKEN_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'ACCESS_TOKEN_CACHE_TTL', 60)
+)
+
+
+def get_identifier(request):
+    """
+    Returns the access token sent with a request, from the Authorization header (`Bearer <token>` or the bare
+    token) or else the `identifier` query parameter.
+    """
+
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+
+    if authorization:
+        return authorization.split(' ')[-1]
+
+    return request.GET.get('identifier')
+
+
+def resolve_token(token):
+    """
+    Returns the ResolvedToken of an access token. Raises AccessToken.DoesNotExist if there is none.
+
+    The token's user id is served from `token_cache` until the token expires, so a request costs a single query
+    for its user and profile instead of a lookup of the token as well.
+    """
+
+    cached = token_cache.get(token)
+
+    if cached is None:
+        access_token = AccessToken.objects.select_related('user__profile').get(token=token)
+        user = access_token.user
+        expires = access_token.expires
+        ttl = token_cache.ttl
+
+        if expires:
+            ttl = min(ttl, (expires - timezone.now()).total_seconds())
+
+        # Expired tokens are still resolved, but from the database every time
+        if ttl > 0:
+            token_cache.set(token, (user.id, expires), ttl=ttl)
+    else:
+        user_id, expires = cached
+
+        try:
+            user = User.objects.select_related('profile').get(id=user_id)
+        except User.DoesNotExist:
+            token_cache.invalidate(token)
+            raise AccessToken.DoesNotExist("The access token's user no longer exists")
+
+    try:
+        profile = user.profile
+    except ObjectDoesNotExist:
+        profile = None
+
+    return ResolvedToken(token, user, profile, expires)
+
+
+def authenticated(request, identifier=None):
+    """
+    Returns the ResolvedToken of the request's access token, reusing the one found by BasicAuthentication. An
+    `identifier` taken from the URL takes precedence over the token sent with the request. Raises
+    AccessToken.DoesNotExist if there is no valid access token.
+    """
+
+    auth = getattr(request, 'auth', None)
+    identifier = identifier or get_identifier(request)
+
+    if isinstance(auth, ResolvedToken) and auth.token == identifier:
+        return auth
+
+    return resolve_token(identifier)
+
 
 class BasicAuthentication(BaseAuthentication):
     """
@@ -19,20 +107,35 @@ class BasicAuthentication(BaseAuthentication):
 
     def authenticate(self, request):
         """
-        Returns a User instance if a correct API key have been supplied
-        using HTTP Basic authentication. Otherwise returns False.
+        Returns a (User, ResolvedToken) tuple if a correct API key have been supplied
+        using HTTP Basic authentication. Otherwise returns None.
         """
 
-        access_token = request.META.get('HTTP_AUTHORIZATION')
-
-        if not access_token:
-            access_token = request.GET.get('identifier')
+        kwargs = (getattr(request, 'parser_context', None) or {}).get('kwargs') or {}
+        access_token = kwargs.get('identifier') or get_identifier(request)
 
         if access_token:
             try:
-                access_token_obj = AccessToken.objects.get(token=access_token)
-                return access_token_obj.user
+                resolved = resolve_token(access_token)
+                return (resolved.user, resolved)
             except AccessToken.DoesNotExist:
                 pass
 
-        return None
\ No newline at end of file
+        return None
+
+
+# Signal Method(s)
+def invalidate_token(sender, instance, **kwargs):
+    """
+    After saving (e.g. refreshing) or deleting (revoking) an access token, drops it from the token cache.
+    """
+
+    token_cache.invalidate(instance.token)
+
+
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """
+    After deleting a User instance, drops the cached tokens of that user.
+    """
+
+    token_cache.invalidate_where(lambda token, cached: cached[0] == instance.pk)
@@ -0,0 +1,141 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TTLCache(object):
+    """
+    Thread-safe, process-local cache with a maximum size (least recently used entries are evicted first)
+    and a time-to-live per entry.
+
+    The cache also carries a version number. Bumping it drops every entry, and values computed under an
+    older version are refused by `set`, so a slow computation that started before the bump cannot store
+    a stale result after it.
+    """
+
+    def __init__(self, maxsize=1000, ttl=300, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.version = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stamp = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires = entry
+
+            if expires <= self.timer():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            # Mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+
+            return value
+
+    def set(self, key, value, ttl=None, version=None):
+        """
+        Stores a value. `ttl` overrides the cache's default time-to-live; the value is discarded if `version`
+        is given and no longer matches the cache's version.
+        """
+
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self.timer() + (self.ttl if ttl is None else ttl))
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """
+        Drops every entry whose (key, value) pair satisfies `predicate`.
+        """
+
+        with self._lock:
+            for key in [key for key, (value, expires) in self._entries.items() if predicate(key, value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def bump_version(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+            return self.version
+
+    def follow(self, stamp):
+        """
+        Bumps the version if `stamp`, e.g. a version stamp shared by every process, changed since the last call.
+        Returns the current version.
+        """
+
+        with self._lock:
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self.version += 1
+                self._entries.clear()
+
+            return self.version
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+# PredictionIO recommendations per user id, with the user's version stamp when they were cached; the version follows
+# the shared recommendation model version stamp
+recommendation_cache = TTLCache(
+    maxsize=getattr(settings, 'PIO_RECOMMENDATION_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'PIO_RECOMMENDATION_CACHE_TTL', 600)
+)
+
+
+# Signal Method(s)
+def invalidate_owner_recommendations(sender, instance, **kwargs):
+    """
+    After saving or deleting an item instance, drops the cached recommendations of its owner.
+    """
+
+    recommendation_cache.invalidate(instance.owner_id)
@@ -0,0 +1,253 @@
+import heapq, logging, time
+
+from collections import defaultdict, deque
+
+from django.conf import settings
+
+from swapp_api.push import push_queue
+from swapp_api.workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUMMARY_FORMAT = u"{alert} (+{more} more)"
+
+
+class Window(object):
+    """
+    Coalescing window of one (recipient, type) pair: the latest notification submitted while it is open, and how
+    many were submitted.
+    """
+
+    __slots__ = ('user_id', 'type', 'closes_at', 'count', 'registration_ids', 'alert', 'badge', 'extra')
+
+    def __init__(self, user_id, type):
+        self.user_id = user_id
+        self.type = type
+        self.closes_at = None
+        self.count = 0
+        self.registration_ids = ()
+        self.alert = None
+        self.badge = None
+        self.extra = None
+
+    def hold(self, registration_ids, alert, badge, extra):
+        self.count += 1
+        self.registration_ids = registration_ids
+        self.alert = alert
+        self.badge = badge
+        self.extra = extra
+
+    def release(self):
+        self.count = 0
+        self.registration_ids = ()
+        self.alert = self.badge = self.extra = None
+
+
+class PushCoalescer(BackgroundWorker):
+    """
+    Shapes the push notifications sent to each recipient before they reach the push queue.
+
+    The first notification of a (recipient, type) pair is sent at once and opens a `window` seconds long window.
+    Notifications submitted while it is open are held; when it closes, the latest of them is sent as a summary
+    that counts the others (e.g. "From Ana: see you (+4 more)"), with the latest badge count, and a new window
+    opens. A burst of chat messages thus costs at most one push per window.
+
+    Each recipient is sent at most `rate_limit` pushes per `rate_period` seconds over all types; a notification
+    over the limit is held in its window until the limit allows it. A `window` of 0 sends every notification at
+    once. Windows and limits are kept per process.
+    """
+
+    worker_name = 'push-coalescer'
+
+    def __init__(self, window=None, rate_limit=None, rate_period=None, summary_format=None, queue=None):
+        self.window = window if window is not None else getattr(settings, 'PUSH_COALESCE_WINDOW', 5)
+        self.rate_limit = rate_limit if rate_limit is not None else getattr(settings, 'PUSH_RATE_LIMIT', 10)
+        self.rate_period = rate_period or getattr(settings, 'PUSH_RATE_PERIOD', 60)
+        self.summary_format = summary_format or getattr(settings, 'PUSH_SUMMARY_FORMAT', DEFAULT_SUMMARY_FORMAT)
+        self.queue = queue or push_queue
+
+        self.submitted = 0
+        self.delivered = 0
+        self.suppressed = 0
+        self.deferred = 0
+        self.summaries = 0
+        self.by_type = defaultdict(lambda: {'delivered': 0, 'suppressed': 0})
+
+        super(PushCoalescer, self).__init__()
+
+    def submit(self, user_id, registration_ids, type, alert, badge=None, extra=None):
+        """
+        Submits a notification to the devices of a recipient. Returns True if it was sent at once, False if it is
+        held in its window.
+        """
+
+        self._check_pid()
+
+        if not self.window:
+            with self._condition:
+                self.submitted += 1
+
+            self._deliver(user_id, type, registration_ids, alert, badge, extra, 1)
+            return True
+
+        now = time.time()
+        key = (user_id, type)
+
+        with self._condition:
+            self._ensure_workers()
+            self.submitted += 1
+            window = self._windows.get(key)
+
+            if window is None:
+                window = self._windows[key] = Window(user_id, type)
+
+                if self._take(user_id, now):
+                    self._schedule(window, now + self.window)
+                    send = True
+                else:
+                    window.hold(registration_ids, alert, badge, extra)
+                    self.deferred += 1
+                    self._schedule(window, self._next_allowed(user_id))
+                    send = False
+            else:
+                window.hold(registration_ids, alert, badge, extra)
+                send = False
+
+        if send:
+            self._deliver(user_id, type, registration_ids, alert, badge, extra, 1)
+
+        return send
+
+    def join(self, timeout=None):
+        """
+        Blocks until no notification is held anymore. Returns False if `timeout` seconds elapsed first.
+        """
+
+        with self._condition:
+            return self._wait_until(
+                lambda: not self._delivering and not any(window.count for window in self._windows.values()), timeout)
+
+    def _stats(self):
+        return {
+            'submitted': self.submitted,
+            'delivered': self.delivered,
+            'suppressed': self.suppressed,
+            'deferred': self.deferred,
+            'summaries': self.summaries,
+            'held': sum(window.count for window in self._windows.values()),
+            'open_windows': len(self._windows),
+            'by_type': dict((type, dict(counts)) for type, counts in self.by_type.items()),
+        }
+
+    def _reset(self):
+        self._windows = {}
+        self._deadlines = []
+        self._sent = {}
+        self._delivering = 0
+        self._last_sweep = time.time()
+
+    def _schedule(self, window, closes_at):
+        window.closes_at = closes_at
+        heapq.heappush(self._deadlines, (closes_at, window.user_id, window.type))
+        self._condition.notify_all()
+
+    def _take(self, user_id, now):
+        """
+        Records a push to `user_id` if the rate limit allows one now. Returns False otherwise.
+        """
+
+        if not self.rate_limit:
+            return True
+
+        sent = self._sent.setdefault(user_id, deque())
+
+        while sent and sent[0] <= now - self.rate_period:
+            sent.popleft()
+
+        if len(sent) >= self.rate_limit:
+            return False
+
+        sent.append(now)
+
+        return True
+
+    def _next_allowed(self, user_id):
+        return self._sent[user_id][0] + self.rate_period
+
+    def _deliver(self, user_id, type, registration_ids, alert, badge, extra, count):
+        if count > 1:
+            alert = self.summary_format.format(alert=alert, count=count, more=count - 1)
+
+        if registration_ids:
+            self.queue.enqueue_many(registration_ids, alert, badge, extra)
+
+        with self._condition:
+            self.delivered += 1
+            self.suppressed += count - 1
+            self.summaries += 1 if count > 1 else 0
+            self.by_type[type]['delivered'] += 1
+            self.by_type[type]['suppressed'] += count - 1
+
+    def _close_due_windows(self, now):
+        """
+        Closes the windows whose deadline passed. Returns the held notifications to send, as `_deliver` arguments.
+        """
+
+        due = []
+
+        while self._deadlines and self._deadlines[0][0] <= now:
+            closes_at, user_id, type = heapq.heappop(self._deadlines)
+            window = self._windows.get((user_id, type))
+
+            if window is None or window.closes_at != closes_at:
+                continue
+
+            if not window.count:
+                # The burst is over
+                del self._windows[(user_id, type)]
+            elif self._take(user_id, now):
+                due.append((user_id, type, window.registration_ids, window.alert, window.badge, window.extra,
+                            window.count))
+                window.release()
+                self._schedule(window, now + self.window)
+            else:
+                self.deferred += 1
+                self._schedule(window, self._next_allowed(user_id))
+
+        if now - self._last_sweep >= self.rate_period:
+            # Forget the recipients that were not sent anything during the last period
+            for user_id in [user_id for user_id, sent in self._sent.items() if not sent or
+                            sent[-1] <= now - self.rate_period]:
+                del self._sent[user_id]
+
+            self._last_sweep = now
+
+        return due
+
+    def _run_forever(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.time()
+
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        break
+
+                    self._condition.wait(self._deadlines[0][0] - now if self._deadlines else None)
+
+                due = self._close_due_windows(now)
+                self._delivering = len(due)
+
+            for arguments in due:
+                try:
+                    self._deliver(*arguments)
+                except Exception as e:
+                    logger.error("Sending a coalesced push notification failed: {}".format(e))
+
+            with self._condition:
+                # Wakes up `join` once the held notifications were handed to the push queue
+                self._delivering = 0
+                self._condition.notify_all()
+
+
+push_coalescer = PushCoalescer()
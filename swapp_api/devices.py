@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from push_notifications.models import APNSDevice
+
+from swapp_api.cache import TTLCache
+
+# User id -> registration ids of the user's active devices. Devices changed through another process stay in use
+# here for at most the cache's time-to-live.
+device_cache = TTLCache(
+    maxsize=getattr(settings, 'PUSH_DEVICE_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'PUSH_DEVICE_CACHE_TTL', 60)
+)
+
+
+def user_devices(user_id):
+    """
+    Returns the registration ids of a user's active APNS devices, from `device_cache` when possible.
+    """
+
+    registration_ids = device_cache.get(user_id)
+
+    if registration_ids is None:
+        registration_ids = tuple(APNSDevice.objects.filter(user_id=user_id, active=True)
+                                                   .order_by('id')
+                                                   .values_list('registration_id', flat=True))
+        device_cache.set(user_id, registration_ids)
+
+    return registration_ids
+
+
+def invalidate_devices(registration_ids):
+    """
+    Drops the cached devices of every user owning one of `registration_ids`.
+    """
+
+    registration_ids = set(registration_ids)
+
+    device_cache.invalidate_where(lambda user_id, cached: not registration_ids.isdisjoint(cached))
+
+
+def register_device(user, registration_id):
+    """
+    Assigns the APNS device with `registration_id` to `user` and marks it active, creating it if needed, in a
+    single UPDATE for devices that are already known. A device moves to the user who last logged in on it.
+    """
+
+    updated = APNSDevice.objects.filter(registration_id=registration_id).update(user=user, active=True)
+
+    if not updated:
+        try:
+            with transaction.atomic():
+                APNSDevice.objects.create(registration_id=registration_id, user=user)
+        except IntegrityError:
+            # Registered by a concurrent request in the meantime
+            APNSDevice.objects.filter(registration_id=registration_id).update(user=user, active=True)
+
+    # The device may have been cached for its previous user, and update() sends no signals
+    invalidate_devices([registration_id])
+    device_cache.invalidate(user.id)
+
+
+def deactivate_devices(registration_ids):
+    """
+    Marks the APNS devices with `registration_ids` inactive, e.g. tokens APNS reported as invalid or uninstalled,
+    so that they are no longer sent notifications. Returns the number of devices deactivated.
+    """
+
+    registration_ids = list(registration_ids)
+
+    if not registration_ids:
+        return 0
+
+    deactivated = APNSDevice.objects.filter(registration_id__in=registration_ids, active=True).update(active=False)
+    invalidate_devices(registration_ids)
+
+    return deactivated
+
+
+# Signal Method(s)
+def invalidate_device(sender, instance, **kwargs):
+    """
+    After saving or deleting an APNS device, drops the cached devices of its user and of any previous user.
+    """
+
+    invalidate_devices([instance.registration_id])
+
+    if instance.user_id:
+        device_cache.invalidate(instance.user_id)
@@ -0,0 +1,128 @@
+import json, socket, struct, threading
+
+from binascii import hexlify
+
+from six.moves import socketserver
+
+from swapp_api.push import ERROR_COMMAND, ERROR_RESPONSE, INVALID_TOKEN
+
+FRAME_HEADER = struct.Struct("!BI")
+ITEM_HEADER = struct.Struct("!BH")
+
+# Item ids of a notification frame (command 2)
+DEVICE_TOKEN = 1
+PAYLOAD = 2
+IDENTIFIER = 3
+
+
+class PlainConnection(object):
+    """
+    Unencrypted connection with the interface of the SSL socket that `_apns_send` writes to.
+    """
+
+    def __init__(self, address):
+        self.socket = socket.create_connection(address)
+
+    def write(self, data):
+        self.socket.sendall(data)
+
+    def recv(self, size):
+        return self.socket.recv(size)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def close(self):
+        self.socket.close()
+
+
+def read_exactly(connection, size):
+    data = b""
+
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+
+        if not chunk:
+            return None
+
+        data += chunk
+
+    return data
+
+
+def parse_frame(frame):
+    """
+    Returns the (device token, payload, identifier) of a notification frame.
+    """
+
+    items = {}
+    offset = 0
+
+    while offset < len(frame):
+        item_id, length = ITEM_HEADER.unpack_from(frame, offset)
+        offset += ITEM_HEADER.size
+        items[item_id] = frame[offset:offset + length]
+        offset += length
+
+    return (hexlify(items[DEVICE_TOKEN]).decode('ascii'),
+            json.loads(items[PAYLOAD].decode('utf-8')),
+            struct.unpack("!I", items[IDENTIFIER])[0])
+
+
+class FakeAPNSServer(socketserver.ThreadingTCPServer):
+    """
+    Local stand-in for the APNS binary interface, without TLS, that records the notifications it receives.
+
+    Notifications to a token in `invalid_tokens` are answered with an "invalid token" error response, after which
+    the connection is closed, as APNS does. Once `drop_after` notifications were received, the connection is
+    closed once without any response, as by a network failure. `connect` opens a connection to it for
+    `PushQueue(connect=...)`.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            server = self.server
+
+            with server.lock:
+                server.connections += 1
+
+            while True:
+                header = read_exactly(self.request, FRAME_HEADER.size)
+
+                if header is None:
+                    return
+
+                command, length = FRAME_HEADER.unpack(header)
+                token, payload, identifier = parse_frame(read_exactly(self.request, length))
+
+                if token in server.invalid_tokens:
+                    self.request.sendall(ERROR_RESPONSE.pack(ERROR_COMMAND, INVALID_TOKEN, identifier))
+                    return
+
+                with server.lock:
+                    server.notifications.append((token, payload))
+
+                    if server.drop_after is not None and len(server.notifications) >= server.drop_after:
+                        server.drop_after = None
+                        return
+
+    def __init__(self, invalid_tokens=(), drop_after=None):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), self.Handler)
+        self.invalid_tokens = set(invalid_tokens)
+        self.drop_after = drop_after
+        self.notifications = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def connect(self):
+        return PlainConnection(self.server_address)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -1,7 +1,7 @@
 import logging
 from django.db.models import ImageField
 from easy_thumbnails.fields import ThumbnailerImageField
-from swapp_api.utils import resize_image, optimize_image
+from swapp_api.images import existing_renditions, get_renditions, image_pool, rendition_name, renditions_generated
 
 
 logger = logging.getLogger(__name__)
@@ -9,11 +9,10 @@ logger = logging.getLogger(__name__)
 
 class AutoResizeImageField(ThumbnailerImageField):
     """
-    This class subclasses the djang.db.modelsImageField and uses
-    imagemagick to downsize images using the convert command and not
-    providing the excalamatory mark (!) to maintain aspect ratio of
-    image when resizing. This results in image having resized when
-    it exceeds the provided width or height limit.
+    This class subclasses easy_thumbnails' ThumbnailerImageField and
+    hands new images to the image pool, which downsizes them with Pillow
+    while keeping their aspect ratio. This results in image having
+    resized when it exceeds the provided width or height limit.
     """
 
     def __init__(self, verbose_name=None, name=None, width_field=None,
@@ -26,26 +25,61 @@ class AutoResizeImageField(ThumbnailerImageField):
                                                     height_field, \
                                                     **kwargs)
     def pre_save(self, model_instance, add):
-        "Returns field's value just before saving."
+        """
+        Returns field's value just before saving.
+
+        A newly uploaded image is queued in the image pool for resizing, optimization and generating its renditions
+        (see `swapp_api.images.rendition_url`), and the job is stored on the instance as `<field name>_job` so that
+        callers can wait for it or check its status. Once the renditions are generated, `renditions_generated` is
+        sent with the instance.
+
+        With a content-addressed storage, the image is resized and optimized before it is named, since a stored
+        file is never rewritten, and only its renditions are generated in the background. Content that was already
+        stored needs neither.
+        """
+        field_file = getattr(model_instance, self.attname)
+
+        if field_file and not field_file._committed and hasattr(self.storage, 'upload'):
+            upload = self.storage.upload(field_file, field_file.name, process=self.process)
+            field_file.save(field_file.name, upload, save=False)
+
+            if upload.deduplicated:
+                for alias in get_renditions():
+                    self.storage.touch(rendition_name(field_file.name, alias))
+            else:
+                self.submit(model_instance, field_file, process=False)
+
+            return super(AutoResizeImageField, self).pre_save(model_instance, add)
+
+        uploaded = bool(field_file) and not field_file._committed
         file = super(AutoResizeImageField, self).pre_save(model_instance, add)
 
-        if file:
-            # resize
-            if self.max_width or self.max_height:
-                width = self.max_width or self.max_height
-                height = self.max_height or self.max_width
-                try:
-                    if file.width > self.max_width or file.height > self.max_height:
-                        resize_image(file.path, width, height)
-                except Exception as e:
-                    error = str(e)
-                    logger.error(error)
-
-            # optimize
-            optimize_image(file.path)
+        if file and uploaded:
+            self.submit(model_instance, file)
 
         return file
 
+    def process(self, path):
+        """
+        Resizes and optimizes the image at `path` in the image pool, and waits for it.
+        """
+
+        image_pool.submit(path, self.max_width, self.max_height).wait()
+
+    def submit(self, model_instance, field_file, process=True):
+        name = field_file.name
+
+        def generated(job):
+            # Payloads built while the renditions were generated remembered them as missing
+            for alias in job.renditions:
+                existing_renditions.invalidate(rendition_name(name, alias))
+
+            renditions_generated.send(sender=model_instance.__class__, instance=model_instance)
+
+        job = image_pool.submit(field_file.path, self.max_width, self.max_height, sorted(get_renditions()), process,
+                                generated)
+        setattr(model_instance, '{}_job'.format(self.name), job)
+
     def south_field_triple(self):
         "Returns a suitable description of this field for South."
         # We'll just introspect the _actual_ field.
@@ -0,0 +1,356 @@
+import logging, os, threading, time
+
+from collections import deque
+
+from django.conf import settings
+from django.dispatch import Signal
+
+from swapp_api.cache import TTLCache
+from swapp_api.workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+# Formats re-encoded by `process_image`; other formats are only resized
+JPEG = 'JPEG'
+PNG = 'PNG'
+
+# Renditions: avatars for small list icons, cards for list entries and details for single-object pages
+AVATAR = 'avatar'
+CARD = 'card'
+DETAIL = 'detail'
+
+# Named renditions generated for every uploaded image: the box the rendition fits in, and whether the image is
+# cropped to fill it
+DEFAULT_RENDITIONS = {
+    AVATAR: {'size': (96, 96), 'crop': True},
+    CARD: {'size': (400, 400), 'crop': False},
+    DETAIL: {'size': (1080, 1080), 'crop': False},
+}
+
+# Whether renditions exist, by name, so that payloads do not check the storage for them on every request. Missing
+# renditions are only remembered for a few seconds, as they are usually being generated.
+existing_renditions = TTLCache(maxsize=50000, ttl=60*60)
+
+# Sent with the model instance whose image's renditions were generated in the image pool, since payloads showing
+# them changed
+renditions_generated = Signal(providing_args=['instance'])
+
+
+def get_renditions():
+    return getattr(settings, 'IMAGE_RENDITIONS', DEFAULT_RENDITIONS)
+
+
+def rendition_name(name, alias):
+    """
+    Returns the name of a rendition of an image: `item/photo.jpg` has its card rendition at `item/photo.card.jpg`.
+    """
+
+    root, extension = os.path.splitext(name)
+
+    return "{}.{}{}".format(root, alias, extension)
+
+
+def rendition_url(field_file, alias):
+    """
+    Returns the URL of a rendition of an image field's file, or the URL of the file itself while the rendition has
+    not been generated yet. Returns "" if there is no file.
+    """
+
+    if not field_file:
+        return ""
+
+    name = rendition_name(field_file.name, alias)
+    exists = existing_renditions.get(name)
+
+    if exists is None:
+        exists = field_file.storage.exists(name)
+        existing_renditions.set(name, exists,
+                                ttl=None if exists else getattr(settings, 'IMAGE_MISSING_RENDITION_TTL', 5))
+
+    return field_file.storage.url(name) if exists else field_file.url
+
+
+def encode(image, path, image_format, quality=None):
+    """
+    Encodes an image to `path` without metadata, optimized for its format.
+    """
+
+    options = {}
+
+    if image_format == JPEG:
+        options = {'quality': quality or getattr(settings, 'IMAGE_JPEG_QUALITY', 85), 'optimize': True,
+                   'progressive': True}
+
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    elif image_format == PNG:
+        options = {'optimize': True}
+
+    image.save(path, image_format, **options)
+
+
+def save_image(image, path, image_format, quality=None):
+    """
+    Encodes an image to `path` atomically, replacing any file there.
+    """
+
+    temporary_path = "{}.tmp{}".format(path, os.getpid())
+
+    try:
+        encode(image, temporary_path, image_format, quality)
+        os.rename(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def generate_renditions(path, aliases=None):
+    """
+    Generates the named renditions of the image at `path` next to it. Returns the paths of the renditions.
+    """
+
+    from PIL import Image, ImageOps
+
+    renditions = get_renditions()
+    source = Image.open(path)
+    source.load()
+    paths = []
+
+    for alias in (aliases if aliases is not None else sorted(renditions)):
+        size = tuple(renditions[alias]['size'])
+
+        if renditions[alias].get('crop'):
+            image = ImageOps.fit(source, size, Image.ANTIALIAS)
+        else:
+            image = source.copy()
+            image.thumbnail(size, Image.ANTIALIAS)
+
+        rendition_path = rendition_name(path, alias)
+        save_image(image, rendition_path, source.format)
+        paths.append(rendition_path)
+
+    return paths
+
+
+def process_image(path, max_width=None, max_height=None, quality=None):
+    """
+    Downsizes the image at `path` to fit within `max_width` x `max_height`, keeping its aspect ratio, and re-encodes
+    it without metadata. The file is replaced atomically, and only if the image was resized or the new encoding is
+    smaller. Returns True if the file was replaced.
+    """
+
+    from PIL import Image
+
+    image = Image.open(path)
+    image_format = image.format
+    resized = False
+
+    if max_width or max_height:
+        width = max_width or max_height
+        height = max_height or max_width
+
+        if image.size[0] > width or image.size[1] > height:
+            image.thumbnail((width, height), Image.ANTIALIAS)
+            resized = True
+
+    temporary_path = "{}.tmp{}".format(path, os.getpid())
+
+    try:
+        encode(image, temporary_path, image_format, quality)
+
+        if resized or os.path.getsize(temporary_path) < os.path.getsize(path):
+            os.rename(temporary_path, path)
+            return True
+
+        return False
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+class ImageJob(object):
+    """
+    Handle on an image queued in an ImagePool, in the manner of a future: `wait` blocks until the job is finished,
+    and `status`, `error`, `queue_time` and `run_time` describe how it went. `callback(job)` is called from the
+    worker once the image is processed and its renditions generated.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path, max_width=None, max_height=None, renditions=(), process=True, callback=None):
+        self.path = path
+        self.max_width = max_width
+        self.max_height = max_height
+        self.renditions = renditions
+        self.process = process
+        self.callback = callback
+
+        self.status = self.PENDING
+        self.error = None
+        self.replaced = False
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self._finished = threading.Event()
+
+    def __repr__(self):
+        return "<ImageJob {} ({})>".format(self.path, self.status)
+
+    @property
+    def queue_time(self):
+        return (self.started_at or time.time()) - self.enqueued_at
+
+    @property
+    def run_time(self):
+        return None if self.started_at is None else (self.finished_at or time.time()) - self.started_at
+
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the job is finished. Returns False if `timeout` seconds elapsed first.
+        """
+
+        self._finished.wait(timeout)
+
+        return self._finished.is_set()
+
+    def run(self):
+        self.status = self.RUNNING
+        self.started_at = time.time()
+
+        try:
+            if self.process:
+                self.replaced = process_image(self.path, self.max_width, self.max_height)
+
+            if self.renditions:
+                generate_renditions(self.path, self.renditions)
+
+            if self.callback is not None:
+                self.callback(self)
+
+            self.status = self.DONE
+        except Exception as e:
+            self.status = self.FAILED
+            self.error = e
+            logger.error("Processing image {} failed: {}".format(self.path, e))
+        finally:
+            self.finished_at = time.time()
+            self._finished.set()
+
+
+class ImagePool(BackgroundWorker):
+    """
+    Bounded pool of worker threads that process uploaded images with Pillow, which does its decoding, resizing and
+    encoding without holding the GIL.
+
+    At most `max_queue` jobs wait in the queue; `submit` blocks while it is full, so that a burst of uploads slows
+    down their requests instead of piling up work on the host.
+    """
+
+    worker_name = 'image-worker'
+
+    def __init__(self, workers=None, max_queue=None, history=100):
+        self.workers = workers or getattr(settings, 'IMAGE_WORKERS', 2)
+        self.max_queue = max_queue or getattr(settings, 'IMAGE_QUEUE_SIZE', 100)
+
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.run_time_total = 0.0
+        self.run_time_max = 0.0
+        self.queue_time_max = 0.0
+        self.recent = deque(maxlen=history)
+
+        super(ImagePool, self).__init__()
+
+    def submit(self, path, max_width=None, max_height=None, renditions=(), process=True, callback=None):
+        """
+        Queues the image at `path` for processing (unless `process` is False) and for generating the named
+        `renditions`, and returns its ImageJob. `callback(job)` is called once they are done.
+        """
+
+        job = ImageJob(path, max_width, max_height, renditions, process, callback)
+        self._check_pid()
+
+        with self._condition:
+            self._ensure_workers(self.workers)
+
+            while len(self._queue) >= self.max_queue:
+                self._condition.wait()
+
+            self._queue.append(job)
+            self.submitted += 1
+            self._condition.notify_all()
+
+        return job
+
+    def join(self, timeout=None):
+        """
+        Blocks until every submitted job is finished. Returns False if `timeout` seconds elapsed first.
+        """
+
+        with self._condition:
+            return self._wait_until(lambda: not self._queue and not self._running, timeout)
+
+    def _stats(self):
+        finished = self.processed + self.failed
+
+        return {
+            'workers': self.workers,
+            'queue_depth': len(self._queue),
+            'running': self._running,
+            'submitted': self.submitted,
+            'processed': self.processed,
+            'failed': self.failed,
+            'run_time_average': self.run_time_total / finished if finished else 0.0,
+            'run_time_max': self.run_time_max,
+            'queue_time_max': self.queue_time_max,
+            'recent': [
+                {'path': job.path, 'status': job.status, 'queue_time': job.queue_time, 'run_time': job.run_time}
+                for job in self.recent
+            ],
+        }
+
+    def _reset(self):
+        self._queue = deque()
+        self._running = 0
+
+    def _run_forever(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+
+                job = self._queue.popleft()
+                self._running += 1
+
+                # Room was made for requests blocked on a full queue
+                self._condition.notify_all()
+
+            job.run()
+
+            with self._condition:
+                self._running -= 1
+
+                if job.status == ImageJob.DONE:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+
+                self.run_time_total += job.run_time
+                self.run_time_max = max(self.run_time_max, job.run_time)
+                self.queue_time_max = max(self.queue_time_max, job.queue_time)
+                self.recent.append(job)
+                self._condition.notify_all()
+
+            logger.debug("Processed image {} in {:.3f}s after {:.3f}s in queue".format(
+                job.path, job.run_time, job.queue_time))
+
+
+image_pool = ImagePool()
@@ -0,0 +1,112 @@
+import base64
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(date, id):
+    """
+    Returns an opaque cursor for the (date, id) position of the last object of a page.
+    """
+
+    position = "{}|{}".format(date.isoformat(), id)
+
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (date, id) position encoded in a cursor. Raises ValueError if the cursor is malformed.
+    """
+
+    try:
+        date, id = base64.urlsafe_b64decode(str(cursor)).decode('utf-8').rsplit('|', 1)
+        date = parse_datetime(date)
+        id = int(id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+    if date is None:
+        raise ValueError("Invalid cursor")
+
+    return date, id
+
+
+def wants_legacy_response(request):
+    """
+    Checks if the client wants the old, unpaginated response shape. Clients that already shipped send neither a
+    cursor nor a page size, so they get it by default; `?legacy=0` or `?legacy=1` chooses explicitly. Setting
+    `LEGACY_LIST_RESPONSES` to False paginates by default once those clients are retired.
+    """
+
+    legacy = request.GET.get('legacy')
+
+    if legacy is not None:
+        return legacy.lower() in ('1', 'true')
+
+    if 'cursor' in request.GET or 'page_size' in request.GET:
+        return False
+
+    return getattr(settings, 'LEGACY_LIST_RESPONSES', True)
+
+
+def get_page_size(request):
+    maximum = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+
+    try:
+        page_size = int(request.GET.get('page_size', getattr(settings, 'PAGINATION_PAGE_SIZE', DEFAULT_PAGE_SIZE)))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+
+    return max(1, min(page_size, maximum))
+
+
+def paginate_queryset(request, queryset, date_field):
+    """
+    Returns one page of a queryset, newest first by (`date_field`, id), and the cursor of the next page (or None).
+
+    The page is selected with a keyset condition on the cursor's position rather than an offset, so later pages
+    cost the same as the first one.
+    """
+
+    page_size = get_page_size(request)
+    queryset = queryset.order_by('-{}'.format(date_field), '-id')
+    cursor = request.GET.get('cursor')
+
+    if cursor:
+        date, id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{'{}__lt'.format(date_field): date}) |
+                                   Q(**{date_field: date, 'id__lt': id}))
+
+    objects = list(queryset[:page_size + 1])
+
+    return page(objects, page_size, lambda obj: getattr(obj, date_field))
+
+
+def paginate_list(request, objects, get_date):
+    """
+    Same as `paginate_queryset`, for a list of objects already in memory. `get_date` returns the date of an object.
+    """
+
+    page_size = get_page_size(request)
+    objects = sorted(objects, key=lambda obj: (get_date(obj), obj.id), reverse=True)
+    cursor = request.GET.get('cursor')
+
+    if cursor:
+        position = decode_cursor(cursor)
+        objects = [obj for obj in objects if (get_date(obj), obj.id) < position]
+
+    return page(objects[:page_size + 1], page_size, get_date)
+
+
+def page(objects, page_size, get_date):
+    if len(objects) <= page_size:
+        return objects, None
+
+    last = objects[page_size - 1]
+
+    return objects[:page_size], encode_cursor(get_date(last), last.id)
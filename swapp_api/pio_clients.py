@@ -0,0 +1,63 @@
+import os, threading
+
+
+class ClientRegistry(object):
+    """
+    Shared registry of PredictionIO clients that are built on first use instead of at import time.
+
+    Clients own threads and connections, which do not survive a fork; when the registry is used from a process other
+    than the one that built its clients (e.g. a forked gunicorn worker), it starts over with fresh clients.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    def get(self, name):
+        self._check_pid()
+        client = self._clients.get(name)
+
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+
+                if client is None:
+                    client = self._clients[name] = self._factories[name]()
+
+        return client
+
+    def built(self):
+        """
+        Returns the names of the clients built so far by this process.
+        """
+
+        self._check_pid()
+
+        return sorted(self._clients.keys())
+
+    def warm(self):
+        """
+        Builds every registered client now, e.g. to move their cost out of the first request.
+        """
+
+        for name in list(self._factories.keys()):
+            self.get(name)
+
+    def reset(self):
+        with self._lock:
+            self._clients = {}
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # The parent's lock may have been held at fork time, so it is replaced rather than acquired
+            self._lock = threading.Lock()
+            self._clients = {}
+            self._pid = os.getpid()
+
+
+clients = ClientRegistry()
@@ -1,76 +1,318 @@
-import os, predictionio, random
+import json, logging, time
+
+from collections import deque
+from datetime import datetime
+
+import requests
 
 from django.conf import settings
 
+from swapp_api.cache import recommendation_cache
+from swapp_api.pio_clients import clients
+from swapp_api.pio_spool import EventSpool
+from swapp_api.versioning import bump_user_versions
+from swapp_api.workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+# PredictionIO apps, each with its own access key
+RECOMMENDATION = 'recommendation'
+SIMILAR = 'similar'
+
+# The event server accepts at most 50 events per batch request
+MAX_BATCH_SIZE = 50
+
+
+def event_time():
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def user_set_event(user_id):
+    return {
+        "event": "$set",
+        "entityType": "user",
+        "entityId": "u{}".format(user_id),
+        "eventTime": event_time(),
+    }
+
+
+def item_set_event(item_id, subcategory_id):
+    return {
+        "event": "$set",
+        "entityType": "item",
+        "entityId": "i{}".format(item_id),
+        "properties": {
+            "categories": ["cat{}".format(subcategory_id)]
+        },
+        "eventTime": event_time(),
+    }
+
+
+def user_item_event(event, user_id, item_id, properties=None):
+    data = {
+        "event": event,
+        "entityType": "user",
+        "entityId": "u{}".format(user_id),
+        "targetEntityType": "item",
+        "targetEntityId": "i{}".format(item_id),
+        "eventTime": event_time(),
+    }
+
+    if properties:
+        data["properties"] = properties
+
+    return data
+
+
+class EventDispatcher(BackgroundWorker):
+    """
+    Queues PredictionIO events and sends them to the event server's batch API from a background thread.
+
+    A batch is flushed once `batch_size` events are queued or the oldest queued event is `flush_interval` seconds old.
+    The queue holds at most `max_queue` events; when it is full, `overflow` decides what happens to a new event:
+
+        'drop_oldest': the oldest queued event is dropped (default)
+        'drop_newest': the new event is dropped
+        'block': the caller waits for room in the queue
+
+    `enqueue(..., block=True)` forces the blocking behavior for bulk producers.
+
+    If a `spool` is given, batches that cannot reach the event server are written to it instead of being lost, and
+    the spool is replayed (at most every `replay_interval` seconds) once the server accepts batches again.
+    """
+
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    BLOCK = 'block'
+
+    worker_name = 'pio-events'
+
+    def __init__(self, url=None, access_keys=None, batch_size=None, flush_interval=None, max_queue=None,
+                 overflow=None, timeout=10, spool=None, replay_interval=None):
+        self.url = url or settings.PIO_EVENT_URL
+        self.access_keys = access_keys or {
+            RECOMMENDATION: settings.PIO_ACCESS_KEY_RECOMMENDATION,
+            SIMILAR: settings.PIO_ACCESS_KEY_SIMILAR,
+        }
+        self.batch_size = min(batch_size or getattr(settings, 'PIO_EVENT_BATCH_SIZE', MAX_BATCH_SIZE), MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval or getattr(settings, 'PIO_EVENT_FLUSH_INTERVAL', 1.0)
+        self.max_queue = max_queue or getattr(settings, 'PIO_EVENT_MAX_QUEUE', 10000)
+        self.overflow = overflow or getattr(settings, 'PIO_EVENT_OVERFLOW', self.DROP_OLDEST)
+        self.timeout = timeout
+        self.spool = spool
+        self.replay_interval = replay_interval or getattr(settings, 'PIO_SPOOL_REPLAY_INTERVAL', 30)
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.spooled = 0
+        self.batches = 0
+        self.flush_time_total = 0.0
+        self.flush_time_max = 0.0
+        self.event_age_max = 0.0
+
+        super(EventDispatcher, self).__init__()
+
+    def enqueue(self, app, event, block=None):
+        """
+        Queues an event for the given app. Returns False if the event was dropped because the queue is full.
+        """
+
+        block = self.overflow == self.BLOCK if block is None else block
+
+        with self._condition:
+            while len(self._queue) >= self.max_queue:
+                if block:
+                    self._ensure_workers()
+                    self._condition.wait()
+                elif self.overflow == self.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                else:
+                    self._queue.popleft()
+                    self.dropped += 1
+
+            self._queue.append((app, event, time.time()))
+            self.enqueued += 1
+            self._ensure_workers()
+
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify_all()
+
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every queued event has been sent (or has failed). Returns False if `timeout` seconds elapsed first.
+        """
+
+        with self._condition:
+            self._ensure_workers()
+            self._flush_requested = True
+            self._condition.notify_all()
+
+            if not self._wait_until(lambda: not self._queue and not self._in_flight, timeout):
+                return False
+
+            self._flush_requested = False
+
+        return True
+
+    def stats(self):
+        stats = super(EventDispatcher, self).stats()
+
+        if self.spool:
+            stats['spool'] = self.spool.stats()
+
+        return stats
+
+    def send_batch(self, app, events):
+        """
+        Posts events of one app to the batch API. Returns the events the server rejected.
+        """
+
+        response = requests.post(
+            "{}/batch/events.json".format(self.url.rstrip('/')),
+            params={'accessKey': self.access_keys[app]},
+            data=json.dumps(events),
+            headers={'Content-Type': 'application/json'},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        return [event for event, result in zip(events, response.json()) if result.get('status') != 201]
+
+    def _stats(self):
+        return {
+            'queue_depth': len(self._queue),
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'sent': self.sent,
+            'failed': self.failed,
+            'spooled': self.spooled,
+            'batches': self.batches,
+            'flush_time_average': self.flush_time_total / self.batches if self.batches else 0.0,
+            'flush_time_max': self.flush_time_max,
+            'event_age_max': self.event_age_max,
+        }
+
+    def _reset(self):
+        self._queue = deque()
+        self._in_flight = 0
+        self._flush_requested = False
+        self._last_replay = 0
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                if self._queue:
+                    age = time.time() - self._queue[0][2]
+
+                    if len(self._queue) >= self.batch_size or age >= self.flush_interval or self._flush_requested:
+                        break
+
+                    self._condition.wait(self.flush_interval - age)
+                else:
+                    self._flush_requested = False
+                    self._condition.wait()
+
+            batch = [self._queue.popleft() for i in range(min(self.batch_size, len(self._queue)))]
+            self._in_flight = len(batch)
+
+            # Room was made for producers blocked on a full queue
+            self._condition.notify_all()
+
+            return batch
+
+    def _run_forever(self):
+        while True:
+            batch = self._next_batch()
+            started = time.time()
+            failed = 0
+            spooled = 0
+
+            for app in set(app for app, event, enqueued_at in batch):
+                events = [event for event_app, event, enqueued_at in batch if event_app == app]
+
+                try:
+                    failed += len(self.send_batch(app, events))
+                except Exception as e:
+                    logger.error("PredictionIO batch of {} events failed: {}".format(len(events), e))
+
+                    if self.spool:
+                        self.spool.append(app, events)
+                        spooled += len(events)
+                    else:
+                        failed += len(events)
+
+            finished = time.time()
+
+            with self._condition:
+                self.batches += 1
+                self.sent += len(batch) - failed - spooled
+                self.failed += failed
+                self.spooled += spooled
+                self.flush_time_total += finished - started
+                self.flush_time_max = max(self.flush_time_max, finished - started)
+                self.event_age_max = max([self.event_age_max] + [finished - item[2] for item in batch])
+                self._in_flight = 0
+                self._condition.notify_all()
+
+            if self.spool and spooled < len(batch) and finished - self._last_replay >= self.replay_interval:
+                self._replay()
+
+    def _replay(self):
+        self._last_replay = time.time()
+
+        try:
+            if self.spool.has_pending():
+                sent = self.spool.drain(self.send_batch, self.batch_size)
+                logger.info("Replayed {} spooled PredictionIO events".format(sent))
+        except Exception as e:
+            logger.error(e)
+
+
+clients.register('event_dispatcher', lambda: EventDispatcher(spool=EventSpool()))
+
+
 class PIOEvent(object):
-    client_recommendation = predictionio.EventClient(
-        access_key=settings.PIO_ACCESS_KEY_RECOMMENDATION,
-        url=settings.PIO_EVENT_URL,
-        threads=5,
-        qsize=500
-    )
-
-    client_similar = predictionio.EventClient(
-        access_key=settings.PIO_ACCESS_KEY_SIMILAR,
-        url=settings.PIO_EVENT_URL,
-        threads=5,
-        qsize=500
-    )
+    """
+    Records user and item events for the recommendation and similar-product engines through the event dispatcher.
+    """
+
+    def __init__(self, dispatcher=None):
+        self.dispatcher = dispatcher or clients.get('event_dispatcher')
 
     def create_user(self, user):
-        self.client_recommendation.create_event(
-            event="$set",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-        )
-        self.client_similar.create_event(
-            event="$set",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-        )
+        self.dispatcher.enqueue(RECOMMENDATION, user_set_event(user.id))
+        self.dispatcher.enqueue(SIMILAR, user_set_event(user.id))
 
     def create_item(self, item):
-        self.client_recommendation.create_event(
-            event="$set",
-            entity_type="item",
-            entity_id="i{}".format(item.id),
-            properties={
-                "categories" : ["cat{}".format(item.subcategory.id)]
-            }
-        )
-        self.client_similar.create_event(
-            event="$set",
-            entity_type="item",
-            entity_id="i{}".format(item.id),
-            properties={
-                "categories" : ["cat{}".format(item.subcategory.id)]
-            }
-        )
+        self.dispatcher.enqueue(RECOMMENDATION, item_set_event(item.id, item.subcategory_id))
+        self.dispatcher.enqueue(SIMILAR, item_set_event(item.id, item.subcategory_id))
 
     def view_item(self, user, item):
-        self.client_similar.create_event(
-            event="view",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-            target_entity_type="item",
-            target_entity_id="i{}".format(item.id)
-        )
+        self.dispatcher.enqueue(SIMILAR, user_item_event("view", user.id, item.id))
 
     def buy_item(self, user, item):
-        self.client_recommendation.create_event(
-            event="buy",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-            target_entity_type="item",
-            target_entity_id="i{}".format(item.id)
-        )
+        self.dispatcher.enqueue(RECOMMENDATION, user_item_event("buy", user.id, item.id))
+        recommendation_cache.invalidate(user.id)
+
+        # Drops the user's recommendations cached by other processes too
+        bump_user_versions(user.id)
 
     def item_on_category(self, user, item):
-        self.client_recommendation.create_event(
-            event="rate",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-            target_entity_type="item",
-            target_entity_id="i{}".format(item.id),
-            properties= { "rating" : float(4) }
-        )
\ No newline at end of file
+        self.items_on_category(user, [item.id])
+
+    def items_on_category(self, user, item_ids):
+        """
+        Rates many items at once for `user`, waiting for room in the dispatcher's queue rather than dropping events.
+        """
+
+        for item_id in item_ids:
+            self.dispatcher.enqueue(
+                RECOMMENDATION,
+                user_item_event("rate", user.id, item_id, {"rating": float(4)}),
+                block=True
+            )
@@ -0,0 +1,246 @@
+import fcntl, json, logging, os, tempfile, threading, time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".jsonl"
+
+# File, in the spool directory, that keeps the lines that could not be decoded and the events the server rejected,
+# so that they are neither replayed forever nor lost
+QUARANTINE_NAME = "quarantine.log"
+
+
+def event_key(app, event):
+    """
+    Identity of an event for deduplication: the same event on the same entities at the same time.
+    """
+
+    return (
+        app,
+        event.get("event"),
+        event.get("entityType"),
+        event.get("entityId"),
+        event.get("targetEntityType"),
+        event.get("targetEntityId"),
+        event.get("eventTime"),
+        json.dumps(event.get("properties"), sort_keys=True),
+    )
+
+
+def compact(records):
+    """
+    Deduplicates spooled (app, event) records and drops `$set` events superseded by a later `$set` on the same
+    entity that sets at least the same properties. The remaining records keep their original order.
+    """
+
+    seen = set()
+    covered = {}
+    kept = []
+
+    for app, event in reversed(records):
+        key = event_key(app, event)
+
+        if key in seen:
+            continue
+
+        seen.add(key)
+
+        if event.get("event") == "$set":
+            entity = (app, event.get("entityType"), event.get("entityId"))
+            properties = set((event.get("properties") or {}).keys())
+
+            if entity in covered and properties.issubset(covered[entity]):
+                continue
+
+            covered[entity] = covered.get(entity, set()) | properties
+
+        kept.append((app, event))
+
+    kept.reverse()
+
+    return kept
+
+
+class EventSpool(object):
+    """
+    Append-only, segmented on-disk spool of PredictionIO events that could not be sent.
+
+    Each `append` writes a whole batch of events to the current segment and fsyncs it once. Segments are rotated once
+    they reach `segment_size` bytes, and the segment being written is locked with `flock`. `drain` replays up to
+    `max_segments` unlocked segments at a time: their events are deduplicated and compacted, sent in batches, and the
+    segments are deleted. Events that still fail to send are written back to a new segment. Lines that cannot be
+    decoded (e.g. torn by a crash in the middle of an append) and events the server rejects are moved to the
+    quarantine file instead.
+    """
+
+    def __init__(self, directory=None, segment_size=None, max_segments=None):
+        self.directory = directory or getattr(settings, 'PIO_SPOOL_DIR',
+                                              os.path.join(tempfile.gettempdir(), 'swapp-pio-spool'))
+        self.segment_size = segment_size or getattr(settings, 'PIO_SPOOL_SEGMENT_SIZE', 4*1024*1024)
+        self.max_segments = max_segments or getattr(settings, 'PIO_SPOOL_DRAIN_SEGMENTS', 16)
+
+        self.spooled = 0
+        self.drained = 0
+        self.compacted = 0
+        self.rejected = 0
+        self.quarantined = 0
+        self.last_drain_rate = 0.0
+
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._file = None
+        self._sequence = 0
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def append(self, app, events):
+        if not events:
+            return
+
+        lines = "".join(json.dumps({"app": app, "event": event}) + "\n" for event in events)
+
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_size:
+                self._rotate()
+
+            self._file.write(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.spooled += len(events)
+
+    def segments(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def has_pending(self):
+        return bool(self.segments())
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in self.segments())
+
+    def drain(self, send_batch, batch_size=50):
+        """
+        Replays spooled events with `send_batch(app, events)`, which must raise if the event server is unreachable
+        and return the events it rejected. Returns the number of events sent.
+        """
+
+        if not self._drain_lock.acquire(False):
+            return 0
+
+        try:
+            with self._lock:
+                self._close()
+                paths = self.segments()[:self.max_segments]
+
+            records = []
+            segments = []
+            undecodable = []
+
+            for path in paths:
+                segment = open(path)
+
+                try:
+                    fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    # Still being written by another process
+                    segment.close()
+                    continue
+
+                segments.append((path, segment))
+
+                for line in segment:
+                    if line.strip():
+                        try:
+                            record = json.loads(line)
+                            records.append((record["app"], record["event"]))
+                        except (ValueError, KeyError, TypeError):
+                            undecodable.append(line.rstrip("\n"))
+
+            if undecodable:
+                logger.error("Quarantined {} undecodable spooled PredictionIO events".format(len(undecodable)))
+                self._quarantine("undecodable", undecodable)
+
+            compacted = compact(records)
+            started = time.time()
+            sent = 0
+            unsent = []
+            rejected = []
+
+            for app in sorted(set(app for app, event in compacted)):
+                events = [event for event_app, event in compacted if event_app == app]
+
+                for start in range(0, len(events), batch_size):
+                    batch = events[start:start + batch_size]
+
+                    if unsent:
+                        unsent.append((app, batch))
+                        continue
+
+                    try:
+                        batch_rejected = send_batch(app, batch) or []
+                        sent += len(batch) - len(batch_rejected)
+                        rejected.extend(json.dumps({"app": app, "event": event}) for event in batch_rejected)
+                    except Exception as e:
+                        logger.error("Replaying spooled PredictionIO events failed: {}".format(e))
+                        unsent.append((app, batch))
+
+            for app, batch in unsent:
+                self.append(app, batch)
+
+            if rejected:
+                logger.error("PredictionIO rejected {} spooled events; quarantined them".format(len(rejected)))
+                self._quarantine("rejected", rejected)
+
+            for path, segment in segments:
+                os.remove(path)
+                segment.close()
+
+            elapsed = time.time() - started
+            self.drained += sent
+            self.compacted += len(records) - len(compacted)
+            self.rejected += len(rejected)
+            self.last_drain_rate = sent / elapsed if elapsed > 0 else float(sent)
+
+            return sent
+        finally:
+            self._drain_lock.release()
+
+    def stats(self):
+        segments = self.segments()
+
+        return {
+            'segments': len(segments),
+            'bytes': sum(os.path.getsize(path) for path in segments),
+            'spooled': self.spooled,
+            'drained': self.drained,
+            'compacted': self.compacted,
+            'rejected': self.rejected,
+            'quarantined': self.quarantined,
+            'last_drain_rate': self.last_drain_rate,
+        }
+
+    def _quarantine(self, reason, lines):
+        with open(os.path.join(self.directory, QUARANTINE_NAME), 'a') as quarantine:
+            quarantine.write("".join("{}\t{}\n".format(reason, line) for line in lines))
+            quarantine.flush()
+            os.fsync(quarantine.fileno())
+
+        self.quarantined += len(lines)
+
+    def _rotate(self):
+        self._close()
+        self._sequence += 1
+
+        # Names sort in creation order, and carry the pid so that processes sharing the directory do not collide
+        name = "{:016d}-{:08d}-{:06d}{}".format(int(time.time()*1000), os.getpid(), self._sequence, SEGMENT_SUFFIX)
+        self._file = open(os.path.join(self.directory, name), 'a')
+
+        # Held until the segment is closed, so that other processes do not drain it while it is written to
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,27 +1,46 @@
-import os, predictionio, random
+import heapq, logging, random
+
+import numpy as np
+
+from itertools import islice
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from item.models import Item, Category, Subcategory
+from item.models import Item, Category
+from item.utils import distances_on_unit_sphere, items_within_radius
+from swapp_api.cache import recommendation_cache
+from swapp_api.pio_clients import clients
+from swapp_api.pio_event import PIOEvent
+from swapp_api.training import training_scheduler
+from swapp_api.versioning import MODEL_VERSION_KEY, get_version, user_version_key
 from user_profile.models import UserProfile, Preference
 
+logger = logging.getLogger(__name__)
+
+# Number of candidate rows scored at once by the fallback recommender
+FALLBACK_CHUNK_SIZE = 500
+
 
 def train_system():
-    os.environ["PATH"] += "PATH=$PATH:{}".format(settings.PIO_PATH)
-    os.system("export PATH")
-    os.system("cd ../../pio_files/swapp-recommendation; pio build; pio train")
-    os.system("cd ../../pio_files/swapp-similar-product; pio build; pio train")
+    """
+    Schedules the recommendation engines to be rebuilt and retrained in the background.
+    """
+
+    training_scheduler.request()
 
 def initialize_data_on_pio():
-    users = User.objects.filter(is_active=True)
-    items = Item.objects.filter(is_available=True)
-    categories = Subcategory.objects.all()
+    """
+    Sends every active user and available item to PredictionIO through the event dispatcher.
+
+    For seeding a fresh engine, the `export_pio_data` management command writes batch-import files instead.
+    """
+
     pio = PIOEvent()
 
-    for user in users:
+    for user in User.objects.filter(is_active=True).only('id').iterator():
         pio.create_user(user)
 
-    for item in items:
+    for item in Item.objects.filter(is_available=True).only('id', 'subcategory').iterator():
         pio.create_item(item)
 
 def random_initial_data():
@@ -63,106 +82,182 @@ def lebesgue_measure(A1, A2, B1, B2):
     else:
         return False
 
+def lebesgue_measures(A1, A2, B1, B2):
+    """
+    Vectorized `lebesgue_measure`: checks one range [A1, A2] against arrays of ranges [B1, B2].
+
+    Returns a NumPy array of booleans that is True where both ranges overlap by at least 15% of their lengths.
+    """
+
+    B1 = np.asarray(B1, dtype=np.float64)
+    B2 = np.asarray(B2, dtype=np.float64)
+
+    overlaps = (B1 < A2) & (B2 > A1)
+    distance = np.minimum(A2, B2) - np.maximum(A1, B1)
+
+    # Zero-length ranges never match instead of raising ZeroDivisionError
+    with np.errstate(divide='ignore', invalid='ignore'):
+        RD1 = (distance / (A2 - A1))*100
+        RD2 = (distance / (B2 - B1))*100
+
+    return overlaps & (RD1 >= 15) & (RD2 >= 15)
+
+
+class PriceRangeIndex(object):
+    """
+    Sorted-endpoint index over the price ranges of a list of items.
+
+    A range that overlaps [A1, A2] by 15% of both lengths can be at most A2-A1 / 0.15 long, so its minimum lies in
+    a bounded window of the sorted minimums. Only that window is scored with `lebesgue_measures`.
+    """
+
+    def __init__(self, items):
+        self.items = list(items)
+
+        minimums = np.array([item.price_range_minimum for item in self.items], dtype=np.float64)
+        maximums = np.array([item.price_range_maximum for item in self.items], dtype=np.float64)
+
+        self.order = np.argsort(minimums, kind='mergesort')
+        self.minimums = minimums[self.order]
+        self.maximums = maximums[self.order]
+
+    def matching(self, minimum, maximum):
+        """
+        Returns the indexed items whose price range matches [minimum, maximum], in their original order.
+        """
+
+        length = float(maximum - minimum)
+
+        if length <= 0 or not self.items:
+            return []
+
+        start = np.searchsorted(self.minimums, minimum - length/0.15 - 1, side='left')
+        end = np.searchsorted(self.minimums, maximum, side='left')
+
+        matches = lebesgue_measures(minimum, maximum, self.minimums[start:end], self.maximums[start:end])
+        positions = np.sort(self.order[start:end][matches])
+
+        return [self.items[position] for position in positions]
+
+
+def engine_client(url_setting):
+    """
+    Returns a factory for a PredictionIO engine client; the SDK is only imported when a client is first needed.
+    """
 
-class PIOEvent(object):
-    client_recommendation = predictionio.EventClient(
-        access_key=settings.PIO_ACCESS_KEY_RECOMMENDATION,
-        url=settings.PIO_EVENT_URL,
-        threads=5,
-        qsize=500
-    )
-
-    client_similar = predictionio.EventClient(
-        access_key=settings.PIO_ACCESS_KEY_SIMILAR,
-        url=settings.PIO_EVENT_URL,
-        threads=5,
-        qsize=500
-    )
-
-    def create_user(self, user):
-        self.client_recommendation.create_event(
-            event="$set",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-        )
-        self.client_similar.create_event(
-            event="$set",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-        )
-
-    def create_item(self, item):
-        self.client_recommendation.create_event(
-            event="$set",
-            entity_type="item",
-            entity_id="i{}".format(item.id),
-            properties={
-                "categories" : ["cat{}".format(item.subcategory.id)]
-            }
-        )
-        self.client_similar.create_event(
-            event="$set",
-            entity_type="item",
-            entity_id="i{}".format(item.id),
-            properties={
-                "categories" : ["cat{}".format(item.subcategory.id)]
-            }
-        )
-
-    def view_item(self, user, item):
-        self.client_similar.create_event(
-            event="view",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-            target_entity_type="item",
-            target_entity_id="i{}".format(item.id)
-        )
-
-    def buy_item(self, user, item):
-        self.client_recommendation.create_event(
-            event="buy",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-            target_entity_type="item",
-            target_entity_id="i{}".format(item.id)
-        )
-
-    def item_on_category(self, user, item):
-        self.client_recommendation.create_event(
-            event="rate",
-            entity_type="user",
-            entity_id="u{}".format(user.id),
-            target_entity_type="item",
-            target_entity_id="i{}".format(item.id),
-            properties= { "rating" : float(4) }
-        )
+    def factory():
+        import predictionio
+
+        return predictionio.EngineClient(url=getattr(settings, url_setting))
+
+    return factory
+
+
+clients.register('engine_client_recommended', engine_client('PIO_ACCESS_URL'))
+clients.register('engine_client_similar', engine_client('PIO_SIMILAR_URL'))
 
 
 class PIOExport(object):
-    engine_client_recommended = predictionio.EngineClient(url=settings.PIO_ACCESS_URL)
-    engine_client_similar= predictionio.EngineClient(url=settings.PIO_SIMILAR_URL)
+    @property
+    def engine_client_recommended(self):
+        return clients.get('engine_client_recommended')
+
+    @property
+    def engine_client_similar(self):
+        return clients.get('engine_client_similar')
 
     def list_of_recommended_items(self, user):
+        """
+        Recommends items with the engine. Recommendations are cached per user until the model is retrained or the
+        user's data changes (e.g. an item is saved or bought), in any process, as told by the shared version stamps.
+        """
+
         try:
             preference = Preference.objects.get(user=user)
-            queryset = self.engine_client_recommended.send_query({"user": "u{}".format(int(user.id)), "num": 10})
-            item_ids = [x.get('item')[1:] for x in queryset.get('itemScores') if x.get('score') > 3.5]
+            model_version = recommendation_cache.follow(get_version(MODEL_VERSION_KEY))
+            user_version = get_version(user_version_key(user.id))
+            cached = recommendation_cache.get(user.id)
+
+            if cached is not None and cached[0] == user_version:
+                item_ids = cached[1]
+            else:
+                queryset = self.engine_client_recommended.send_query({"user": "u{}".format(int(user.id)), "num": 10})
+                item_ids = [x.get('item')[1:] for x in queryset.get('itemScores') if x.get('score') > 3.5]
 
-            if not set(map(int,item_ids)).issubset(Item.objects.all().values_list('id', flat=True)):
-                return []
+                recommendation_cache.set(user.id, (user_version, item_ids), version=model_version)
 
-            items = [Item.objects.get(id=int(x)) for x in item_ids]
-            sample_item = Item.objects.filter(owner=user)[0]
-            items_filtered = [item for item in items if item.owner != user]
+            items_filtered = self.hydrate_items(user, item_ids)
         except Exception as e:
-            items_filtered = [item for item in Item.objects.exclude(owner=user)]
+            logger.error(e)
+            items_filtered = self.list_of_fallback_items(user)
         return items_filtered
 
+    def list_of_fallback_items(self, user, limit=None):
+        """
+        Recommends items without the engine, for when PredictionIO fails.
+
+        Candidates are available items of other users, prefiltered in SQL by the user's location cells and preferred
+        categories, and streamed in chunks. Only the `limit` nearest (or, without a location, newest) items are kept in
+        a bounded heap, so memory use does not depend on the size of the catalog.
+        """
+
+        limit = limit or getattr(settings, 'PIO_FALLBACK_LIMIT', 100)
+        candidates = Item.objects.filter(is_available=True).exclude(owner=user)
+        origin = None
+
+        try:
+            profile = UserProfile.objects.get(user=user)
+
+            if profile.current_latitude is not None and profile.current_longitude is not None:
+                origin = (profile.current_latitude, profile.current_longitude, profile.distance_range)
+                candidates = items_within_radius(candidates, *origin)
+        except UserProfile.DoesNotExist:
+            pass
+
+        category_ids = [x for x in Preference.objects.filter(user=user).values_list('categories', flat=True) if x]
+
+        if category_ids:
+            candidates = candidates.filter(subcategory__parent_category__in=category_ids)
+
+        rows = candidates.values_list('id', 'latitude', 'longitude').iterator()
+        top_items = []
+
+        while True:
+            chunk = list(islice(rows, FALLBACK_CHUNK_SIZE))
+
+            if not chunk:
+                break
+
+            ids, latitudes, longitudes = zip(*chunk)
+
+            if origin:
+                distances = distances_on_unit_sphere(origin[0], origin[1], latitudes, longitudes)
+                scored = [(-distance, x) for x, distance in zip(ids, distances) if distance <= float(origin[2])]
+            else:
+                scored = [(x, x) for x in ids]
+
+            for entry in scored:
+                if len(top_items) < limit:
+                    heapq.heappush(top_items, entry)
+                else:
+                    heapq.heappushpop(top_items, entry)
+
+        return self.hydrate_items(user, [x for score, x in sorted(top_items, reverse=True)])
+
+    def hydrate_items(self, user, item_ids):
+        """
+        Resolves recommended item ids to the available items not owned by `user`, with a single query.
+
+        The items keep the order of `item_ids` (i.e. by score); ids of deleted, unavailable or owned items are dropped.
+        """
+
+        item_ids = [int(x) for x in item_ids]
+        items = Item.objects.filter(is_available=True).exclude(owner=user).in_bulk(item_ids)
+
+        return [items[x] for x in item_ids if x in items]
+
     def list_of_matching_items_by_price_range(self, current_item, recommended_items):
-        matching_items = [item for item in recommended_items if lebesgue_measure(
-            current_item.price_range_minimum,
-            current_item.price_range_maximum,
-            item.price_range_minimum,
-            item.price_range_maximum)]
+        index = recommended_items if isinstance(recommended_items, PriceRangeIndex) else PriceRangeIndex(recommended_items)
+        matching_items = index.matching(current_item.price_range_minimum, current_item.price_range_maximum)
 
         return matching_items
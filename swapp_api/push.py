@@ -0,0 +1,405 @@
+import logging, select, socket, struct, time
+
+from collections import deque
+
+from django.conf import settings
+
+from swapp_api.workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+# Error response of the APNS binary interface: command 8, status and the identifier of the rejected notification,
+# after which APNS closes the connection and ignores every notification written after the rejected one
+ERROR_RESPONSE = struct.Struct("!BBI")
+ERROR_COMMAND = 8
+INVALID_TOKEN = 8
+
+MAX_IDENTIFIER = 2**32
+
+
+class PushMessage(object):
+    __slots__ = ('registration_id', 'alert', 'badge', 'extra', 'enqueued_at', 'attempts', 'identifier', 'written_at')
+
+    def __init__(self, registration_id, alert, badge=None, extra=None):
+        self.registration_id = registration_id
+        self.alert = alert
+        self.badge = badge
+        self.extra = extra or {}
+        self.enqueued_at = time.time()
+        self.attempts = 0
+        self.identifier = None
+        self.written_at = None
+
+
+class FrameBuffer(object):
+    """
+    Stands in for the socket given to `_apns_send`, so that the frames of a batch are written to APNS at once.
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame)
+
+    def getvalue(self):
+        return b"".join(self.frames)
+
+
+class PushQueue(BackgroundWorker):
+    """
+    Queues Apple push notifications and sends them to APNS from a background thread over one persistent
+    connection, so that requests only pay for appending to the queue.
+
+    A batch is written once `batch_size` notifications are queued or the oldest queued notification is
+    `flush_interval` seconds old. Written notifications stay unconfirmed until the queue runs empty and APNS has
+    not answered with an error for `error_timeout` seconds; an error response rejects one notification and sends
+    the ones written after it again. Under a sustained load, notifications written more than `confirm_after`
+    seconds ago, and the oldest beyond `max_unconfirmed`, are taken as sent, since APNS answers errors well before;
+    the last `history` of them are kept to tell which device a late error response is about. When the connection
+    fails, the unconfirmed notifications are sent again over a new one after an exponential backoff, at most
+    `max_retries` times each; some may then be received twice.
+
+    The queue holds at most `max_queue` notifications; new ones are dropped while it is full.
+    """
+
+    worker_name = 'apns-push'
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue=None, max_retries=None, backoff=None,
+                 max_backoff=None, error_timeout=None, confirm_after=None, max_unconfirmed=None, history=10000,
+                 connect=None):
+        self.batch_size = batch_size or getattr(settings, 'PUSH_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval or getattr(settings, 'PUSH_FLUSH_INTERVAL', 0.05)
+        self.max_queue = max_queue or getattr(settings, 'PUSH_MAX_QUEUE', 10000)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'PUSH_MAX_RETRIES', 5)
+        self.backoff = backoff if backoff is not None else getattr(settings, 'PUSH_RETRY_BACKOFF', 0.5)
+        self.max_backoff = max_backoff or getattr(settings, 'PUSH_MAX_BACKOFF', 30)
+        self.error_timeout = error_timeout or getattr(settings, 'PUSH_ERROR_TIMEOUT', 0.2)
+        self.confirm_after = confirm_after or getattr(settings, 'PUSH_CONFIRM_AFTER', 5)
+        self.max_unconfirmed = max_unconfirmed or getattr(settings, 'PUSH_MAX_UNCONFIRMED', 1000)
+        self.history = history
+        self.connect = connect
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.connections = 0
+        self.write_time_total = 0.0
+        self.write_time_max = 0.0
+        self.message_age_max = 0.0
+        self.unconfirmed_max = 0
+        self.invalid_tokens = set()
+
+        super(PushQueue, self).__init__()
+
+    def enqueue(self, registration_id, alert, badge=None, extra=None):
+        """
+        Queues a notification to a device. Returns False if it was dropped because the queue is full.
+        """
+
+        return self.enqueue_many([registration_id], alert, badge, extra) == 1
+
+    def enqueue_many(self, registration_ids, alert, badge=None, extra=None):
+        """
+        Queues the same notification to several devices at once, so that they are written in the same batch.
+        Returns the number of notifications queued; the others were dropped because the queue is full.
+        """
+
+        messages = [PushMessage(registration_id, alert, badge, extra) for registration_id in registration_ids]
+        self._check_pid()
+
+        with self._condition:
+            self._ensure_workers()
+
+            room = max(self.max_queue - len(self._queue), 0)
+            self.dropped += max(len(messages) - room, 0)
+            messages = messages[:room]
+
+            self._queue.extend(messages)
+            self.enqueued += len(messages)
+
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify_all()
+
+        return len(messages)
+
+    def pop_invalid_tokens(self):
+        """
+        Returns the registration ids APNS rejected as invalid since the last call, and forgets them.
+        """
+
+        with self._condition:
+            tokens, self.invalid_tokens = self.invalid_tokens, set()
+
+        return tokens
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every queued notification has been sent (or has failed). Returns False if `timeout` seconds
+        elapsed first.
+        """
+
+        self._check_pid()
+
+        with self._condition:
+            self._ensure_workers()
+            self._flush_requested = True
+            self._condition.notify_all()
+
+            if not self._wait_until(lambda: not self._queue and not self._unconfirmed, timeout):
+                return False
+
+            self._flush_requested = False
+
+        return True
+
+    def _stats(self):
+        return {
+            'queue_depth': len(self._queue),
+            'unconfirmed': len(self._unconfirmed),
+            'unconfirmed_max': self.unconfirmed_max,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'invalid_tokens': len(self.invalid_tokens),
+            'batches': self.batches,
+            'connections': self.connections,
+            'write_time_average': self.write_time_total / self.batches if self.batches else 0.0,
+            'write_time_max': self.write_time_max,
+            'message_age_max': self.message_age_max,
+        }
+
+    def _reset(self):
+        # The connection belongs to the process that opened it
+        self._queue = deque()
+        self._unconfirmed = []
+        self._confirmed = deque(maxlen=self.history)
+        self._flush_requested = False
+        self._connection = None
+        self._identifier = 0
+        self._failures = 0
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                if self._queue:
+                    age = time.time() - self._queue[0].enqueued_at
+
+                    if len(self._queue) >= self.batch_size or age >= self.flush_interval or self._flush_requested:
+                        break
+
+                    self._condition.wait(self.flush_interval - age)
+                else:
+                    self._flush_requested = False
+                    self._condition.wait()
+
+            return [self._queue.popleft() for i in range(min(self.batch_size, len(self._queue)))]
+
+    def _next_identifier(self):
+        self._identifier = (self._identifier + 1) % MAX_IDENTIFIER
+
+        return self._identifier
+
+    def _open(self):
+        if self._connection is None:
+            from push_notifications.apns import _apns_create_socket_to_push
+
+            self._connection = (self.connect or _apns_create_socket_to_push)()
+
+            with self._condition:
+                self.connections += 1
+
+        return self._connection
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+
+            self._connection = None
+
+    def _run_forever(self):
+        while True:
+            batch = self._next_batch()
+
+            try:
+                self._write(batch)
+
+                with self._condition:
+                    idle = not self._queue
+
+                # Errors are only waited for once the queue is empty; under load they are picked up between batches
+                self._read_error(self.error_timeout if idle else 0)
+                self._failures = 0
+            except Exception as e:
+                if not self._read_late_error():
+                    logger.error("Sending push notifications to APNS failed: {}".format(e))
+                    self._retry()
+
+    def _write(self, batch):
+        from push_notifications.apns import APNSDataOverflow, _apns_send
+
+        frames = FrameBuffer()
+        written_at = time.time()
+        written = []
+        dropped = 0
+        invalid = []
+
+        for message in batch:
+            message.identifier = self._next_identifier()
+            message.written_at = written_at
+
+            try:
+                _apns_send(message.registration_id, message.alert, badge=message.badge, extra=message.extra,
+                           identifier=message.identifier, socket=frames)
+                written.append(message)
+            except APNSDataOverflow:
+                dropped += 1
+            except (TypeError, ValueError):
+                # The registration id is not a hex encoded device token
+                invalid.append(message.registration_id)
+
+        with self._condition:
+            # Added before connecting, so that they are sent again if the connection cannot be made
+            self._unconfirmed.extend(written)
+            self.unconfirmed_max = max(self.unconfirmed_max, len(self._unconfirmed))
+            self.dropped += dropped
+            self.failed += len(invalid)
+            self.invalid_tokens.update(invalid)
+            self.batches += 1
+
+        started = time.time()
+        self._open().write(frames.getvalue())
+        finished = time.time()
+
+        with self._condition:
+            self.write_time_total += finished - started
+            self.write_time_max = max(self.write_time_max, finished - started)
+            self.message_age_max = max([self.message_age_max] + [finished - item.enqueued_at for item in batch])
+
+    def _read_error(self, timeout):
+        connection = self._connection
+        pending = getattr(connection, 'pending', lambda: 0)()
+
+        if not pending and not select.select([connection], [], [], timeout)[0]:
+            with self._condition:
+                if timeout:
+                    # No error response within the timeout: every notification written so far was accepted
+                    self.sent += len(self._unconfirmed)
+                    self._unconfirmed = []
+                    self._confirmed.clear()
+                else:
+                    self._confirm_older(time.time())
+
+                self._condition.notify_all()
+
+            return
+
+        data = connection.recv(ERROR_RESPONSE.size)
+
+        if len(data) < ERROR_RESPONSE.size:
+            raise socket.error("APNS closed the connection")
+
+        command, status, identifier = ERROR_RESPONSE.unpack(data)
+        self._close()
+
+        with self._condition:
+            identifiers = [message.identifier for message in self._unconfirmed]
+            confirmed = dict((message.identifier, message) for message in self._confirmed)
+
+            if command == ERROR_COMMAND and identifier in identifiers:
+                index = identifiers.index(identifier)
+                rejected = self._unconfirmed[index]
+                self.sent += index
+                requeued = self._unconfirmed[index + 1:]
+            else:
+                # A notification rejected after it was taken as sent: the ones written since then were ignored too
+                rejected = confirmed.get(identifier) if command == ERROR_COMMAND else None
+                requeued = self._unconfirmed
+
+                if rejected is not None:
+                    self.sent -= 1
+
+            if rejected is not None:
+                logger.warning("APNS rejected a notification to {} with status {}".format(
+                    rejected.registration_id, status))
+
+                if status == INVALID_TOKEN:
+                    self.invalid_tokens.add(rejected.registration_id)
+
+                self.failed += 1
+            else:
+                logger.warning("APNS answered {} with status {} for unknown notification {}".format(
+                    command, status, identifier))
+
+            # APNS ignored the notifications written after the rejected one; they have not been attempted
+            self._queue.extendleft(reversed(requeued))
+            self._unconfirmed = []
+            self._confirmed.clear()
+            self._condition.notify_all()
+
+    def _read_late_error(self):
+        """
+        Reads the error response APNS may have sent before closing the connection, which can fail a write before
+        it is read. Returns True if there was one.
+        """
+
+        if self._connection is None:
+            return False
+
+        try:
+            self._read_error(0)
+        except Exception:
+            return False
+
+        # The connection is closed once an error response is read
+        return self._connection is None
+
+    def _confirm_older(self, now):
+        """
+        Counts as sent the unconfirmed notifications written before `confirm_after` seconds ago, and the oldest
+        beyond `max_unconfirmed`, so that they are not sent again if the connection fails.
+        """
+
+        cutoff = now - self.confirm_after
+        count = max(len(self._unconfirmed) - self.max_unconfirmed, 0)
+
+        while count < len(self._unconfirmed) and self._unconfirmed[count].written_at <= cutoff:
+            count += 1
+
+        self.sent += count
+        self._confirmed.extend(self._unconfirmed[:count])
+        del self._unconfirmed[:count]
+
+    def _retry(self):
+        self._close()
+        self._failures += 1
+
+        with self._condition:
+            requeued = []
+
+            for message in self._unconfirmed:
+                message.attempts += 1
+
+                if message.attempts > self.max_retries:
+                    self.failed += 1
+                else:
+                    requeued.append(message)
+
+            self.retried += len(requeued)
+            self._queue.extendleft(reversed(requeued))
+            self._unconfirmed = []
+            self._confirmed.clear()
+            self._condition.notify_all()
+
+        time.sleep(min(self.backoff * 2**(self._failures - 1), self.max_backoff))
+
+
+push_queue = PushQueue()
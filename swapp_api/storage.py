@@ -0,0 +1,147 @@
+import errno, hashlib, os, uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Directory, relative to the storage's location, where uploads are written before they are moved to their name
+UPLOAD_DIRECTORY = 'uploads'
+
+EXTENSION_ALIASES = {
+    '.jpeg': '.jpg',
+}
+
+
+def content_hash(content):
+    """
+    Returns the SHA-256 hex digest of a file's content, reading it in chunks.
+    """
+
+    digest = hashlib.sha256()
+
+    if hasattr(content, 'seek'):
+        content.seek(0)
+
+    for chunk in content.chunks():
+        digest.update(chunk)
+
+    if hasattr(content, 'seek'):
+        content.seek(0)
+
+    return digest.hexdigest()
+
+
+class StoredUpload(File):
+    """
+    File written to a ContentAddressedStorage's upload directory, with the hash of its final content. Saving it
+    moves it to its name instead of copying it; `deduplicated` is then True if the content was already stored.
+    """
+
+    def __init__(self, file, upload_name, digest):
+        super(StoredUpload, self).__init__(file)
+        self.upload_name = upload_name
+        self.digest = digest
+        self.size = os.path.getsize(file.name)
+        self.deduplicated = False
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files by the hash of their content, e.g. `item/3f/3fa9...e1.jpg` for a file
+    saved as `item/photo.jpg`.
+
+    Saving a file whose content is already stored writes nothing and returns the name of the existing file, so
+    several objects can share it. Files are therefore never deleted when an object stops using them; the
+    `collect_media_garbage` command deletes the files no object references anymore. A stored file is never
+    rewritten: content that must be processed (e.g. resized) is processed by `upload` before it is named.
+    """
+
+    def content_name(self, name, digest):
+        """
+        Returns the name under which content with the hash `digest`, to be saved as `name`, is stored.
+        """
+
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        extension = EXTENSION_ALIASES.get(extension, extension)
+
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def upload(self, content, name, process=None):
+        """
+        Writes `content`, to be saved as `name`, to the upload directory, lets `process(path)` rewrite it there, and
+        returns it as a StoredUpload to be saved.
+        """
+
+        if not hasattr(content, 'chunks'):
+            content = File(content)
+
+        upload_name = super(ContentAddressedStorage, self)._save(
+            os.path.join(UPLOAD_DIRECTORY, uuid.uuid4().hex + os.path.splitext(name)[1]), content)
+        path = self.path(upload_name)
+
+        try:
+            if process is not None:
+                process(path)
+
+            with open(path, 'rb') as processed:
+                digest = content_hash(File(processed))
+        except Exception:
+            os.remove(path)
+            raise
+
+        return StoredUpload(open(path, 'rb'), upload_name, digest)
+
+    def touch(self, name):
+        """
+        Refreshes the modification time of a stored file, if it exists, so that `collect_media_garbage` keeps it
+        for its grace period. Returns True if it exists.
+        """
+
+        try:
+            os.utime(self.path(name), None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+            return False
+
+        return True
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+
+        if not isinstance(content, StoredUpload):
+            content = self.upload(content, name)
+
+        name = self.content_name(name, content.digest)
+        content.close()
+
+        if self.touch(name):
+            # Re-referenced content keeps its file, refreshed so that it is not collected before the object is saved
+            os.remove(self.path(content.upload_name))
+            content.deduplicated = True
+
+            return name
+
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        # Written under a unique name first and then renamed, so that a file is never seen half-written under its
+        # final name, and two processes saving the same content at once both succeed
+        directory = os.path.dirname(self.path(name))
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        os.rename(self.path(content.upload_name), self.path(name))
+
+        return name
+
+
+content_storage = ContentAddressedStorage()
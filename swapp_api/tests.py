@@ -0,0 +1,925 @@
+import base64, hashlib, json, os, shutil, stat, tempfile, threading, time
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.utils.http import http_date
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework import status
+from rest_framework.response import Response
+
+from swapp_api.cache import TTLCache, recommendation_cache
+from swapp_api.coalescing import PushCoalescer
+from swapp_api.fake_apns import FakeAPNSServer
+from swapp_api.images import AVATAR, CARD, ImageJob, ImagePool, existing_renditions, rendition_name, rendition_url
+from swapp_api.pagination import (
+    decode_cursor,
+    encode_cursor,
+    paginate_list,
+    wants_legacy_response
+)
+from swapp_api.pio_event import RECOMMENDATION, SIMILAR, EventDispatcher, item_set_event, user_set_event
+from swapp_api.pio_spool import QUARANTINE_NAME, EventSpool
+from swapp_api.push import PushQueue
+from swapp_api.storage import UPLOAD_DIRECTORY, ContentAddressedStorage
+from swapp_api.training import EngineLock, TrainingScheduler
+from swapp_api.uploads import UploadError, decode_base64_image
+from swapp_api.versioning import (
+    MODEL_VERSION_KEY,
+    bump_user_versions,
+    bump_version,
+    conditional_response,
+    get_version,
+    user_version_key
+)
+
+
+class TTLCacheTest(SimpleTestCase):
+    """
+    Class to test the process-local cache used for PredictionIO recommendations
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = TTLCache(maxsize=2, ttl=60, timer=lambda: self.now)
+
+    def test_lru_eviction(self):
+        """
+        Test method to check if the least recently used entry is evicted when the cache is full
+
+        Expected behavior: The entry not read since it was stored be evicted, and the eviction be counted
+        """
+
+        self.cache.set(1, "first")
+        self.cache.set(2, "second")
+        self.cache.get(1)
+        self.cache.set(3, "third")
+
+        self.assertEqual(self.cache.get(1), "first")
+        self.assertEqual(self.cache.get(2), None)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl_expiration(self):
+        """
+        Test method to check if an entry expires after its time-to-live
+
+        Expected behavior: The entry be returned before its TTL and be a miss afterwards
+        """
+
+        self.cache.set(1, "first")
+        self.now += 59
+        self.assertEqual(self.cache.get(1), "first")
+
+        self.now += 2
+        self.assertEqual(self.cache.get(1), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_version_bump(self):
+        """
+        Test method to check if bumping the version drops entries and refuses values computed under the old version
+
+        Expected behavior: The cache be empty after the bump and stay empty after a stale `set`
+        """
+
+        version = self.cache.version
+        self.cache.set(1, "first")
+        self.cache.bump_version()
+        self.cache.set(2, "second", version=version)
+
+        self.assertEqual(len(self.cache), 0)
+
+    def test_follow_shared_stamp(self):
+        """
+        Test method to check if the cache follows a shared version stamp, e.g. one bumped by another process
+
+        Expected behavior: Entries be kept while the stamp is unchanged, and dropped once it changes
+        """
+
+        version = self.cache.follow(1.0)
+        self.cache.set(1, "first", version=version)
+
+        self.assertEqual(self.cache.follow(1.0), version)
+        self.assertEqual(self.cache.get(1), "first")
+        self.assertEqual(self.cache.follow(2.0), version + 1)
+        self.assertEqual(self.cache.get(1), None)
+
+
+class TrainingSchedulerTest(SimpleTestCase):
+    """
+    Class to test the background PredictionIO training scheduler against a stub `pio` command
+    """
+
+    def setUp(self):
+        self.engine_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.engine_dir, 'pio.log')
+        self.pio_path = os.path.join(self.engine_dir, 'pio')
+
+        with open(self.pio_path, 'w') as stub:
+            stub.write('#!/bin/sh\necho "$1" >> "{}"\n'.format(self.log_path))
+
+        os.chmod(self.pio_path, os.stat(self.pio_path).st_mode | stat.S_IEXEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.engine_dir)
+
+    def test_requests_are_coalesced(self):
+        """
+        Test method to check if requests made within the debounce window are served by a single training job
+
+        Expected behavior: The stub be called once with `build` and once with `train`, and the model version be 1
+        """
+
+        scheduler = TrainingScheduler(debounce=0.2)
+
+        with override_settings(PIO_COMMAND=self.pio_path, PIO_ENGINE_DIRS=[self.engine_dir]):
+            for i in range(5):
+                scheduler.request()
+
+            self.assertEqual(scheduler.wait(timeout=10), True)
+
+        with open(self.log_path) as log:
+            self.assertEqual(log.read().split(), ['build', 'train'])
+
+        self.assertEqual(scheduler.status()['model_version'], 1)
+        self.assertEqual(scheduler.status()['requests'], 5)
+
+    def test_training_drops_cached_recommendations(self):
+        """
+        Test method to check if a successful training drops the recommendations cached by this process and bumps the
+        shared model version stamp for the others
+
+        Expected behavior: The cached recommendations be gone and the model version stamp be newer
+        """
+
+        scheduler = TrainingScheduler(debounce=0)
+        stamp = get_version(MODEL_VERSION_KEY)
+        recommendation_cache.set(1, (stamp, ["1"]))
+
+        with override_settings(PIO_COMMAND=self.pio_path, PIO_ENGINE_DIRS=[self.engine_dir]):
+            scheduler.request()
+
+            self.assertEqual(scheduler.wait(timeout=10), True)
+
+        self.assertEqual(recommendation_cache.get(1), None)
+        self.assertNotEqual(get_version(MODEL_VERSION_KEY), stamp)
+
+    def test_training_waits_for_engine_lock(self):
+        """
+        Test method to check if a training job waits while another process holds the engine directory's lock
+
+        Expected behavior: The stub not be called while the lock is held, and be called once it is released
+        """
+
+        scheduler = TrainingScheduler(debounce=0)
+
+        with override_settings(PIO_COMMAND=self.pio_path, PIO_ENGINE_DIRS=[self.engine_dir]):
+            with EngineLock(self.engine_dir):
+                thread = threading.Thread(target=scheduler.train)
+                thread.start()
+                thread.join(0.5)
+
+                self.assertTrue(thread.is_alive())
+                self.assertFalse(os.path.exists(self.log_path))
+
+            thread.join(10)
+
+        with open(self.log_path) as log:
+            self.assertEqual(log.read().split(), ['build', 'train'])
+
+
+class FakeEventServer(HTTPServer):
+    """
+    Local stand-in for the PredictionIO event server's batch API that records the batches it receives
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            events = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            self.server.batches.append((self.path, events))
+
+            body = json.dumps([{'status': 201, 'eventId': str(i)} for i in range(len(events))]).encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), self.Handler)
+        self.batches = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class EventDispatcherTest(SimpleTestCase):
+    """
+    Class to test the batched PredictionIO event dispatcher against a local fake event server
+    """
+
+    def setUp(self):
+        self.server = FakeEventServer()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_dispatcher(self, **kwargs):
+        return EventDispatcher(
+            url=self.server.url,
+            access_keys={RECOMMENDATION: 'recommendation-key', SIMILAR: 'similar-key'},
+            **kwargs
+        )
+
+    def test_events_are_sent_in_batches(self):
+        """
+        Test method to check if queued events are sent in batches of at most `batch_size` events per access key
+
+        Expected behavior: 7 events be sent in 3 batches with the recommendation access key, and be counted as sent
+        """
+
+        dispatcher = self.get_dispatcher(batch_size=3, flush_interval=60)
+
+        for user_id in range(7):
+            dispatcher.enqueue(RECOMMENDATION, user_set_event(user_id))
+
+        self.assertEqual(dispatcher.flush(timeout=10), True)
+
+        self.assertEqual([len(events) for path, events in self.server.batches], [3, 3, 1])
+        self.assertEqual(all('accessKey=recommendation-key' in path for path, events in self.server.batches), True)
+        self.assertEqual(dispatcher.stats()['sent'], 7)
+
+    def test_overflow_drops_oldest_event(self):
+        """
+        Test method to check if a full queue drops its oldest event under the `drop_oldest` policy
+
+        Expected behavior: One event be counted as dropped and the two newest events be sent
+        """
+
+        dispatcher = self.get_dispatcher(batch_size=50, flush_interval=60, max_queue=2, overflow='drop_oldest')
+
+        for user_id in range(3):
+            dispatcher.enqueue(RECOMMENDATION, user_set_event(user_id))
+
+        dispatcher.flush(timeout=10)
+
+        self.assertEqual(dispatcher.stats()['dropped'], 1)
+        self.assertEqual([event['entityId'] for event in self.server.batches[0][1]], ['u1', 'u2'])
+
+
+class EventSpoolTest(SimpleTestCase):
+    """
+    Class to test the on-disk spool of PredictionIO events that could not be sent
+    """
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.server = FakeEventServer()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.spool_dir)
+
+    def test_failed_batches_are_spooled_and_replayed(self):
+        """
+        Test method to check if events that fail to reach the event server are spooled, then replayed compacted
+
+        Expected behavior: The duplicate event and the superseded `$set` be dropped, and the spool be empty afterwards
+        """
+
+        spool = EventSpool(directory=self.spool_dir)
+        unreachable = EventDispatcher(
+            url="http://127.0.0.1:1",
+            access_keys={RECOMMENDATION: 'recommendation-key', SIMILAR: 'similar-key'},
+            flush_interval=60,
+            timeout=1,
+            spool=spool
+        )
+
+        user_event = user_set_event(1)
+        unreachable.enqueue(RECOMMENDATION, user_event)
+        unreachable.enqueue(RECOMMENDATION, user_event)
+        unreachable.enqueue(RECOMMENDATION, item_set_event(1, 1))
+        unreachable.enqueue(RECOMMENDATION, item_set_event(1, 2))
+        unreachable.flush(timeout=10)
+
+        self.assertEqual(unreachable.stats()['spooled'], 4)
+        self.assertEqual(spool.has_pending(), True)
+
+        dispatcher = EventDispatcher(
+            url=self.server.url,
+            access_keys={RECOMMENDATION: 'recommendation-key', SIMILAR: 'similar-key'}
+        )
+        sent = spool.drain(dispatcher.send_batch)
+
+        self.assertEqual(sent, 2)
+        self.assertEqual([event['entityId'] for event in self.server.batches[0][1]], ['u1', 'i1'])
+        self.assertEqual(self.server.batches[0][1][1]['properties'], {'categories': ['cat2']})
+        self.assertEqual(spool.stats()['segments'], 0)
+
+    def test_torn_lines_are_quarantined(self):
+        """
+        Test method to check if a line torn by a crash in the middle of an append does not block the spool
+
+        Expected behavior: The valid event be sent, the torn line be moved to the quarantine file, and the spool be
+        empty afterwards
+        """
+
+        spool = EventSpool(directory=self.spool_dir)
+        spool.append(RECOMMENDATION, [user_set_event(1)])
+        spool._close()
+
+        with open(spool.segments()[0], 'a') as segment:
+            segment.write('{"app": "recommendation", "event": {"ev')
+
+        batches = []
+        sent = spool.drain(lambda app, events: batches.append(events) or [])
+
+        self.assertEqual(sent, 1)
+        self.assertEqual(spool.stats()['segments'], 0)
+        self.assertEqual(spool.stats()['quarantined'], 1)
+
+        with open(os.path.join(self.spool_dir, QUARANTINE_NAME)) as quarantine:
+            self.assertTrue(quarantine.read().startswith("undecodable\t"))
+
+    def test_rejected_events_are_not_counted_as_sent(self):
+        """
+        Test method to check if events the event server rejects are quarantined instead of counted as sent
+
+        Expected behavior: One of the two events be counted as sent and the other as rejected and quarantined
+        """
+
+        spool = EventSpool(directory=self.spool_dir)
+        spool.append(RECOMMENDATION, [user_set_event(1), item_set_event(1, 1)])
+
+        sent = spool.drain(lambda app, events: [event for event in events if event['entityType'] == 'item'])
+
+        self.assertEqual(sent, 1)
+        self.assertEqual(spool.stats()['rejected'], 1)
+        self.assertEqual(spool.stats()['quarantined'], 1)
+        self.assertEqual(spool.stats()['segments'], 0)
+
+
+@override_settings(CONDITIONAL_RESPONSES=True)
+class ConditionalResponseTest(SimpleTestCase):
+    """
+    Class to test the conditional GET responses built from version stamps
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.key = user_version_key(0)
+        self.built = 0
+        bump_version(self.key)
+
+    def build_response(self):
+        self.built += 1
+
+        return Response({'built': self.built}, status=status.HTTP_200_OK)
+
+    def test_not_modified_until_version_bump(self):
+        """
+        Test method to check if a request revalidated with the response's ETag is answered 304 until the stamp changes
+
+        Expected behavior: The response be built only for the first request and the request made after the bump
+        """
+
+        response = conditional_response(self.factory.get('/feed/'), [self.key], self.build_response)
+        etag = response['ETag']
+
+        response = conditional_response(self.factory.get('/feed/', HTTP_IF_NONE_MATCH=etag), [self.key],
+                                        self.build_response)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.built, 1)
+
+        time.sleep(0.01)
+        bump_version(self.key)
+        response = conditional_response(self.factory.get('/feed/', HTTP_IF_NONE_MATCH=etag), [self.key],
+                                        self.build_response)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.built, 2)
+
+    def test_etag_differs_between_users(self):
+        """
+        Test method to check if two users whose version stamps were bumped at once get different ETags for the same
+        path, e.g. with their tokens sent in a header
+
+        Expected behavior: The second user's request with the first user's ETag be answered with a full response
+        """
+
+        bump_user_versions(1, 2)
+        response = conditional_response(self.factory.get('/user/profile/'), [user_version_key(1)],
+                                        self.build_response)
+
+        response = conditional_response(self.factory.get('/user/profile/', HTTP_IF_NONE_MATCH=response['ETag']),
+                                        [user_version_key(2)], self.build_response)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.built, 2)
+
+    def test_if_modified_since_at_full_resolution(self):
+        """
+        Test method to check if If-Modified-Since revalidation sees a write made within the second of the stamp
+
+        Expected behavior: Last-Modified be the stamp rounded up, a request with it be answered 304, and a write made
+        in the same second as the previous stamp be answered 200
+        """
+
+        stamp = int(time.time()) - 10 + 0.3
+        cache.set(self.key, stamp, None)
+
+        response = conditional_response(self.factory.get('/feed/'), [self.key], self.build_response)
+
+        self.assertEqual(response['Last-Modified'], http_date(int(stamp) + 1))
+
+        request = self.factory.get('/feed/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        self.assertEqual(conditional_response(request, [self.key], self.build_response).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        # Dated within the same second as the stamp the client's date was rounded from
+        cache.set(self.key, stamp + 0.5, None)
+        request = self.factory.get('/feed/', HTTP_IF_MODIFIED_SINCE=http_date(int(stamp)))
+
+        self.assertEqual(conditional_response(request, [self.key], self.build_response).status_code,
+                         status.HTTP_200_OK)
+
+    def test_current_second_has_no_last_modified(self):
+        """
+        Test method to check if Last-Modified is left out while a later write could still fall within its second
+
+        Expected behavior: The response have an ETag but no Last-Modified header
+        """
+
+        cache.set(self.key, time.time() + 5, None)
+        response = conditional_response(self.factory.get('/feed/'), [self.key], self.build_response)
+
+        self.assertTrue(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_disabled_without_shared_stamps(self):
+        """
+        Test method to check if conditional responses are turned off when the stamps are not shared between processes
+
+        Expected behavior: Every request be built, with no ETag
+        """
+
+        with override_settings(CONDITIONAL_RESPONSES=False):
+            response = conditional_response(self.factory.get('/feed/', HTTP_IF_NONE_MATCH='*'), [self.key],
+                                            self.build_response)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ImagePoolTest(SimpleTestCase):
+    """
+    Class to test the worker pool that processes uploaded images
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pool = ImagePool(workers=2, max_queue=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_images_are_resized(self):
+        """
+        Test method to check if queued images are downsized to fit the maximum size, keeping their aspect ratio
+
+        Expected behavior: Every job be done, each image be 100x50, and the jobs be counted in the pool's stats
+        """
+
+        from PIL import Image
+
+        jobs = []
+
+        for i in range(5):
+            path = os.path.join(self.directory, "image{}.jpg".format(i))
+            Image.new('RGB', (400, 200), (255, 0, 0)).save(path, 'JPEG')
+            jobs.append(self.pool.submit(path, max_width=100, max_height=100))
+
+        self.assertTrue(self.pool.join(timeout=30))
+
+        for job in jobs:
+            self.assertEqual(job.status, ImageJob.DONE)
+            self.assertEqual(Image.open(job.path).size, (100, 50))
+
+        stats = self.pool.stats()
+
+        self.assertEqual(stats['processed'], 5)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_renditions_are_generated(self):
+        """
+        Test method to check if the named renditions of an image are generated next to it
+
+        Expected behavior: The avatar rendition be cropped to a square and the card rendition keep the aspect ratio
+        """
+
+        from PIL import Image
+
+        path = os.path.join(self.directory, "photo.jpg")
+        Image.new('RGB', (800, 400), (0, 0, 255)).save(path, 'JPEG')
+
+        job = self.pool.submit(path, renditions=[AVATAR, CARD])
+
+        self.assertTrue(job.wait(timeout=30))
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertEqual(Image.open(rendition_name(path, AVATAR)).size, (96, 96))
+        self.assertEqual(Image.open(rendition_name(path, CARD)).size, (400, 200))
+
+    def test_callback_is_called_once_renditions_exist(self):
+        """
+        Test method to check if a job's callback is called once its renditions were generated
+
+        Expected behavior: The callback be called once, when the rendition already exists
+        """
+
+        from PIL import Image
+
+        path = os.path.join(self.directory, "photo.jpg")
+        Image.new('RGB', (800, 400), (0, 0, 255)).save(path, 'JPEG')
+        calls = []
+
+        job = self.pool.submit(path, renditions=[AVATAR], callback=lambda job: calls.append(
+            os.path.exists(rendition_name(job.path, AVATAR))))
+
+        self.assertTrue(job.wait(timeout=30))
+        self.assertEqual(calls, [True])
+
+    def test_missing_renditions_are_remembered_briefly(self):
+        """
+        Test method to check if the storage is not checked again for a missing rendition within its short
+        time-to-live, and is checked again once it expired
+
+        Expected behavior: The original photo's URL be returned with a single storage check, then the rendition's
+        URL once it exists and its cached absence was dropped
+        """
+
+        class Storage(object):
+            def __init__(self):
+                self.names = set()
+                self.checks = 0
+
+            def exists(self, name):
+                self.checks += 1
+                return name in self.names
+
+            def url(self, name):
+                return "/media/" + name
+
+        class FieldFile(object):
+            name = "item/photo.jpg"
+            url = "/media/item/photo.jpg"
+            storage = Storage()
+
+        field_file = FieldFile()
+        existing_renditions.clear()
+
+        self.assertEqual(rendition_url(field_file, CARD), "/media/item/photo.jpg")
+        self.assertEqual(rendition_url(field_file, CARD), "/media/item/photo.jpg")
+        self.assertEqual(field_file.storage.checks, 1)
+
+        field_file.storage.names.add(rendition_name(field_file.name, CARD))
+        existing_renditions.invalidate(rendition_name(field_file.name, CARD))
+
+        self.assertEqual(rendition_url(field_file, CARD), "/media/item/photo.card.jpg")
+        self.assertEqual(rendition_url(field_file, CARD), "/media/item/photo.card.jpg")
+        self.assertEqual(field_file.storage.checks, 2)
+
+
+class DecodeBase64ImageTest(SimpleTestCase):
+    """
+    Class to test the streaming decode of base64 encoded image uploads
+    """
+
+    PNG = b'\x89PNG\r\n\x1a\n' + b'\x00'*200000
+
+    def test_image_is_decoded_in_chunks(self):
+        """
+        Test method to check if an image larger than one chunk is decoded whole, with its extension from its header
+
+        Expected behavior: The uploaded file have the original bytes, size and a `.png` name
+        """
+
+        data = "data:image/png;base64," + base64.b64encode(self.PNG).decode('ascii')
+        uploaded = decode_base64_image(data, "photo")
+
+        self.assertEqual(uploaded.name, "photo.png")
+        self.assertEqual(uploaded.size, len(self.PNG))
+        self.assertEqual(uploaded.read(), self.PNG)
+
+    def test_invalid_images_are_rejected(self):
+        """
+        Test method to check if images over the size limit and data of other formats are rejected
+
+        Expected behavior: UploadError be raised in both cases
+        """
+
+        data = base64.b64encode(self.PNG).decode('ascii')
+
+        self.assertRaises(UploadError, decode_base64_image, data, "photo", max_size=1000)
+        self.assertRaises(UploadError, decode_base64_image, base64.b64encode(b"%PDF-1.4").decode('ascii'), "doc")
+
+
+class ContentAddressedStorageTest(SimpleTestCase):
+    """
+    Class to test the storage that names files by the hash of their content
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = ContentAddressedStorage(location=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_identical_content_is_stored_once(self):
+        """
+        Test method to check if saving the same content twice under different names stores a single file
+
+        Expected behavior: Both saves return the same hash-based name, and a different content get another name
+        """
+
+        first = self.storage.save("item/photo.jpeg", ContentFile(b"same content"))
+        second = self.storage.save("item/other.jpg", ContentFile(b"same content"))
+        third = self.storage.save("item/photo.jpg", ContentFile(b"other content"))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+        self.assertTrue(first.startswith("item/") and first.endswith(".jpg"))
+        self.assertEqual(self.storage.open(first).read(), b"same content")
+        self.assertEqual(os.listdir(os.path.join(self.directory, UPLOAD_DIRECTORY)), [])
+
+    def test_processed_content_is_named_by_its_final_hash(self):
+        """
+        Test method to check if content processed before it is saved is named by the hash of what is stored
+
+        Expected behavior: The name hash the processed bytes, which are the bytes stored
+        """
+
+        def process(path):
+            with open(path, 'wb') as upload:
+                upload.write(b"processed content")
+
+        upload = self.storage.upload(ContentFile(b"raw content"), "item/photo.jpg", process=process)
+        name = self.storage.save("item/photo.jpg", upload)
+
+        self.assertIn(hashlib.sha256(b"processed content").hexdigest(), name)
+        self.assertEqual(self.storage.open(name).read(), b"processed content")
+
+    def test_deduplicated_save_refreshes_the_stored_file(self):
+        """
+        Test method to check if saving content that is already stored refreshes the modification time of its file
+
+        Expected behavior: The file be newer than the garbage collection cutoff, and the upload be removed
+        """
+
+        name = self.storage.save("item/photo.jpg", ContentFile(b"same content"))
+        os.utime(self.storage.path(name), (0, 0))
+
+        upload = self.storage.upload(ContentFile(b"same content"), "item/other.jpg")
+
+        self.assertEqual(self.storage.save("item/other.jpg", upload), name)
+        self.assertTrue(upload.deduplicated)
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), time.time() - 60)
+        self.assertEqual(os.listdir(os.path.join(self.directory, UPLOAD_DIRECTORY)), [])
+
+
+class PushQueueTest(SimpleTestCase):
+    """
+    Class to test the batched APNS push queue against a local fake APNS endpoint
+    """
+
+    def setUp(self):
+        self.server = FakeAPNSServer(invalid_tokens=["ff"*32])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_notifications_are_sent_over_one_connection(self):
+        """
+        Test method to check if queued notifications are written in batches over a single persistent connection
+
+        Expected behavior: Every notification be received with its badge and extra keys, over one connection
+        """
+
+        queue = PushQueue(batch_size=100, flush_interval=60, connect=self.server.connect)
+
+        for i in range(250):
+            queue.enqueue("{:064x}".format(i), "Message {}".format(i), badge=1, extra={"type": "notification"})
+
+        self.assertTrue(queue.flush(timeout=10))
+
+        stats = queue.stats()
+
+        self.assertEqual(len(self.server.notifications), 250)
+        self.assertEqual(self.server.notifications[0][1], {"aps": {"alert": "Message 0", "badge": 1},
+                                                          "type": "notification"})
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(stats['sent'], 250)
+        self.assertEqual(stats['batches'], 3)
+
+    def test_rejected_notification_is_skipped(self):
+        """
+        Test method to check if a notification rejected by APNS is dropped and the ones written after it are resent
+
+        Expected behavior: The other notifications be received over a new connection and the token be marked invalid
+        """
+
+        queue = PushQueue(batch_size=100, flush_interval=60, connect=self.server.connect)
+
+        for token in ["{:064x}".format(1), "ff"*32, "{:064x}".format(2), "{:064x}".format(3)]:
+            queue.enqueue(token, "Hello")
+
+        self.assertTrue(queue.flush(timeout=10))
+
+        stats = queue.stats()
+
+        self.assertEqual([token[-1] for token, payload in self.server.notifications], ['1', '2', '3'])
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(stats['sent'], 3)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(queue.invalid_tokens, {"ff"*32})
+
+    def test_unconfirmed_notifications_are_bounded_under_load(self):
+        """
+        Test method to check if, while the queue never runs empty, the notifications awaiting an error response are
+        capped, so that a rejected notification and then a failed connection only resend a bounded number of them
+
+        Expected behavior: At most `max_unconfirmed` plus a batch be unconfirmed or received twice, the rejected
+        token be marked invalid, and every notification be accounted for
+        """
+
+        self.server.stop()
+        self.server = FakeAPNSServer(invalid_tokens=["ff"*32], drop_after=2500)
+        queue = PushQueue(batch_size=100, flush_interval=60, max_unconfirmed=200, backoff=0,
+                          connect=self.server.connect)
+        tokens = ["{:064x}".format(i) for i in range(3000)]
+        tokens[1000] = "ff"*32
+
+        for token in tokens:
+            queue.enqueue(token, "Hello")
+
+        self.assertTrue(queue.flush(timeout=30))
+
+        stats = queue.stats()
+        received = [token for token, payload in self.server.notifications]
+
+        self.assertLessEqual(stats['unconfirmed_max'], 300)
+        self.assertLessEqual(len(received) - len(set(received)), 300)
+        self.assertNotIn("ff"*32, received)
+        self.assertEqual(queue.invalid_tokens, {"ff"*32})
+        self.assertEqual(stats['sent'] + stats['failed'] + stats['dropped'], 3000)
+
+
+class PushCoalescerTest(SimpleTestCase):
+    """
+    Class to test the coalescing and rate limiting of push notifications per recipient
+    """
+
+    class Queue(object):
+        def __init__(self):
+            self.pushes = []
+
+        def enqueue_many(self, registration_ids, alert, badge=None, extra=None):
+            self.pushes.append((tuple(registration_ids), alert, badge, extra))
+
+            return len(registration_ids)
+
+    def setUp(self):
+        self.queue = self.Queue()
+
+    def test_burst_is_merged_into_summary(self):
+        """
+        Test method to check if notifications submitted while a recipient's window is open are merged
+
+        Expected behavior: The first message be pushed at once and the next four as one summary with the latest
+        thread and badge, while the other recipient's message be pushed on its own
+        """
+
+        coalescer = PushCoalescer(window=0.2, rate_limit=0, queue=self.queue)
+
+        for i in range(5):
+            coalescer.submit(1, ["a"], "message", "Message {}".format(i), badge=i, extra={"thread_id": i})
+
+        coalescer.submit(2, ["b"], "message", "Hello")
+
+        self.assertTrue(coalescer.join(timeout=5))
+        self.assertEqual(self.queue.pushes, [
+            (("a",), "Message 0", 0, {"thread_id": 0}),
+            (("b",), "Hello", None, None),
+            (("a",), "Message 4 (+3 more)", 4, {"thread_id": 4}),
+        ])
+
+        stats = coalescer.stats()
+
+        self.assertEqual((stats['delivered'], stats['suppressed'], stats['summaries']), (3, 3, 1))
+
+    def test_rate_limit_defers_pushes(self):
+        """
+        Test method to check if a recipient over the rate limit is not pushed to until the limit allows it
+
+        Expected behavior: The second type's notification be held, then pushed once the rate period is over
+        """
+
+        coalescer = PushCoalescer(window=5, rate_limit=1, rate_period=0.3, queue=self.queue)
+
+        self.assertTrue(coalescer.submit(1, ["a"], "message", "Message"))
+        self.assertFalse(coalescer.submit(1, ["a"], "notification", "Offer", badge=1))
+        self.assertEqual(len(self.queue.pushes), 1)
+
+        self.assertTrue(coalescer.join(timeout=5))
+        self.assertEqual(self.queue.pushes[1], (("a",), "Offer", 1, None))
+        self.assertEqual(coalescer.stats()['deferred'], 1)
+
+
+class PaginationTest(SimpleTestCase):
+    """
+    Class to test the keyset cursors and the switch between legacy and paginated list responses
+    """
+
+    Entry = namedtuple('Entry', ['id', 'date'])
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_cursor_round_trip(self):
+        """
+        Test method to check if a cursor decodes to the position it was encoded from, and malformed cursors are refused
+
+        Expected behavior: The position be equal after a round trip, and ValueError be raised for malformed cursors
+        """
+
+        date = datetime(2015, 6, 1, 12, 30, 15, 250000)
+
+        self.assertEqual(decode_cursor(encode_cursor(date, 42)), (date, 42))
+
+        for cursor in ["not a cursor", base64.urlsafe_b64encode(b"no-separator").decode('ascii'),
+                       base64.urlsafe_b64encode(b"2015-06-01T12:30:15|abc").decode('ascii'),
+                       base64.urlsafe_b64encode(b"yesterday|3").decode('ascii')]:
+            self.assertRaises(ValueError, decode_cursor, cursor)
+
+    def test_paginate_list_walks_every_page(self):
+        """
+        Test method to check if following the next cursors returns every object once, newest first
+
+        Expected behavior: Pages of 2, 2 and 1 entries, with ties on the date ordered by id, and no cursor on the last
+        """
+
+        date = datetime(2015, 6, 1)
+        entries = [self.Entry(1, date), self.Entry(2, date), self.Entry(3, date + timedelta(days=1)),
+                   self.Entry(4, date - timedelta(days=1)), self.Entry(5, date)]
+        pages = []
+        cursor = None
+
+        while True:
+            params = {'page_size': 2}
+
+            if cursor:
+                params['cursor'] = cursor
+
+            objects, cursor = paginate_list(self.factory.get('/', params), entries, lambda entry: entry.date)
+            pages.append([entry.id for entry in objects])
+
+            if cursor is None:
+                break
+
+        self.assertEqual(pages, [[3, 5], [2, 1], [4]])
+
+    def test_legacy_response_switch(self):
+        """
+        Test method to check if clients that send no cursor or page size get the legacy response shape by default
+
+        Expected behavior: Only requests with a cursor, a page size or `legacy=0` be paginated, unless the setting
+        turns pagination on by default
+        """
+
+        self.assertTrue(wants_legacy_response(self.factory.get('/')))
+        self.assertFalse(wants_legacy_response(self.factory.get('/', {'page_size': 10})))
+        self.assertFalse(wants_legacy_response(self.factory.get('/', {'cursor': 'abc'})))
+        self.assertFalse(wants_legacy_response(self.factory.get('/', {'legacy': '0'})))
+        self.assertTrue(wants_legacy_response(self.factory.get('/', {'legacy': '1', 'page_size': 10})))
+
+        with override_settings(LEGACY_LIST_RESPONSES=False):
+            self.assertFalse(wants_legacy_response(self.factory.get('/')))
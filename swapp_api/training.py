@@ -0,0 +1,199 @@
+import fcntl
+import logging
+import os
+import subprocess
+import time
+
+from django.conf import settings
+
+from swapp_api.cache import recommendation_cache
+from swapp_api.versioning import MODEL_VERSION_KEY, bump_version
+from swapp_api.workers import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENGINE_DIRS = (
+    "../../pio_files/swapp-recommendation",
+    "../../pio_files/swapp-similar-product",
+)
+
+# Lock file, in each engine directory, held while the engine is built and trained
+LOCK_FILE_NAME = ".pio-train.lock"
+
+
+class EngineLock(object):
+    """
+    Exclusive `flock` on an engine directory's lock file, so that processes with their own TrainingScheduler (e.g.
+    several gunicorn workers) never build or train the same engine at once.
+    """
+
+    def __init__(self, engine_dir):
+        self.path = os.path.join(engine_dir, LOCK_FILE_NAME)
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except Exception:
+            self._file.close()
+            raise
+
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+
+
+class TrainingScheduler(BackgroundWorker):
+    """
+    Runs `pio build` and `pio train` for every engine in a background worker thread.
+
+    Trigger requests are coalesced: the first request opens a debounce window of `debounce` seconds and every request
+    made within it is served by the same training job. At most one job runs at a time; requests made while a job runs
+    schedule exactly one more job after it. Across processes, each engine is built and trained under an EngineLock,
+    so a job waits for another process's job on the same engine to finish.
+
+    The `pio` executable and the engine directories are read from the `PIO_COMMAND`, `PIO_PATH` and `PIO_ENGINE_DIRS`
+    settings when a job starts, so tests can point them to a local stub.
+    """
+
+    IDLE = 'idle'
+    SCHEDULED = 'scheduled'
+    RUNNING = 'running'
+
+    worker_name = 'pio-training'
+
+    def __init__(self, debounce=None):
+        self.debounce = debounce if debounce is not None else getattr(settings, 'PIO_TRAIN_DEBOUNCE', 60)
+
+        self.model_version = 0
+        self.requests = 0
+        self.runs = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = None
+        self.last_error = None
+
+        super(TrainingScheduler, self).__init__()
+
+    @property
+    def state(self):
+        if self._running:
+            return self.RUNNING
+
+        return self.IDLE if self._requested_at is None else self.SCHEDULED
+
+    def request(self):
+        """
+        Asks for the models to be retrained and returns immediately.
+        """
+
+        self._check_pid()
+
+        with self._condition:
+            self.requests += 1
+
+            if self._requested_at is None:
+                self._requested_at = time.time()
+
+            self._ensure_workers()
+            self._condition.notify_all()
+
+    def status(self):
+        return self.stats()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until no job is running or scheduled. Returns False if `timeout` seconds elapsed first.
+        """
+
+        with self._condition:
+            return self._wait_until(lambda: self.state == self.IDLE, timeout)
+
+    def train(self):
+        """
+        Builds and trains every engine synchronously. Raises CalledProcessError if a `pio` command fails.
+        """
+
+        pio = getattr(settings, 'PIO_COMMAND', 'pio')
+        env = dict(os.environ)
+        pio_path = getattr(settings, 'PIO_PATH', None)
+
+        if pio_path:
+            env['PATH'] = os.pathsep.join([env.get('PATH', ''), pio_path])
+
+        for engine_dir in getattr(settings, 'PIO_ENGINE_DIRS', DEFAULT_ENGINE_DIRS):
+            with EngineLock(engine_dir):
+                for command in ('build', 'train'):
+                    subprocess.check_output([pio, command], cwd=engine_dir, env=env, stderr=subprocess.STDOUT)
+
+    def _stats(self):
+        return {
+            'state': self.state,
+            'model_version': self.model_version,
+            'requests': self.requests,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_started': self.last_started,
+            'last_finished': self.last_finished,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+        }
+
+    def _reset(self):
+        self._requested_at = None
+        self._running = False
+
+    def _run_forever(self):
+        while True:
+            with self._condition:
+                while self._requested_at is None:
+                    self._condition.wait()
+
+                # Wait out the debounce window so that further requests are coalesced into this job
+                remaining = self._requested_at + self.debounce - time.time()
+
+                while remaining > 0:
+                    self._condition.wait(remaining)
+                    remaining = self._requested_at + self.debounce - time.time()
+
+                self._requested_at = None
+                self._running = True
+                self.last_started = time.time()
+
+            error = None
+
+            try:
+                self.train()
+            except subprocess.CalledProcessError as e:
+                error = "{}: {}".format(e, e.output)
+            except Exception as e:
+                error = str(e)
+
+            with self._condition:
+                self._running = False
+                self.runs += 1
+                self.last_finished = time.time()
+                self.last_duration = self.last_finished - self.last_started
+                self.last_error = error
+
+                if error:
+                    self.failures += 1
+                    logger.error("PredictionIO training failed: {}".format(error))
+                else:
+                    self.model_version += 1
+
+                    # Recommendations cached under the previous model are now stale
+                    recommendation_cache.bump_version()
+                    bump_version(MODEL_VERSION_KEY)
+
+                self._condition.notify_all()
+
+
+training_scheduler = TrainingScheduler()
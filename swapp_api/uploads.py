@@ -0,0 +1,106 @@
+import binascii, re, tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+DEFAULT_MAX_IMAGE_UPLOAD_SIZE = 10*1024*1024
+
+# Base64 characters decoded at a time; a multiple of 4, so that every chunk decodes on its own
+CHUNK_SIZE = 64*1024
+
+# Image formats accepted in uploads: (file extension, content type, leading bytes)
+IMAGE_SIGNATURES = (
+    ('jpg', 'image/jpeg', (b'\xff\xd8\xff',)),
+    ('png', 'image/png', (b'\x89PNG\r\n\x1a\n',)),
+    ('gif', 'image/gif', (b'GIF87a', b'GIF89a')),
+)
+
+WHITESPACE = re.compile(r'\s')
+
+
+class UploadError(ValueError):
+    pass
+
+
+def max_image_upload_size():
+    return getattr(settings, 'MAX_IMAGE_UPLOAD_SIZE', DEFAULT_MAX_IMAGE_UPLOAD_SIZE)
+
+
+def detect_image_format(header):
+    """
+    Returns the (file extension, content type) of an image from its first bytes, or None if it is not a supported
+    image format.
+    """
+
+    for extension, content_type, signatures in IMAGE_SIGNATURES:
+        if any(header.startswith(signature) for signature in signatures):
+            return extension, content_type
+
+    return None
+
+
+def decode_base64_image(data, name, max_size=None):
+    """
+    Decodes a base64 encoded image into an UploadedFile backed by a spooled temporary file, which stays in memory up
+    to FILE_UPLOAD_MAX_MEMORY_SIZE bytes and moves to disk beyond that. `name` is the file name without extension.
+
+    The data is decoded chunk by chunk, so the decoded image is never held in memory next to the base64 string. The
+    size limit is checked from the length of the string before anything is decoded, and the format is detected from
+    the first chunk. Raises UploadError if the data is too large, malformed or not a supported image.
+    """
+
+    max_size = max_size or max_image_upload_size()
+
+    # Header of the "data:image/png;base64,..." format
+    if data.startswith('data:') and ';base64,' in data[:100]:
+        data = data[data.index(';base64,') + len(';base64,'):]
+
+    if WHITESPACE.search(data):
+        data = WHITESPACE.sub('', data)
+
+    if len(data) // 4 * 3 - data[-2:].count('=') > max_size:
+        raise UploadError("Image is larger than {} bytes".format(max_size))
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=getattr(settings, 'FILE_UPLOAD_MAX_MEMORY_SIZE', 2621440))
+    image_format = None
+
+    try:
+        for start in range(0, len(data), CHUNK_SIZE):
+            chunk = binascii.a2b_base64(data[start:start + CHUNK_SIZE])
+
+            if image_format is None:
+                image_format = detect_image_format(chunk)
+
+                if image_format is None:
+                    raise UploadError("Unsupported image format")
+
+            spooled.write(chunk)
+    except (binascii.Error, TypeError):
+        spooled.close()
+        raise UploadError("Invalid base64 data")
+    except UploadError:
+        spooled.close()
+        raise
+
+    if image_format is None:
+        raise UploadError("Empty image")
+
+    extension, content_type = image_format
+    size = spooled.tell()
+    spooled.seek(0)
+
+    return UploadedFile(spooled, name="{}.{}".format(name, extension), content_type=content_type, size=size)
+
+
+def request_data(request):
+    """
+    Returns a mutable copy of the request's data that includes its uploaded files, so that views accept both JSON
+    bodies with base64 encoded images and multipart forms with the images uploaded as files.
+    """
+
+    data = request.DATA.copy()
+
+    for name, uploaded_file in request.FILES.items():
+        data[name] = uploaded_file
+
+    return data
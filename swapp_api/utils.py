@@ -1,55 +1,51 @@
-import subprocess
+from swapp_api.coalescing import push_coalescer
+from swapp_api.devices import deactivate_devices, user_devices
+from swapp_api.push import push_queue
 
-from os.path import splitext
-
-from push_notifications.apns import (
-    APNSDataOverflow,
-    APNSError,
-    APNSServerError
-)
-from push_notifications.models import APNSDevice
 
+def send_push_notification(user, notification, type, obj_id, badge_count=0):
+    """
+    Utility function to queue Push Notifications for the APNS, to every
+    active device of the user. Bursts to the same user and type are merged
+    into summary pushes by the push coalescer, and the pushes are sent by
+    the push queue's background worker instead of on the request thread.
+    """
 
-def resize_image(image_path, width, height):
-    cmd = "mogrify %s -resize %sx%s %s" % (image_path, width, height, image_path)
+    # Devices APNS rejected since the last notification are not sent to again
+    invalid_tokens = push_queue.pop_invalid_tokens()
 
-    subprocess.Popen(cmd, shell=True)
+    if invalid_tokens:
+        deactivate_devices(invalid_tokens)
 
-def optimize_image(path):
-    run_string = {
-        ".jpeg": u"jpegoptim -f --strip-all '%(file)s'",
-        ".jpg": u"jpegoptim -f --strip-all '%(file)s'",
-        ".png": u"optipng -force -o7 '%(file)s' && advpng -z4 '%(file)s' \
-                && pngcrush -rem gAMA -rem alla -rem cHRM -rem iCCP \
-                -rem sRGB -rem time '%(file)s' '%(file)s.bak' && mv '%(file)s.bak' '%(file)s'"
-    }
+    registration_ids = user_devices(user.id)
 
-    ext = splitext(path)[1].lower()
+    if registration_ids:
+        notif_type_id_key = "thread_id" if type == "message" else "notification_id"
 
-    if ext in run_string:
-        cmd = run_string[ext] % {'file': path}
+        # Badge if notification is about an offer
+        push_coalescer.submit(user.id,
+                              registration_ids,
+                              type,
+                              notification,
+                              badge=badge_count if type == "notification" else None,
+                              extra={"type": type, notif_type_id_key: obj_id})
 
-        subprocess.Popen(cmd, shell=True)
 
-def send_push_notification(user, notification, type, obj_id, badge_count=0):
+def chunked_rows(queryset, fields, chunk_size):
     """
-    Utility function to send Push Notifications to the APNS using the
-    `django-push-notifications` package.
+    Yields `values_list` rows of a queryset in primary key order, fetching `chunk_size` rows per query so that memory
+    use does not depend on the size of the table.
     """
 
-    try:
-        device = APNSDevice.objects.get(user=user)
-        notif_type_id_key = "thread_id" if type == "message" else "notification_id"
+    last_id = 0
+
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', *fields)[:chunk_size])
+
+        for row in rows:
+            yield row
+
+        if len(rows) < chunk_size:
+            break
 
-        try:
-            # Badge if notification is about an offer
-            if type == "notification":
-                device.send_message(notification,
-                                    badge=badge_count,
-                                    extra={"type": type, notif_type_id_key: obj_id})
-            else:
-                device.send_message(notification, extra={"type": type, notif_type_id_key: obj_id})
-        except (APNSDataOverflow, APNSError, APNSServerError):
-            pass
-    except APNSDevice.DoesNotExist:
-        pass
+        last_id = rows[-1][0]
@@ -0,0 +1,176 @@
+import hashlib, math, time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.http import http_date, parse_http_date_safe
+
+from rest_framework import status
+from rest_framework.response import Response
+
+USER_VERSION_KEY = "swapp:version:user:{}"
+CATALOG_VERSION_KEY = "swapp:version:catalog"
+MODEL_VERSION_KEY = "swapp:version:model"
+TAXONOMY_VERSION_KEY = "swapp:version:taxonomy"
+
+
+def stamps_are_shared():
+    """
+    Checks if version stamps can answer conditional requests and key process-level caches: they must live in a
+    cache shared by every process, or a write in one process would leave the others answering 304 or serving their
+    cached data, both stale. `CONDITIONAL_RESPONSES` forces them on (e.g. for a single-process deployment) or off;
+    by default they are off with a process-local cache.
+    """
+
+    enabled = getattr(settings, 'CONDITIONAL_RESPONSES', None)
+
+    if enabled is not None:
+        return enabled
+
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def get_version(key):
+    """
+    Returns the version stamp stored in the shared cache under `key`, creating it if needed.
+
+    Stamps are the time of the last write they track, so they double as Last-Modified dates.
+    """
+
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, time.time(), None)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_version(key):
+    cache.set(key, time.time(), None)
+
+
+def user_version_key(user_id):
+    return USER_VERSION_KEY.format(user_id)
+
+
+def bump_user_versions(*user_ids):
+    now = time.time()
+    cache.set_many(dict((user_version_key(user_id), now) for user_id in set(user_ids) if user_id), None)
+
+
+def make_etag(*parts):
+    return '"{}"'.format(hashlib.md5("|".join(str(part) for part in parts).encode('utf-8')).hexdigest())
+
+
+def is_not_modified(request, etag, last_modified):
+    """
+    Checks the request's If-None-Match header against `etag`, or, without it, If-Modified-Since against
+    `last_modified` (a timestamp), at full resolution so that a write made after a whole-second date is never
+    mistaken for an older one.
+    """
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    if if_none_match:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def conditional_response(request, version_keys, build_response):
+    """
+    Answers a GET with `304 Not Modified` if the client's copy is as recent as the version stamps in `version_keys`;
+    otherwise returns `build_response()` with ETag and Last-Modified headers.
+
+    The stamps are read before the response is built, so a write made while building it can only cause an
+    unnecessary refetch on the next poll, never a stale 304. Last-Modified is the latest stamp rounded up to the
+    second, and is only sent once that second is over, so that no later write can fall within it. Without shared
+    stamps (see `stamps_are_shared`) the response is always built.
+    """
+
+    if not stamps_are_shared():
+        return build_response()
+
+    versions = cache.get_many(version_keys)
+    versions = [versions[key] if key in versions else get_version(key) for key in version_keys]
+
+    # The keys tell apart responses at the same path for different users, e.g. with the token in a header, whose
+    # stamps can be equal since writes bump every user they involve at once
+    etag = make_etag(request.get_full_path(), *(list(version_keys) + versions))
+    last_modified = max(versions)
+
+    if is_not_modified(request, etag, last_modified):
+        response = Response(None, status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = build_response()
+
+        if response.status_code != status.HTTP_200_OK:
+            return response
+
+    response['ETag'] = etag
+
+    if time.time() >= math.ceil(last_modified):
+        response['Last-Modified'] = http_date(math.ceil(last_modified))
+
+    return response
+
+
+# Signal Method(s)
+def bump_item_versions(sender, instance, **kwargs):
+    """
+    After saving or deleting an item, marks its owner's data and the item catalog as modified.
+    """
+
+    bump_user_versions(instance.owner_id)
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def bump_photo_versions(sender, instance, **kwargs):
+    """
+    After the renditions of an item or profile photo are generated, marks its owner's data and the item catalog,
+    which shows items with their owners' avatars, as modified.
+    """
+
+    bump_user_versions(getattr(instance, 'owner_id', None) or instance.user_id)
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def bump_user_version(sender, instance, **kwargs):
+    """
+    After saving a model that belongs to a single user (User, UserProfile or Preference), marks that user's data as
+    modified.
+    """
+
+    # Changes made from the category side of Preference.categories cannot be traced to a user cheaply
+    if kwargs.get('reverse'):
+        return
+
+    bump_user_versions(getattr(instance, 'user_id', instance.pk))
+
+
+def bump_transaction_versions(sender, instance, **kwargs):
+    """
+    After saving or deleting a transaction, marks the data of the owners of both items as modified.
+    """
+
+    try:
+        bump_user_versions(instance.item1.owner_id, instance.item2.owner_id)
+    except ObjectDoesNotExist:
+        pass
+
+
+def bump_notification_versions(sender, instance, **kwargs):
+    bump_user_versions(instance.recipient_id, instance.action_from_id)
+
+
+def bump_conversation_versions(sender, instance, **kwargs):
+    """
+    After saving or deleting a thread or message, marks the data of its sender and receiver as modified.
+    """
+
+    bump_user_versions(instance.sender_id, instance.receiver_id)
@@ -0,0 +1,77 @@
+import os, threading, time
+
+
+class BackgroundWorker(object):
+    """
+    Base of the objects that do their work in daemon threads: a queue, pool or scheduler whose state is guarded by
+    one `threading.Condition`, shared by the callers and the worker threads.
+
+    Subclasses implement `_run_forever`, the body of each worker thread, and `_reset`, which sets up the state that
+    only makes sense in the process that created it (queues, connections). Worker threads are started on first use
+    by `_ensure_workers`, and a process forked from the one that started them starts over with a new condition, no
+    threads and a fresh state once it calls `_check_pid`.
+    """
+
+    worker_name = 'worker'
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._threads = []
+        self._pid = os.getpid()
+        self._reset()
+
+    def stats(self):
+        with self._condition:
+            return self._stats()
+
+    def _stats(self):
+        """
+        Returns the counters reported by `stats`, which calls it with the condition held.
+        """
+
+        return {}
+
+    def _reset(self):
+        pass
+
+    def _run_forever(self):
+        raise NotImplementedError
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # Threads do not survive a fork, and the parent's lock may have been held at fork time
+            self._condition = threading.Condition()
+            self._threads = []
+            self._pid = os.getpid()
+            self._reset()
+
+    def _ensure_workers(self, count=1):
+        """
+        Starts worker threads until `count` of them are alive. Must be called with the condition held.
+        """
+
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+
+        for i in range(count - len(self._threads)):
+            thread = threading.Thread(target=self._run_forever, name=self.worker_name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _wait_until(self, predicate, timeout=None):
+        """
+        Waits on the condition, which must be held, until `predicate()` is true. Returns False if `timeout` seconds
+        elapsed first.
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        while not predicate():
+            remaining = None if deadline is None else deadline - time.time()
+
+            if remaining is not None and remaining <= 0:
+                return False
+
+            self._condition.wait(remaining)
+
+        return True
@@ -1,10 +1,13 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 from item.models import Item
+from swapp_api.images import AVATAR, CARD, rendition_url
+from swapp_api.versioning import bump_notification_versions, bump_transaction_versions
 
 
 optional = {
@@ -34,10 +37,10 @@ class Transaction(models.Model):
         return {
             "item_1": self.item1.name,
             "item_1_owner_id": self.item1.owner.id,
-            "item_1_photo": "" if not self.item1.photo else  self.item1.photo.url,
+            "item_1_photo": rendition_url(self.item1.photo, CARD),
             "item_2": self.item2.name,
             "item_2_owner_id": self.item2.owner.id,
-            "item_2_photo": "" if not self.item2.photo else  self.item2.photo.url,
+            "item_2_photo": rendition_url(self.item2.photo, CARD),
             "date_approved": self.date_approved
         }
 
@@ -140,8 +143,8 @@ class Notification(models.Model):
             "is_read": self.is_read,
             "item_id": self.transaction.item1.id,
             "other_item_id": self.transaction.item2.id,
-            "item_photo": "" if not self.transaction.item1.photo else self.transaction.item1.photo.url,
-            "other_item_photo": "" if not self.transaction.item2.photo else self.transaction.item2.photo.url,
+            "item_photo": rendition_url(self.transaction.item1.photo, AVATAR),
+            "other_item_photo": rendition_url(self.transaction.item2.photo, AVATAR),
             "is_valid_transaction": self.transaction.is_valid
         }
 
@@ -150,3 +153,10 @@ class Notification(models.Model):
             self.notification = "offered a Swapp with you."
 
         return super(Notification, self).save()
+
+
+# Register the signal
+post_save.connect(bump_transaction_versions, sender=Transaction)
+post_delete.connect(bump_transaction_versions, sender=Transaction)
+post_save.connect(bump_notification_versions, sender=Notification)
+post_delete.connect(bump_notification_versions, sender=Notification)
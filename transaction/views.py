@@ -11,10 +11,13 @@ from rest_framework.views import APIView
 
 from item.models import Item
 from message.models import Thread
-from swapp_api.authentication import BasicAuthentication
+from swapp_api.authentication import BasicAuthentication, authenticated
+from swapp_api.images import DETAIL
+from swapp_api.pagination import paginate_queryset, wants_legacy_response
 from swapp_api.permissions import IsAuthenticated
 from swapp_api.predictionio_api import PIOEvent, train_system
 from swapp_api.utils import send_push_notification
+from swapp_api.versioning import conditional_response, user_version_key
 from transaction.models import Notification, Transaction
 from transaction.serializers import TransactionSerializer
 
@@ -26,20 +29,35 @@ class NotificationList(APIView):
 
     def get(self, request, **kwargs):
         try:
-            token = AccessToken.objects.get(token=kwargs.get('identifier'))
-            user = token.user
+            user = authenticated(request, kwargs.get('identifier')).user
 
-            sorted_notifications = sorted(
-                [notif.to_dict() for notif in user.notifications_received.all()],
-                key=lambda n: n['date'],
-                reverse=True
-            )
-            notifications_data = {'notifications': sorted_notifications}
-
-            return Response(notifications_data, status.HTTP_200_OK)
+            return conditional_response(
+                request,
+                [user_version_key(user.id)],
+                lambda: self.get_notifications(request, user))
         except Exception as e:
             return Response("Error: {}".format(e), status.HTTP_400_BAD_REQUEST)
 
+    def get_notifications(self, request, user):
+        notifications = user.notifications_received.select_related(
+            'action_from',
+            'transaction__item1',
+            'transaction__item2'
+        )
+
+        if wants_legacy_response(request):
+            notifications_data = {
+                'notifications': [notif.to_dict() for notif in notifications.order_by('-date_created', '-id')]
+            }
+        else:
+            notifications, next_cursor = paginate_queryset(request, notifications, 'date_created')
+            notifications_data = {
+                'notifications': [notif.to_dict() for notif in notifications],
+                'next_cursor': next_cursor
+            }
+
+        return Response(notifications_data, status.HTTP_200_OK)
+
 
 class NotificationView(APIView):
     authentication_classes = (BasicAuthentication,)
@@ -62,16 +80,13 @@ class NotificationDetail(APIView):
 
     def get(self, request, **kwargs):
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = identifier.split(' ')[1] if identifier else request.GET.get('identifier')
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
+            user = authenticated(request).user
 
             try:
                 notification = Notification.objects.get(id=int(kwargs.get('pk')))
                 notification_data = {
                     'notification': notification.to_dict(),
-                    'item': notification.transaction.item1.to_dict()
+                    'item': Item.bulk_to_dict([notification.transaction.item1_id], DETAIL)[0]
                 }
 
                 return Response(notification_data, status=status.HTTP_200_OK)
@@ -92,10 +107,7 @@ class NotificationAction(APIView):
         """
 
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = identifier.split(' ')[1] if identifier else request.GET.get('identifier')
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
+            user = authenticated(request).user
 
             data = request.DATA
             action = data.get('action')
@@ -182,9 +194,7 @@ class TransactionDetail(APIView):
         """
 
         try:
-            identifier = kwargs.get('identifier')
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
+            user = authenticated(request, kwargs.get('identifier')).user
             pio = PIOEvent()
             is_new_transaction = False
 
@@ -256,10 +266,7 @@ class SwappingHistory(APIView):
         """
 
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = identifier.split(' ')[1] if identifier else request.GET.get('identifier')
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
+            user = authenticated(request).user
 
             # Retrieve associated transactions to user
             user_transactions = Transaction.get_approved_user_transactions(user)
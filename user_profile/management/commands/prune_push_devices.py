@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from swapp_api.devices import deactivate_devices
+
+
+class Command(BaseCommand):
+    help = ("Deactivates the APNS devices that the APNS feedback service reports as no longer reachable, e.g. after "
+            "the app was uninstalled, so that notifications are no longer fanned out to them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="List the inactive tokens without deactivating their devices")
+
+    def handle(self, *args, **options):
+        from push_notifications.apns import apns_fetch_inactive_ids
+
+        inactive_ids = [registration_id.decode('ascii') if isinstance(registration_id, bytes) else registration_id
+                        for registration_id in apns_fetch_inactive_ids()]
+
+        if options['dry_run']:
+            for registration_id in inactive_ids:
+                self.stdout.write("Would deactivate {}".format(registration_id))
+
+            return
+
+        self.stdout.write("APNS reported {} inactive token(s); deactivated {} device(s)".format(
+            len(inactive_ids), deactivate_devices(inactive_ids)))
@@ -2,14 +2,21 @@ import logging
 
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 from cities_light.models import City
+from oauth2_provider.models import AccessToken
+from push_notifications.models import APNSDevice
 
+from swapp_api.authentication import invalidate_token, invalidate_user_tokens
+from swapp_api.devices import invalidate_device
 from swapp_api.fields import AutoResizeImageField
+from swapp_api.images import renditions_generated
 from swapp_api.pio_event import PIOEvent
+from swapp_api.storage import content_storage
+from swapp_api.versioning import bump_photo_versions, bump_user_version
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +34,7 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, related_name='profile')
     location = models.CharField(max_length=50, **optional)
     phone = models.CharField(max_length=50, **optional)
-    photo = AutoResizeImageField(upload_to = "profile/", max_length = 500, **optional)
+    photo = AutoResizeImageField(upload_to = "profile/", max_length = 500, storage=content_storage, **optional)
     date_registered = models.DateTimeField(default=timezone.now)
     last_login = models.DateTimeField(default=timezone.now)
     current_latitude = models.DecimalField(max_digits=11, decimal_places=8, **optional)
@@ -108,3 +115,15 @@ def set_user_password(sender, instance, **kwargs):
 post_save.connect(create_user_profile, sender=User)
 post_save.connect(create_user_preference, sender=User)
 pre_save.connect(set_user_password, sender=User)
+post_save.connect(bump_user_version, sender=User)
+post_save.connect(bump_user_version, sender=UserProfile)
+post_save.connect(bump_user_version, sender=Preference)
+renditions_generated.connect(bump_photo_versions, sender=UserProfile)
+m2m_changed.connect(bump_user_version, sender=Preference.categories.through)
+post_save.connect(invalidate_token, sender=AccessToken)
+post_delete.connect(invalidate_token, sender=AccessToken)
+
+post_delete.connect(invalidate_user_tokens, sender=User)
+
+post_save.connect(invalidate_device, sender=APNSDevice)
+post_delete.connect(invalidate_device, sender=APNSDevice)
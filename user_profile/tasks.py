@@ -1,6 +1,6 @@
-from django.shortcuts import get_object_or_404
+from django.http import Http404
 
-from item.models import Category, Subcategory, Item
+from item.models import Category, Item
 from swapp_api.predictionio_api import PIOEvent
 from user_profile.models import Preference
 
@@ -9,6 +9,9 @@ def set_user_preference(user, categories=[]):
     """
     Function that sets the user preference of the user
 
+    Only categories that were not already preferred generate events, so setting the same preferences again sends
+    nothing to PredictionIO.
+
     Args:
         user: the current user (object)
         categories: list of Category IDs of the user's preferences (list of integers)
@@ -17,11 +20,22 @@ def set_user_preference(user, categories=[]):
         None
     """
     preference, created = Preference.objects.get_or_create(user=user)
-    pio = PIOEvent()
+    category_ids = set(int(cat) for cat in categories)
+    selected_categories = list(Category.objects.filter(id__in=category_ids))
+
+    if len(selected_categories) != len(category_ids):
+        raise Http404("No Category matches the given query.")
+
+    previous_ids = set(preference.categories.values_list('id', flat=True))
     preference.categories.clear()
-    for cat in categories:
-        category = get_object_or_404(Category, id=int(cat))
-        preference.categories.add(category)
-        for subcategory in Subcategory.objects.filter(parent_category=category):
-            for item in Item.objects.filter(subcategory=subcategory).exclude(owner=user):
-                pio.item_on_category(user, item)
\ No newline at end of file
+    preference.categories.add(*selected_categories)
+
+    added_ids = category_ids - previous_ids
+
+    if added_ids:
+        item_ids = (Item.objects.filter(subcategory__parent_category__in=added_ids)
+                                .exclude(owner=user)
+                                .values_list('id', flat=True)
+                                .iterator())
+
+        PIOEvent().items_on_category(user, item_ids)
@@ -9,6 +9,13 @@ from django.test.client import Client
 from cities_light.models import City, Country
 from oauth2_provider.models import AccessToken, Application
 
+from item.models import Category
+from swapp_api.authentication import resolve_token, token_cache
+from swapp_api.devices import deactivate_devices, register_device, user_devices
+from swapp_api.pio_event import PIOEvent
+from user_profile.models import Preference
+from user_profile.tasks import set_user_preference
+
 
 class UserTest(LiveServerTestCase):
     """
@@ -124,6 +131,92 @@ class UserTest(LiveServerTestCase):
 
         self.assertEqual(response.status_code, 401)
 
+    def test_resolve_token_cache(self):
+        """
+        Test method to check if an access token is resolved from the token cache until it is revoked, while its user
+        and profile are always loaded fresh
+
+        Expected behavior: A cached token be resolved with a single query, with its profile attached to its user, a
+        profile edit be seen at once, and a deleted token not be resolved anymore
+        """
+
+        access_token = AccessToken.objects.get(user=self.user)
+        token_cache.clear()
+        resolve_token(access_token.token)
+
+        with self.assertNumQueries(1):
+            resolved = resolve_token(access_token.token)
+            profile = resolved.user.profile
+
+        self.assertEqual(resolved.user, self.user)
+        self.assertEqual(profile, resolved.profile)
+
+        profile.distance_range = profile.distance_range + 10
+        profile.save()
+
+        self.assertEqual(resolve_token(access_token.token).profile.distance_range, profile.distance_range)
+
+        access_token.delete()
+
+        self.assertRaises(AccessToken.DoesNotExist, resolve_token, access_token.token)
+
+    def test_device_registry(self):
+        """
+        Test method to check if device tokens are registered to the user who last logged in on them, and if the
+        cached devices of both users follow the changes
+
+        Expected behavior: The device move from the first to the second user, and a deactivated device not be listed
+        """
+
+        other_user = User.objects.create(username='otheruser', password='otherpassword')
+        first_token, second_token = "{:064x}".format(1), "{:064x}".format(2)
+
+        register_device(self.user, first_token)
+        register_device(self.user, second_token)
+
+        self.assertEqual(user_devices(self.user.id), (first_token, second_token))
+
+        with self.assertNumQueries(0):
+            user_devices(self.user.id)
+
+        register_device(other_user, second_token)
+
+        self.assertEqual(user_devices(self.user.id), (first_token,))
+        self.assertEqual(user_devices(other_user.id), (second_token,))
+
+        deactivate_devices([first_token])
+
+        self.assertEqual(user_devices(self.user.id), ())
+
+    def test_set_user_preference_is_idempotent(self):
+        """
+        Test method to check if setting the same preferences twice leaves the same preference state, and only sends
+        events to PredictionIO for the first call
+
+        Expected behavior: The user have one Preference with the two categories after both calls, and the items of
+        the categories be rated once
+        """
+
+        categories = [Category.objects.create(name='Sports Apparel'), Category.objects.create(name='Gadgets')]
+        category_ids = [category.id for category in categories]
+        rated = []
+        items_on_category = PIOEvent.items_on_category
+        PIOEvent.items_on_category = lambda pio, user, item_ids: rated.append(list(item_ids))
+
+        try:
+            set_user_preference(self.user, category_ids)
+            self.assertEqual(len(rated), 1)
+
+            set_user_preference(self.user, category_ids)
+            self.assertEqual(len(rated), 1)
+        finally:
+            PIOEvent.items_on_category = items_on_category
+
+        preferences = Preference.objects.filter(user=self.user)
+
+        self.assertEqual(preferences.count(), 1)
+        self.assertEqual(sorted(preferences[0].categories.values_list('id', flat=True)), sorted(category_ids))
+
     def test_change_password_200(self):
         """
         Test method to check if the endpoint for Change Password correctly modifies the user's password.
@@ -2,13 +2,13 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django.http import Http404
 
-from push_notifications.models import APNSDevice
 from oauth2_provider.models import AccessToken
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from item.models import Category, Subcategory
+from item.models import Item
+from item.taxonomy import taxonomy
 from user_profile.models import (
     Preference,
     UserProfile
@@ -18,9 +18,13 @@ from user_profile.serializers import (
     UserSerializer,
     UserProfileSerializer
 )
-from swapp_api.authentication import BasicAuthentication
+from swapp_api.authentication import BasicAuthentication, authenticated
+from swapp_api.devices import register_device
+from swapp_api.images import CARD, rendition_url
 from swapp_api.permissions import IsAuthenticated
 from swapp_api.predictionio_api import PIOEvent, train_system
+from swapp_api.uploads import request_data
+from swapp_api.versioning import TAXONOMY_VERSION_KEY, conditional_response, user_version_key
 
 
 # User
@@ -45,40 +49,41 @@ class UserProfileDetail(APIView):
         """
 
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
-            profile = UserProfile.objects.get(user=user)
-
-            preferences = user.preferences.first()
-            preference_list = []
-
-            if preferences:
-                categories = [category.name for category in Category.objects.all().order_by('name')]
-
-                for i in range(len(categories)):
-                    if preferences.categories.filter(name=categories[i]).exists():
-                        preference_list.append(i)
-                        
-            user_info = {
-                'id': user.id,
-                'name': user.get_full_name(),
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-                'phone': "" if not profile.phone else profile.phone,
-                'address': "" if not user.profile else str(user.profile.location),
-                'items': [item.to_dict() for item in user.items.filter(is_available=True)],
-                'image': "" if not user.profile.photo else user.profile.photo.url,
-                'subcategories': [subcategory.name for subcategory in Subcategory.objects.all()],
-                'range': profile.distance_range,
-                'preferences': preference_list,
-            }
+            user = authenticated(request).user
 
-            return Response(user_info, status.HTTP_200_OK)
+            return conditional_response(
+                request,
+                [user_version_key(user.id), TAXONOMY_VERSION_KEY],
+                lambda: self.get_profile(user))
         except Exception, e:
             return Response("Error: {}".format(e), status.HTTP_400_BAD_REQUEST)
 
+    def get_profile(self, user):
+        profile = user.profile
+
+        preferences = user.preferences.first()
+        preference_list = []
+
+        if preferences:
+            preferred = set(preferences.categories.values_list('id', flat=True))
+            preference_list = [i for i, category_id in enumerate(taxonomy.category_ids()) if category_id in preferred]
+
+        user_info = {
+            'id': user.id,
+            'name': user.get_full_name(),
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'phone': "" if not profile.phone else profile.phone,
+            'address': "" if not user.profile else str(user.profile.location),
+            'items': Item.bulk_to_dict(user.items.filter(is_available=True)),
+            'image': rendition_url(user.profile.photo, CARD),
+            'subcategories': taxonomy.subcategory_names(),
+            'range': profile.distance_range,
+            'preferences': preference_list,
+        }
+
+        return Response(user_info, status.HTTP_200_OK)
+
 
 class EditUserProfileView(APIView):
     """
@@ -93,7 +98,7 @@ class EditUserProfileView(APIView):
         POST request to change user profile fields
         """
         try:
-            data = request.DATA
+            data = request_data(request)
             user = User.objects.get(id=int(data.get('id')))
             profile = UserProfile.objects.get(user=user)
 
@@ -111,10 +116,7 @@ class EditUserProfileView(APIView):
                 profile_serializer = UserProfileSerializer(profile, data=profile_data)
 
                 if profile_serializer.is_valid():
-                    # Deletes first its previous image to save server storage space
-                    if profile.photo:
-                        profile.photo.delete(False)
-
+                    # The previous image is left to `collect_media_garbage`, as other objects may share it
                     user.save()
                     profile_serializer.save()
                 else:
@@ -144,7 +146,7 @@ class SignupView(APIView):
         POST request to create a new User and UserProfile
         """
 
-        data = request.DATA
+        data = request_data(request)
         serializer = UserSerializer(data=data)
 
         if serializer.is_valid():
@@ -156,11 +158,8 @@ class SignupView(APIView):
             profile = UserProfile.objects.get(user=user)
             
 
-            if device_token != "none":
-                apns_device, created = APNSDevice.objects.get_or_create(registration_id=device_token)
-                apns_device.user = user
-
-                apns_device.save()
+            if device_token and device_token != "none":
+                register_device(user, device_token)
 
             if data.get('photo'):
                 profile_data = {
@@ -237,13 +236,12 @@ class ChangeUserLocation(APIView):
 
         try:
             data = request.DATA
-            token = AccessToken.objects.get(token=kwargs.get('identifier'))
-            user = UserProfile.objects.get(user=token.user)
+            user = authenticated(request, kwargs.get('identifier')).user.profile
 
             user.current_latitude = data.get('latitude')
             user.current_longitude = data.get('longitude')
             user.location = data.get('location')
-            user.save()
+            user.save(update_fields=['current_latitude', 'current_longitude', 'location'])
 
             return Response("Test", status=status.HTTP_200_OK)
         except Exception as e:
@@ -260,27 +258,13 @@ class StoreDeviceTokenView(APIView):
 
     def post(self, request, **kwargs):
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
+            user = authenticated(request).user
 
             # Update APNS device token of currently logged-in user (For cases that user has logged in to another device)
             device_token = request.DATA.get('device_token')
 
-            try:
-                # Checks first if user is already registered for notifications.
-                apns_device = APNSDevice.objects.get(user=user, registration_id=device_token)
-            except APNSDevice.DoesNotExist:
-                try:
-                    # Checks if device token has already been registered
-                    apns_device, created = APNSDevice.objects.get_or_create(registration_id=device_token)
-
-                    if created or apns_device.user != user:
-                        apns_device.user = user
-                        apns_device.save()
-                except:
-                    pass
+            if device_token and device_token != "none":
+                register_device(user, device_token)
 
             return Response(None, status=status.HTTP_200_OK)
         except Exception, e:
@@ -317,7 +301,7 @@ class ChangePreferencesView(APIView):
 
             preference_list = data.get('preferences')
             preferences, created = Preference.objects.get_or_create(user=user)
-            categories = [category for category in Category.objects.all().order_by('name')]
+            categories = taxonomy.category_ids()
 
             try:
                 preferences.categories.clear()
@@ -340,19 +324,11 @@ class PreferenceList(APIView):
 
     def get(self, request, **kwargs):
         try:
-            identifier = request.META.get('HTTP_AUTHORIZATION')
-            identifier = request.GET.get('identifier') if not identifier else identifier.split(' ')[1]
-            token = AccessToken.objects.get(token=identifier)
-            user = token.user
-
-            preferences = Preference.objects.get_or_create(user=user)
-            categories = [category.name for category in Category.objects.all().order_by('name')]
+            user = authenticated(request).user
 
-            preference_list = []
-
-            for i in range(len(categories)):
-                if preferences.categories.filter(name=categories[i]).exists():
-                    preference_list.append(i)
+            preferences, created = Preference.objects.get_or_create(user=user)
+            preferred = set(preferences.categories.values_list('id', flat=True))
+            preference_list = [i for i, category_id in enumerate(taxonomy.category_ids()) if category_id in preferred]
 
             result_text = {'preference_list': preference_list}
 